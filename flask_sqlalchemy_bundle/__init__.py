@@ -11,12 +11,14 @@
 __version__ = '0.3.1'
 
 
+import click
+
 from flask_unchained import Bundle
 
 from .alembic import MaterializedViewMigration
 from .base_model import BaseModel
 from .base_query import BaseQuery
-from .decorators import param_converter
+from .decorators import Many, param_converter
 from .extensions import SQLAlchemy, db
 from .model_form import ModelForm
 from .services import ModelManager, SessionManager
@@ -32,3 +34,17 @@ class FlaskSQLAlchemyBundle(Bundle):
     def after_init_app(cls, app):
         from .meta.model_registry import _model_registry
         _model_registry.finalize_mappings()
+
+        # CLI commands (other than the development server) don't get a worker
+        if (app.config.get('SQLALCHEMY_MATERIALIZED_VIEW_REFRESH_WORKER')
+                and not _in_cli_command()):
+            from .commands import make_refresh_worker
+            worker = make_refresh_worker(app)
+            if worker.views:
+                worker.start()
+            app.extensions['materialized_view_refresh_worker'] = worker
+
+
+def _in_cli_command():
+    ctx = click.get_current_context(silent=True)
+    return ctx is not None and ctx.info_name != 'run'
@@ -1 +1,4 @@
+from .incremental_view import PopulateIncrementalViewOp
 from .materialized_view import MaterializedViewMigration
+from .online_ops import (BackfillOp, CreateIndexConcurrentlyOp,
+                         DropIndexConcurrentlyOp)
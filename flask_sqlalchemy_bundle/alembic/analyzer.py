@@ -0,0 +1,257 @@
+"""
+Static analysis of the lock impact of pending migrations.
+
+The ``upgrade()`` functions of the pending revisions get run against an
+:class:`~alembic.operations.Operations` object that records the operations
+they invoke instead of executing them. Every recorded operation then gets
+classified by the (PostgreSQL) lock level it takes and by its risk:
+
+- ``'low'``: only briefly locks the table (or doesn't lock it at all)
+- ``'medium'``: blocks writes (or reads) while scanning the table, or can't be
+  analyzed (eg raw SQL)
+- ``'high'``: rewrites the table while holding an ``ACCESS EXCLUSIVE`` lock
+
+When row count estimates of the tables are available, operations that scan or
+rewrite a table are considered ``'high'`` risk on tables with at least
+``large_table_rows`` rows, and ``'low'`` risk on smaller tables.
+"""
+import re
+
+from alembic.migration import MigrationContext
+from alembic.operations import BatchOperations, Operations, ops
+from collections import namedtuple
+from contextlib import contextmanager
+from sqlalchemy import text
+from typing import *
+
+from .materialized_view import (CreateMaterializedViewOp, DropMaterializedViewOp,
+                                SwapMaterializedViewOp)
+from .online_ops import (BackfillOp, CreateIndexConcurrentlyOp,
+                         DropIndexConcurrentlyOp)
+
+
+RISK_LEVELS = ('low', 'medium', 'high')
+
+
+class OperationImpact:
+    """
+    :param revision: The revision id invoking the operation.
+    :param operation: The operation (or None if the revision couldn't be
+                      analyzed).
+    :param description: A short description of the operation.
+    :param lock: The (PostgreSQL) lock level the operation takes, if any.
+    :param risk: One of ``'low'``, ``'medium'`` or ``'high'``.
+    :param reason: Why the operation was classified as it was.
+    :param table_name: The name of the table the operation affects.
+    :param rows: The estimated number of rows in the table (if known).
+    """
+    def __init__(self, revision: str, operation, description: str,
+                 lock: Optional[str], risk: str, reason: str,
+                 table_name: Optional[str] = None, rows: Optional[int] = None):
+        self.revision = revision
+        self.operation = operation
+        self.description = description
+        self.lock = lock
+        self.risk = risk
+        self.reason = reason
+        self.table_name = table_name
+        self.rows = rows
+
+    def exceeds(self, threshold: str) -> bool:
+        """Whether this impact's risk is at or above the given threshold"""
+        return RISK_LEVELS.index(self.risk) >= RISK_LEVELS.index(threshold)
+
+    def __repr__(self):
+        return f'<OperationImpact {self.revision} {self.description!r} ' \
+               f'risk={self.risk!r}>'
+
+
+def get_pending_revisions(script, current_heads=()) -> List[Any]:
+    """
+    Get the revisions between the current heads and the script's heads
+    (ordered from oldest to newest)
+    """
+    return list(reversed(list(script.iterate_revisions(
+        'heads', tuple(current_heads) or 'base'))))
+
+
+def collect_operations(script, revision, dialect_name: str) -> List[Any]:
+    """
+    Run the revision's ``upgrade()`` function, recording (but not executing)
+    the operations it invokes (including those of ``batch_alter_table`` blocks)
+    """
+    context = MigrationContext.configure(
+        dialect_name=dialect_name, opts={'as_sql': True, 'script': script})
+    recorded = []
+
+    @contextmanager
+    def batch_alter_table(table_name, schema=None, **kwargs):
+        batch = BatchOperations(context, impl=_BatchTable(table_name, schema))
+        batch.invoke = recorded.append
+        batch.get_bind = _no_bind
+        yield batch
+
+    with Operations.context(context) as operations:
+        operations.invoke = recorded.append
+        operations.get_bind = _no_bind
+        operations.batch_alter_table = batch_alter_table
+        revision.module.upgrade()
+    return recorded
+
+
+# what the operations of batch_alter_table blocks need to know of their table
+_BatchTable = namedtuple('_BatchTable', ['table_name', 'schema'])
+
+
+def _no_bind():
+    raise RuntimeError('revisions using the connection cannot be analyzed')
+
+
+def analyze_revisions(script, revisions, dialect_name: str,
+                      table_rows: Optional[Dict[str, int]] = None,
+                      large_table_rows: int = 100000) -> List[OperationImpact]:
+    """
+    Classify the operations of the given revisions by their lock impact
+    """
+    impacts = []
+    for revision in revisions:
+        try:
+            operations = collect_operations(script, revision, dialect_name)
+        except Exception as e:
+            impacts.append(OperationImpact(
+                revision.revision, None, 'upgrade()', None, 'medium',
+                f'could not be analyzed ({e.__class__.__name__}: {e})'))
+            continue
+
+        for operation in operations:
+            impacts.append(classify_operation(revision.revision, operation,
+                                              table_rows, large_table_rows))
+    return impacts
+
+
+def classify_operation(revision: str, operation,
+                       table_rows: Optional[Dict[str, int]] = None,
+                       large_table_rows: int = 100000) -> OperationImpact:
+    table_name = _get_table_name(operation)
+    lock, risk, reason, scans = _classify(operation)
+
+    rows = None
+    if table_rows is not None and table_name in table_rows:
+        rows = table_rows[table_name]
+        if scans:
+            risk = 'high' if rows >= large_table_rows else 'low'
+
+    return OperationImpact(revision, operation, _describe(operation, table_name),
+                           lock, risk, reason, table_name, rows)
+
+
+def get_table_row_estimates(conn) -> Dict[str, int]:
+    """
+    Get the planner's row count estimates of all tables (and materialized
+    views) in the current search path (only on PostgreSQL). Tables that have
+    never been analyzed (``reltuples`` is -1, or 0 before PostgreSQL 14) are
+    left out, as their size is unknown.
+    """
+    if conn.dialect.name != 'postgresql':
+        return {}
+    return {name: int(rows) for name, rows in conn.execute(text("""
+        SELECT c.relname, c.reltuples
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE c.relkind IN ('r', 'm', 'p')
+          AND n.nspname = ANY(current_schemas(false))
+          AND c.reltuples > 0
+    """))}
+
+
+def _classify(op) -> Tuple[Optional[str], str, str, bool]:
+    """
+    Get the lock level, base risk, reason and whether the operation scans
+    (or rewrites) the table
+    """
+    if isinstance(op, ops.AddColumnOp):
+        column = op.column
+        if not column.nullable and column.server_default is not None:
+            return ('ACCESS EXCLUSIVE', 'high',
+                    'adding a NOT NULL column with a default rewrites the table '
+                    '(before PostgreSQL 11)', True)
+        elif not column.nullable:
+            return ('ACCESS EXCLUSIVE', 'high',
+                    'adding a NOT NULL column without a default fails on '
+                    'tables with rows', False)
+        return 'ACCESS EXCLUSIVE', 'low', 'adding a nullable column', False
+
+    elif isinstance(op, ops.AlterColumnOp):
+        if op.modify_type is not None:
+            return ('ACCESS EXCLUSIVE', 'high',
+                    'changing a column type (usually) rewrites the table', True)
+        elif op.modify_nullable is False:
+            return ('ACCESS EXCLUSIVE', 'medium',
+                    'setting NOT NULL scans the table', True)
+        return 'ACCESS EXCLUSIVE', 'low', 'altering column metadata', False
+
+    elif isinstance(op, (CreateIndexConcurrentlyOp, DropIndexConcurrentlyOp)):
+        return ('SHARE UPDATE EXCLUSIVE', 'low',
+                'does not block reads or writes', False)
+
+    elif isinstance(op, ops.CreateIndexOp):
+        if op.kw.get('postgresql_concurrently'):
+            return ('SHARE UPDATE EXCLUSIVE', 'low',
+                    'does not block reads or writes', False)
+        return ('SHARE', 'medium',
+                'a non-concurrent index build blocks writes', True)
+
+    elif isinstance(op, ops.CreateForeignKeyOp):
+        return ('SHARE ROW EXCLUSIVE', 'medium',
+                'validating a foreign key scans the table and blocks writes',
+                True)
+
+    elif isinstance(op, (ops.CreateUniqueConstraintOp,
+                         ops.CreateCheckConstraintOp)):
+        return ('ACCESS EXCLUSIVE', 'medium',
+                'adding a constraint scans the table', True)
+
+    elif isinstance(op, BackfillOp):
+        return 'ROW EXCLUSIVE', 'low', 'updates committed in chunks', False
+
+    elif isinstance(op, ops.ExecuteSQLOp):
+        return None, 'medium', 'raw SQL cannot be analyzed', False
+
+    elif isinstance(op, SwapMaterializedViewOp):
+        return ('ACCESS EXCLUSIVE', 'low',
+                'builds the new version before swapping it in', False)
+
+    elif isinstance(op, CreateMaterializedViewOp):
+        return ('ACCESS EXCLUSIVE', 'medium',
+                'creating a materialized view scans its parent tables', False)
+
+    elif isinstance(op, ops.CreateTableOp):
+        return None, 'low', 'creating a table', False
+
+    elif isinstance(op, (ops.DropColumnOp, ops.DropIndexOp, ops.DropTableOp,
+                         ops.DropConstraintOp, ops.RenameTableOp,
+                         DropMaterializedViewOp)):
+        return 'ACCESS EXCLUSIVE', 'low', 'only briefly locks the table', False
+
+    return None, 'low', 'no known lock impact', False
+
+
+def _get_table_name(op):
+    if isinstance(op, (CreateMaterializedViewOp, DropMaterializedViewOp,
+                       SwapMaterializedViewOp)):
+        return op.target.name
+    return getattr(op, 'table_name', None) or getattr(op, 'source_table', None)
+
+
+def _describe(op, table_name):
+    if isinstance(op, ops.AddColumnOp):
+        return f'add_column {table_name}.{op.column.name}'
+    elif isinstance(op, ops.AlterColumnOp):
+        return f'alter_column {table_name}.{op.column_name}'
+    elif isinstance(op, ops.ExecuteSQLOp):
+        return 'execute'
+
+    name = re.sub(r'(?<!^)(?=[A-Z])', '_', op.__class__.__name__).lower()
+    if name.endswith('_op'):
+        name = name[:-3]
+    return f'{name} {table_name or ""}'.rstrip()
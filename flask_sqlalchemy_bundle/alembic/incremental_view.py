@@ -0,0 +1,46 @@
+from alembic.autogenerate import comparators
+from alembic.operations.ops import CreateTableOp, ExecuteSQLOp
+
+# the summary tables of incrementally maintained views (see
+# flask_sqlalchemy_bundle.sqla.incremental_view) are regular tables, which get
+# populated by db.create_all(), but not when they get created by a migration.
+# so autogenerate renders a statement populating them after their creation
+
+
+class PopulateIncrementalViewOp(ExecuteSQLOp):
+    """
+    Populate the summary table of an incrementally maintained view (rendered
+    as a plain ``op.execute`` of the ``INSERT INTO ... SELECT`` statement)
+    """
+    def __init__(self, table_name, sqltext):
+        super().__init__(sqltext)
+        self.table_name = table_name
+
+    def reverse(self):
+        return ExecuteSQLOp(f'DELETE FROM {self.table_name}')
+
+
+@comparators.dispatch_for('schema')
+def compare_incremental_views(autogen_context, upgrade_ops, schemas):
+    metadata = autogen_context.metadata
+    if metadata is None:
+        return
+
+    # populate them last, after their parent tables have been created
+    for op in list(upgrade_ops.ops):
+        if not isinstance(op, CreateTableOp):
+            continue
+        key = f'{op.schema}.{op.table_name}' if op.schema else op.table_name
+        table = metadata.tables.get(key)
+        plan = table is not None and table.info.get('incremental_view_plan')
+        if plan:
+            upgrade_ops.ops.append(PopulateIncrementalViewOp(
+                op.table_name, _get_populate_sql(plan, autogen_context.dialect)))
+
+
+def _get_populate_sql(plan, dialect):
+    stmt = plan.table.insert().from_select(
+        [column.name for column in plan.selectable.inner_columns],
+        plan.selectable)
+    return str(stmt.compile(dialect=dialect,
+                            compile_kwargs={'literal_binds': True}))
@@ -1,8 +1,12 @@
+import hashlib
+
 from alembic.autogenerate import comparators, renderers
-from alembic.operations import Operations
+from alembic.operations import MigrateOperation, Operations
+from sqlalchemy import text
 from sqlalchemy.dialects.postgresql.base import PGInspector
 
 from .reversible_op import ReversibleOp
+from .revision_index import RevisionIndex
 
 # relevant docs
 # http://alembic.zzzcomputing.com/en/latest/cookbook.html#replaceable-objects
@@ -32,9 +36,10 @@ class MaterializedViewMigration:
         # metadata thinks. maybe it's a bug in the create_materialized_view
         # factory method?
         columns = tuple(c['name'] for c in self.columns)
-        indexes = tuple(tuple((k, isinstance(v, list) and tuple(v) or v)
-                              for k, v in index.items())
-                        for index in self.indexes)
+        indexes = tuple(sorted(
+            tuple((k, isinstance(v, list) and tuple(v) or v)
+                  for k, v in sorted(index.items()))
+            for index in self.indexes))
         return hash((self.name, columns, indexes))
 
     def __repr__(self):
@@ -59,6 +64,43 @@ class DropMaterializedViewOp(ReversibleOp):
         return CreateMaterializedViewOp(self.target)
 
 
+@Operations.register_operation("swap_sql", "swap")
+class SwapMaterializedViewOp(MigrateOperation):
+    """
+    Replace the ``old`` version of a materialized view with its ``target``
+    version without dropping the view readers are using first:
+
+    - the new version gets created under a temporary name (optionally ``WITH
+      NO DATA``, in which case it gets populated after its indexes are built)
+    - the old version gets renamed out of the way, the new version gets
+      renamed into place (along with its indexes), and the old one gets dropped
+
+    Readers only ever block on the final renames (and the drop). To keep that
+    window short, run migrations using this op with ``transaction_per_migration``
+    enabled (and don't combine it with other slow operations in one revision).
+    """
+    def __init__(self, target, old, with_no_data=False):
+        self.target = target
+        self.old = old
+        self.with_no_data = with_no_data
+
+    @classmethod
+    def swap(cls, operations, target, replaces=None, replace_with=None,
+             with_no_data=False):
+        if replaces:
+            old = ReversibleOp._get_object_from_version(operations, replaces)
+            op = cls(target, old, with_no_data)
+        elif replace_with:
+            new = ReversibleOp._get_object_from_version(operations, replace_with)
+            op = cls(new, target, with_no_data)
+        else:
+            raise TypeError("replaces or replace_with is required")
+        return operations.invoke(op)
+
+    def reverse(self):
+        return SwapMaterializedViewOp(self.old, self.target, self.with_no_data)
+
+
 @renderers.dispatch_for(CreateMaterializedViewOp)
 def render_create_sql(autogen_context, op):
     autogen_context.imports.add('import flask_sqlalchemy_bundle')
@@ -67,18 +109,27 @@ def render_create_sql(autogen_context, op):
         f'{op.target.name} = flask_sqlalchemy_bundle.{op.target}')
 
     if op.target.prev:
-        return f'op.replace_sql({op.target.name}, replaces={op.target.prev!r})'
+        replace = _get_replace_op(autogen_context)
+        return f'op.{replace}({op.target.name}, replaces={op.target.prev!r})'
     return f'op.create_sql({op.target.name})'
 
 
 @renderers.dispatch_for(DropMaterializedViewOp)
 def render_drop_sql(autogen_context, op):
     if op.target.prev:
-        return f'op.replace_sql({op.target.name}, ' \
+        replace = _get_replace_op(autogen_context)
+        return f'op.{replace}({op.target.name}, ' \
                f'replace_with={op.target.prev!r})'
     return f'op.drop_sql({op.target.name})'
 
 
+def _get_replace_op(autogen_context):
+    # enable the build-and-swap strategy for replacing materialized views by
+    # setting ALEMBIC_CONTEXT['materialized_view_swap'] = True in your config
+    opts = autogen_context.migration_context.opts
+    return opts.get('materialized_view_swap') and 'swap_sql' or 'replace_sql'
+
+
 @Operations.implementation_for(CreateMaterializedViewOp)
 def create_sql(operations, operation):
     operations.execute(operation.target.create_sql)
@@ -97,6 +148,57 @@ def drop_sql(operations, operation):
     operations.execute(operation.target.drop_sql)
 
 
+@Operations.implementation_for(SwapMaterializedViewOp)
+def swap_sql(operations, operation):
+    new, old = operation.target, operation.old
+    new_name = _get_swap_name(new.name, '__swap_new')
+    old_name = _get_swap_name(old.name, '__swap_old')
+
+    prefix = f'CREATE MATERIALIZED VIEW {new.name} '
+    if not new.create_sql.lstrip().startswith(prefix):
+        raise ValueError(f'Unexpected create_sql for {new.name}: '
+                         f'{new.create_sql!r}')
+    create_sql = new.create_sql.lstrip().replace(
+        prefix, f'CREATE MATERIALIZED VIEW {new_name} ', 1)
+    if operation.with_no_data:
+        create_sql = f'{create_sql.rstrip().rstrip(";")} WITH NO DATA'
+
+    # build the new version next to the old one
+    operations.execute(create_sql)
+    for idx in new.indexes:
+        operations.create_index(operations.f(_get_swap_name(idx['name'],
+                                                            '__swap_new')),
+                                new_name,
+                                idx['column_names'],
+                                unique=idx['unique'])
+    if operation.with_no_data:
+        operations.execute(f'REFRESH MATERIALIZED VIEW {new_name}')
+
+    # and swap them
+    operations.execute(f'ALTER MATERIALIZED VIEW {old.name} RENAME TO {old_name}')
+    operations.execute(f'ALTER MATERIALIZED VIEW {new_name} RENAME TO {new.name}')
+    operations.execute(f'DROP MATERIALIZED VIEW {old_name}')
+    for idx in new.indexes:
+        swap_name = _get_swap_name(idx['name'], '__swap_new')
+        operations.execute(f'ALTER INDEX {swap_name} RENAME TO {idx["name"]}')
+
+
+# postgres silently truncates longer identifiers
+_MAX_IDENTIFIER_LENGTH = 63
+
+
+def _get_swap_name(name, suffix):
+    """
+    Get the temporary name of a view (or index) while swapping it, shortening
+    (and disambiguating with a hash) names that would otherwise be too long
+    """
+    if len(name) + len(suffix) <= _MAX_IDENTIFIER_LENGTH:
+        return f'{name}{suffix}'
+    digest = hashlib.md5(name.encode()).hexdigest()[:8]
+    prefix = name[:_MAX_IDENTIFIER_LENGTH - len(suffix) - len(digest) - 1]
+    return f'{prefix}_{digest}{suffix}'
+
+
 def create_replaceable_sql_for_existing(name, inspector, schema=None):
     query = inspector.get_view_definition(name, schema)
     columns = inspector.get_columns(name, schema)
@@ -104,6 +206,69 @@ def create_replaceable_sql_for_existing(name, inspector, schema=None):
     return _create_replaceable_sql(name, query, columns, indexes)
 
 
+def reflect_replaceable_sql_for_existing(inspector, schemas):
+    """
+    Like :func:`create_replaceable_sql_for_existing`, but for all of the
+    materialized views in the given schemas, using a few bulk queries of the
+    postgres catalog (instead of three queries per view)
+    """
+    schemas = [schema or inspector.default_schema_name for schema in schemas]
+    conn = inspector.bind
+
+    queries, columns, indexes = {}, {}, {}
+    for schema, name, query in conn.execute(_VIEW_DEFINITIONS_SQL,
+                                            schemas=schemas):
+        queries[(schema, name)] = query
+    for schema, name, column, type_, not_null in conn.execute(
+            _VIEW_COLUMNS_SQL, schemas=schemas):
+        columns.setdefault((schema, name), []).append(
+            {'name': column, 'type': type_, 'nullable': not not_null})
+    for schema, name, index, unique, column_names in conn.execute(
+            _VIEW_INDEXES_SQL, schemas=schemas):
+        indexes.setdefault((schema, name), []).append(
+            {'name': index, 'unique': unique, 'column_names': column_names})
+
+    return [_create_replaceable_sql(name, query,
+                                    columns.get((schema, name), []),
+                                    indexes.get((schema, name), []))
+            for (schema, name), query in queries.items()]
+
+
+_VIEW_DEFINITIONS_SQL = text("""
+    SELECT n.nspname, c.relname, pg_get_viewdef(c.oid)
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE c.relkind = 'm' AND n.nspname = ANY(:schemas)
+    ORDER BY c.oid
+""")
+
+_VIEW_COLUMNS_SQL = text("""
+    SELECT n.nspname, c.relname, a.attname,
+           format_type(a.atttypid, a.atttypmod), a.attnotnull
+    FROM pg_attribute a
+    JOIN pg_class c ON c.oid = a.attrelid
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE c.relkind = 'm' AND n.nspname = ANY(:schemas)
+      AND a.attnum > 0 AND NOT a.attisdropped
+    ORDER BY n.nspname, c.relname, a.attnum
+""")
+
+_VIEW_INDEXES_SQL = text("""
+    SELECT n.nspname, t.relname, i.relname, ix.indisunique,
+           ARRAY(SELECT a.attname
+                 FROM unnest(ix.indkey) WITH ORDINALITY AS k(attnum, ord)
+                 JOIN pg_attribute a ON a.attrelid = t.oid
+                                    AND a.attnum = k.attnum
+                 ORDER BY k.ord)
+    FROM pg_index ix
+    JOIN pg_class i ON i.oid = ix.indexrelid
+    JOIN pg_class t ON t.oid = ix.indrelid
+    JOIN pg_namespace n ON n.oid = t.relnamespace
+    WHERE t.relkind = 'm' AND n.nspname = ANY(:schemas)
+    ORDER BY n.nspname, t.relname, i.relname
+""")
+
+
 def create_replaceable_sql_for_new(name, selectable, metadata):
     query = selectable.compile(compile_kwargs={'literal_binds': True})
     table = metadata.info['materialized_tables'][name]
@@ -143,12 +308,8 @@ def compare_views(autogen_context, upgrade_ops, schemas):
     prev_revision = autogen_context.migration_context.get_current_revision()
 
     # existing views (inspect their representation from the db)
-    views = set()
-    view_names = set()
-    for schema in schemas:
-        for name in inspector.get_view_names(include='materialized', schema=schema):
-            views.add(create_replaceable_sql_for_existing(name, inspector, schema))
-            view_names.add(name)
+    views = set(reflect_replaceable_sql_for_existing(inspector, schemas))
+    view_names = {view.name for view in views}
 
     # current metadata views (get their representation from current metadata)
     metadata_views = set()
@@ -164,10 +325,20 @@ def compare_views(autogen_context, upgrade_ops, schemas):
     for replaceable_sql in creates:
         name = replaceable_sql.name
         if name in upgrades:
-            replaceable_sql.prev = f'{prev_revision}.{name}'
+            replaceable_sql.prev = _get_prev(autogen_context, name, prev_revision)
         upgrade_ops.ops.append(CreateMaterializedViewOp(replaceable_sql))
 
     for replaceable_sql in drops:
         if replaceable_sql.name in upgrades:
             continue
         upgrade_ops.ops.append(DropMaterializedViewOp(replaceable_sql))
+
+
+def _get_prev(autogen_context, name, prev_revision):
+    # the current revision isn't necessarily the one that defined the view
+    script = autogen_context.migration_context.script
+    found = script and prev_revision and \
+        RevisionIndex.for_script(script).find(name, before=prev_revision)
+    if found:
+        return '.'.join(found)
+    return f'{prev_revision}.{name}'
@@ -0,0 +1,190 @@
+"""
+Migration operations that don't lock hot tables for the duration of a
+migration:
+
+- ``op.create_index_concurrently`` / ``op.drop_index_concurrently``: build (or
+  drop) indexes with ``CONCURRENTLY`` on PostgreSQL (plain indexes elsewhere)
+- ``op.backfill``: update the rows of a table in primary key range chunks,
+  each committed separately, optionally sleeping between chunks
+
+On PostgreSQL, both commit the migration's transaction first and run outside
+of it (in an alembic ``autocommit_block``), because ``CREATE INDEX CONCURRENTLY`` cannot run in
+a transaction block, and because committing every chunk is the point of a
+backfill. Any operations preceding them in the same revision therefore get
+committed early, so it's best to put them in revisions of their own.
+"""
+import time
+
+from alembic import util
+from alembic.operations import MigrateOperation, Operations
+from contextlib import contextmanager
+from sqlalchemy import Column, and_, func, select, text
+from sqlalchemy.types import NullType
+
+
+@Operations.register_operation('create_index_concurrently')
+class CreateIndexConcurrentlyOp(MigrateOperation):
+    def __init__(self, index_name, table_name, columns, schema=None,
+                 unique=False, **kw):
+        self.index_name = index_name
+        self.table_name = table_name
+        self.columns = columns
+        self.schema = schema
+        self.unique = unique
+        self.kw = kw
+
+    @classmethod
+    def create_index_concurrently(cls, operations, index_name, table_name,
+                                  columns, schema=None, unique=False, **kw):
+        return operations.invoke(cls(index_name, table_name, columns,
+                                     schema=schema, unique=unique, **kw))
+
+    def reverse(self):
+        return DropIndexConcurrentlyOp(self.index_name, self.table_name,
+                                       columns=self.columns, schema=self.schema,
+                                       unique=self.unique, **self.kw)
+
+
+@Operations.register_operation('drop_index_concurrently')
+class DropIndexConcurrentlyOp(MigrateOperation):
+    def __init__(self, index_name, table_name=None, columns=None, schema=None,
+                 unique=False, **kw):
+        self.index_name = index_name
+        self.table_name = table_name
+        self.columns = columns
+        self.schema = schema
+        self.unique = unique
+        self.kw = kw
+
+    @classmethod
+    def drop_index_concurrently(cls, operations, index_name, table_name=None,
+                                schema=None, **kw):
+        return operations.invoke(cls(index_name, table_name,
+                                     schema=schema, **kw))
+
+    def reverse(self):
+        if self.columns is None:
+            raise ValueError('operation is not reversible; '
+                             'original index columns are not present')
+        return CreateIndexConcurrentlyOp(self.index_name, self.table_name,
+                                         self.columns, schema=self.schema,
+                                         unique=self.unique, **self.kw)
+
+
+@Operations.register_operation('backfill')
+class BackfillOp(MigrateOperation):
+    """
+    :param table_name: The table to update.
+    :param set_: A dictionary of column names to the values (or SQL
+                 expressions, eg ``sa.text('price * 100')``) to set.
+    :param where: An optional condition (a string of SQL or a SQL expression)
+                  limiting which rows get updated.
+    :param revert: The ``set_`` values for reversing the backfill (by default,
+                   the backfilled columns get set to NULL). The reverse
+                   backfill uses the same ``where`` condition, so only the
+                   rows it still matches get reverted.
+    :param pk: The name of the table's (integer) primary key column.
+    :param batch_size: The size of the primary key ranges to update at a time.
+    :param sleep: The number of seconds to sleep between chunks.
+    """
+    def __init__(self, table_name, set_, where=None, revert=None, pk='id',
+                 batch_size=1000, sleep=0, schema=None):
+        self.table_name = table_name
+        self.set_ = set_
+        self.where = where
+        self.revert = revert
+        self.pk = pk
+        self.batch_size = batch_size
+        self.sleep = sleep
+        self.schema = schema
+
+    @classmethod
+    def backfill(cls, operations, table_name, set_, where=None, revert=None,
+                 pk='id', batch_size=1000, sleep=0, schema=None):
+        return operations.invoke(cls(table_name, set_, where=where,
+                                     revert=revert, pk=pk,
+                                     batch_size=batch_size, sleep=sleep,
+                                     schema=schema))
+
+    def reverse(self):
+        revert = self.revert or {column: None for column in self.set_}
+        return BackfillOp(self.table_name, revert, where=self.where,
+                          revert=self.set_, pk=self.pk, batch_size=self.batch_size,
+                          sleep=self.sleep, schema=self.schema)
+
+
+@Operations.implementation_for(CreateIndexConcurrentlyOp)
+def create_index_concurrently(operations, operation):
+    with _outside_transaction(operations):
+        operations.create_index(operation.index_name,
+                                operation.table_name,
+                                operation.columns,
+                                schema=operation.schema,
+                                unique=operation.unique,
+                                postgresql_concurrently=True,
+                                **operation.kw)
+
+
+@Operations.implementation_for(DropIndexConcurrentlyOp)
+def drop_index_concurrently(operations, operation):
+    with _outside_transaction(operations):
+        operations.drop_index(operation.index_name,
+                              table_name=operation.table_name,
+                              schema=operation.schema,
+                              postgresql_concurrently=True,
+                              **operation.kw)
+
+
+@Operations.implementation_for(BackfillOp)
+def backfill(operations, operation):
+    table = operations.schema_obj.table(
+        operation.table_name,
+        *[Column(name, NullType) for name in {operation.pk, *operation.set_}],
+        schema=operation.schema)
+    pk = table.c[operation.pk]
+    where = operation.where
+    if isinstance(where, str):
+        where = text(where)
+
+    def update(*clauses):
+        clauses = [clause for clause in (*clauses, where) if clause is not None]
+        stmt = table.update().values(**operation.set_)
+        return stmt.where(and_(*clauses)) if clauses else stmt
+
+    if operations.get_context().as_sql:
+        operations.execute(update())  # no data to chunk by in offline mode
+        return
+
+    with _outside_transaction(operations):
+        conn = operations.get_bind()
+        query = select([func.min(pk), func.max(pk)])
+        if where is not None:
+            query = query.where(where)
+        lo, hi = conn.execute(query).first()
+        if lo is None:
+            util.msg(f'Backfill of {operation.table_name}: no rows to update')
+            return
+
+        updated = 0
+        for start in range(lo, hi + 1, operation.batch_size):
+            end = min(start + operation.batch_size, hi + 1)
+            updated += conn.execute(update(pk >= start, pk < end)).rowcount
+            util.msg(f'Backfill of {operation.table_name}: '
+                     f'{operation.pk} {start}-{end - 1} of {lo}-{hi} '
+                     f'({updated} rows updated)')
+            if operation.sleep and end <= hi:
+                time.sleep(operation.sleep)
+
+
+@contextmanager
+def _outside_transaction(operations):
+    """
+    Commit the migration's transaction, and run the operations in the block in
+    autocommit mode (on PostgreSQL, elsewhere this does nothing)
+    """
+    context = operations.get_context()
+    if context.dialect.name != 'postgresql':
+        yield
+    else:
+        with context.autocommit_block():
+            yield
@@ -1,5 +1,7 @@
 from alembic.operations import MigrateOperation
 
+from .revision_index import RevisionIndex
+
 
 # http://alembic.zzzcomputing.com/en/latest/cookbook.html#replaceable-objects
 class ReversibleOp(MigrateOperation):
@@ -16,11 +18,8 @@ class ReversibleOp(MigrateOperation):
 
     @classmethod
     def _get_object_from_version(cls, operations, ident):
-        version, objname = ident.split(".")
-
-        module = operations.get_context().script.get_revision(version).module
-        obj = getattr(module, objname)
-        return obj
+        script = operations.get_context().script
+        return RevisionIndex.for_script(script).get_object(ident)
 
     @classmethod
     def replace(cls, operations, target, replaces=None, replace_with=None):
@@ -0,0 +1,114 @@
+"""
+An index of the reversible objects (eg :class:`MaterializedViewMigration`)
+defined by the revisions of a migrations directory, mapping the name of every
+object to the revisions that define it (and the module attribute names they
+define it as), so the revision defining (a previous version of) an object can
+be looked up by the object's name.
+
+The index gets built (in memory) once per
+:class:`~alembic.script.ScriptDirectory`, from the revision modules alembic
+already imported.
+"""
+import weakref
+
+from alembic.script import ScriptDirectory
+from typing import *
+
+
+_indexes = weakref.WeakKeyDictionary()
+
+
+class RevisionIndex:
+    """
+    :param script: The script directory the index is for.
+    :param revisions: A dictionary of revision ids to ``{attr_name: obj_name}``
+                      dictionaries of the reversible objects they define.
+    """
+    def __init__(self, script: ScriptDirectory,
+                 revisions: Dict[str, Dict[str, str]]):
+        self.script = script
+        self.revisions = revisions
+        self._objects = {}
+
+        # from base to head(s)
+        self._order = [rev.revision
+                       for rev in reversed(list(script.walk_revisions()))]
+        self.names = {}
+        for revision in self._order:
+            for attr, name in sorted(revisions.get(revision, {}).items()):
+                self.names.setdefault(name, []).append((revision, attr))
+
+    @classmethod
+    def for_script(cls, script: ScriptDirectory) -> 'RevisionIndex':
+        """
+        Get the (cached) index for the given script directory
+        """
+        index = _indexes.get(script)
+        if index is None:
+            index = _indexes[script] = cls.load(script)
+        return index
+
+    @classmethod
+    def load(cls, script: ScriptDirectory) -> 'RevisionIndex':
+        """
+        Build the index of the given script directory
+        """
+        return cls(script, {rev.revision: _scan_module(rev.module)
+                            for rev in script.walk_revisions()})
+
+    def get_revisions(self, name: str) -> List[Tuple[str, str]]:
+        """
+        Get the ``(revision, attr_name)`` tuples of the revisions defining
+        the named object (ordered from base to head)
+        """
+        return self.names.get(name, [])
+
+    def find(self, name: str, before: Optional[str] = None
+             ) -> Optional[Tuple[str, str]]:
+        """
+        Get the ``(revision, attr_name)`` of the latest definition of the named
+        object, optionally only considering the revision ``before`` and its
+        ancestors (or None if there is none)
+        """
+        revisions = self.get_revisions(name)
+        if before is not None:
+            ancestors = {rev.revision for rev in self.script.revision_map
+                         .iterate_revisions(before, 'base')}
+            revisions = [(rev, attr) for rev, attr in revisions
+                         if rev in ancestors]
+        return revisions[-1] if revisions else None
+
+    def get_object(self, ident: str):
+        """
+        Get the object identified by ``'<revision>.<attr_name>'`` (or by just
+        its name, for the latest definition of it)
+        """
+        if ident in self._objects:
+            return self._objects[ident]
+
+        if '.' in ident:
+            # objects of other types than the indexed ones are looked up
+            # directly on their revision's module
+            revision, attr = ident.split('.')
+            revision = self.script.get_revision(revision).revision
+        else:
+            found = self.find(ident)
+            if found is None:
+                raise KeyError(f'No revision defines {ident!r}')
+            revision, attr = found
+
+        module = self.script.get_revision(revision).module
+        if not hasattr(module, attr):
+            defined_in = [rev for rev, _ in self.get_revisions(attr)]
+            raise AttributeError(f'Revision {revision} does not define {attr!r} '
+                                 f'(it is defined in {defined_in or "none"})')
+        obj = getattr(module, attr)
+        self._objects[ident] = obj
+        return obj
+
+
+def _scan_module(module):
+    from .materialized_view import MaterializedViewMigration
+    return {attr: value.name for attr, value in vars(module).items()
+            if isinstance(value, MaterializedViewMigration)}
+
@@ -0,0 +1,162 @@
+"""
+Schema baselines: a snapshot of the migrated schema (as DDL, plus the
+``alembic_version`` stamp), so fresh databases can be created by loading the
+baseline and then only running the revisions newer than it (instead of
+replaying the entire migration history).
+
+Baselines also store a checksum of the revision files up to their revision, so
+that editing any of those revisions makes the baseline stale.
+
+The DDL gets generated from the reflected schema (tables, their indexes and
+constraints, enum types and materialized views of the default schema).
+Anything else created by migrations (eg plain views, or functions, triggers
+and extensions created with ``op.execute``), and any rows inserted by data
+migrations, are not part of the baseline.
+"""
+import hashlib
+
+from alembic.migration import MigrationContext
+from alembic.script.revision import RevisionError
+from sqlalchemy import MetaData, inspect as sa_inspect
+from sqlalchemy.dialects.postgresql import ENUM
+from sqlalchemy.dialects.postgresql.base import CreateEnumType
+from sqlalchemy.schema import CreateIndex, CreateTable
+from typing import *
+
+from .materialized_view import reflect_replaceable_sql_for_existing
+
+
+BASELINE_FILENAME = 'baseline.sql'
+VERSION_TABLE = 'alembic_version'
+
+_HEADER = '-- schema baseline, generated by `flask db snapshot`'
+_REVISIONS = '-- revisions: '
+_CHECKSUM = '-- checksum: '
+_SEPARATOR = '\n;\n\n'
+
+
+class Baseline:
+    """
+    :param revisions: The migration heads the schema was at.
+    :param statements: The DDL statements recreating the schema (including
+                       the ``alembic_version`` table and its stamp).
+    :param checksum: The checksum of the revision files up to ``revisions``
+                     (see :func:`get_revisions_checksum`).
+    """
+    def __init__(self, revisions: Tuple[str, ...], statements: List[str],
+                 checksum: Optional[str] = None):
+        self.revisions = tuple(revisions)
+        self.statements = statements
+        self.checksum = checksum
+
+    @classmethod
+    def from_connection(cls, conn, script=None) -> 'Baseline':
+        """
+        Snapshot the schema of the database on the given connection (along
+        with the checksum of the revisions of ``script`` it's at, if given)
+        """
+        revisions = MigrationContext.configure(conn).get_current_heads()
+        metadata = MetaData()
+        metadata.reflect(conn)
+
+        statements, enums = [], set()
+        for table in metadata.sorted_tables:
+            for column in table.columns:
+                if isinstance(column.type, ENUM) and column.type.name not in enums:
+                    enums.add(column.type.name)
+                    statements.append(CreateEnumType(column.type))
+            statements.append(CreateTable(table))
+            statements.extend(CreateIndex(index) for index in
+                              sorted(table.indexes, key=lambda idx: idx.name))
+        statements = [_compile(stmt, conn.dialect) for stmt in statements]
+
+        if conn.dialect.name == 'postgresql':
+            for view in reflect_replaceable_sql_for_existing(sa_inspect(conn),
+                                                             [None]):
+                statements.append(view.create_sql.strip().rstrip(';'))
+                statements.extend(_create_index_sql(view.name, index)
+                                  for index in view.indexes)
+
+        statements.extend(f"INSERT INTO {VERSION_TABLE} (version_num) "
+                          f"VALUES ('{revision}')" for revision in revisions)
+        checksum = (get_revisions_checksum(script, revisions)
+                    if script is not None and revisions else None)
+        return cls(revisions, statements, checksum)
+
+    @classmethod
+    def read(cls, path: str) -> 'Baseline':
+        with open(path) as f:
+            header, revisions, checksum, sql = f.read().split('\n', 3)
+        if (header != _HEADER or not revisions.startswith(_REVISIONS)
+                or not checksum.startswith(_CHECKSUM)):
+            raise ValueError(f'{path} is not a schema baseline')
+
+        revisions = revisions[len(_REVISIONS):].split(', ')
+        statements = [stmt.strip() for stmt in sql.split(_SEPARATOR)]
+        return cls(tuple(rev for rev in revisions if rev),
+                   [stmt for stmt in statements if stmt],
+                   checksum[len(_CHECKSUM):] or None)
+
+    def write(self, path: str):
+        with open(path, 'w') as f:
+            f.write('\n'.join([_HEADER, _REVISIONS + ', '.join(self.revisions),
+                               _CHECKSUM + (self.checksum or ''), '']))
+            f.write(_SEPARATOR.join(self.statements) + _SEPARATOR)
+
+    def load(self, conn):
+        """
+        Execute the baseline's statements on the given connection (in a
+        transaction)
+        """
+        conn = conn.execution_options(no_parameters=True)
+        with conn.begin():
+            for statement in self.statements:
+                conn.execute(statement)
+
+    def check(self, script) -> List[str]:
+        """
+        Check the baseline against the migrations, returning the revisions
+        newer than it (raising :class:`ValueError` if it's not an ancestor of
+        the migration heads, eg because its revision was removed, or if any of
+        the revisions up to it were modified since it was saved)
+        """
+        if not self.revisions:
+            raise ValueError('the baseline has no alembic_version stamp')
+        try:
+            newer = list(script.iterate_revisions('heads', self.revisions))
+        except RevisionError as e:
+            raise ValueError(f'the baseline revision(s) {", ".join(self.revisions)} '
+                             f'are not part of the migration history ({e})')
+
+        if (self.checksum is not None
+                and get_revisions_checksum(script, self.revisions) != self.checksum):
+            raise ValueError('the revisions up to the baseline were modified '
+                             'since it was saved')
+        return [rev.revision for rev in reversed(newer)]
+
+
+def get_revisions_checksum(script, revisions) -> str:
+    """
+    Get the checksum of the files of the given revisions and their ancestors
+    """
+    checksum = hashlib.sha256()
+    for rev in reversed(list(script.iterate_revisions(revisions, 'base'))):
+        checksum.update(rev.revision.encode())
+        with open(rev.path, 'rb') as f:
+            checksum.update(f.read())
+    return checksum.hexdigest()
+
+
+def _create_index_sql(table_name, index):
+    unique = 'UNIQUE ' if index['unique'] else ''
+    return f'CREATE {unique}INDEX {index["name"]} ' \
+           f'ON {table_name} ({", ".join(index["column_names"])})'
+
+
+def _compile(ddl, dialect):
+    sql = str(ddl.compile(dialect=dialect)).strip()
+    # the baseline gets executed without parameters, so undo the escaping of
+    # percent signs for "format" paramstyle drivers (eg psycopg2)
+    if dialect.identifier_preparer._double_percents:
+        sql = sql.replace('%%', '%')
+    return sql
@@ -1,3 +1,4 @@
+import hashlib
 import inspect
 
 from collections import defaultdict
@@ -5,12 +6,24 @@ from flask_sqlalchemy.model import Model as FlaskSQLAlchemyBaseModel
 from flask_unchained.string_utils import pluralize, title_case
 from flask_unchained import lazy_gettext as _
 from sqlalchemy.ext.declarative import declared_attr
+from typing import *
 
 from .base_query import BaseQuery
+from .loader import LoaderDescriptor, ModelLoader
 from .meta import ModelMetaFactory
+from .serializer import ModelSerializer
 from .validation import Required, ValidationError, ValidationErrors
 
 
+def make_etag(*pks_and_updated_ats: Tuple[Any, Any]) -> str:
+    """
+    Make an ETag from one or more (primary key, updated_at) pairs
+    """
+    data = '|'.join(f'{pk}:{updated_at.isoformat() if updated_at else ""}'
+                    for pk, updated_at in pks_and_updated_ats)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
 class QueryAliasDescriptor:
     def __get__(self, instance, cls):
         return cls.query
@@ -37,6 +50,10 @@ class BaseModel(FlaskSQLAlchemyBaseModel):
 
     query: BaseQuery
     q: BaseQuery = QueryAliasDescriptor()
+    loader: ModelLoader = LoaderDescriptor()
+
+    __serializer__: ModelSerializer
+    """The compiled serializer for the model (set by the model registry)"""
 
     __repr_props__ = ()
     """Set to customize automatic string representation.
@@ -61,6 +78,17 @@ class BaseModel(FlaskSQLAlchemyBaseModel):
                       for prop in self.__repr_props__ if hasattr(self, prop)]
         return f"<{self.__class__.__name__} {' '.join(properties)}>"
 
+    @property
+    def etag(self) -> Union[str, None]:
+        """
+        An ETag for the model instance, based on its primary key and updated_at
+        column (or None if the model does not have both)
+        """
+        if not self._meta.pk or not self._meta.updated_at:
+            return None
+        return make_etag((getattr(self, self._meta.pk),
+                          getattr(self, self._meta.updated_at)))
+
     @declared_attr
     def __plural__(self):
         return pluralize(self.__name__)
@@ -1,7 +1,32 @@
+import array
+import datetime as dt
+
 from flask_sqlalchemy import BaseQuery as FlaskSQLAlchemyBaseQuery
+from sqlalchemy import func, inspect as sa_inspect
+from typing import *
+
+from .readonly import readonly_class
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# array.array typecodes (and the equivalent numpy dtypes) used by to_columns.
+# datetimes get stored as floats of seconds since the epoch
+_ARRAY_TYPECODES = {bool: 'b', int: 'q', float: 'd', dt.datetime: 'd'}
+_NUMPY_DTYPES = {'b': 'bool', 'q': 'int64', 'd': 'float64'}
+_NAN = float('nan')
 
 
 class BaseQuery(FlaskSQLAlchemyBaseQuery):
+    _readonly = False
+
+    def __iter__(self):
+        if self._readonly and self._is_model_query:
+            return self._iter_readonly()
+        return super().__iter__()
+
     def get(self, id):
         if isinstance(id, tuple):
             return super().get(id)
@@ -9,3 +34,160 @@ class BaseQuery(FlaskSQLAlchemyBaseQuery):
 
     def get_by(self, **kwargs):
         return self.filter_by(**kwargs).one_or_none()
+
+    def exists_by(self, **kwargs) -> bool:
+        """
+        Check whether any rows match the given filters, using ``SELECT EXISTS``
+        (no model instances are loaded)
+        """
+        return self.session.query(self.filter_by(**kwargs).exists()).scalar()
+
+    def count_by(self, **kwargs) -> int:
+        """
+        Count the rows matching the given filters, using ``SELECT count(*)``
+        directly against the table (instead of :meth:`count`, which counts
+        rows from a subquery). Any limit and offset of the query are ignored.
+        """
+        stmt = (self.limit(None).offset(None).filter_by(**kwargs).statement
+                .with_only_columns([func.count()])
+                .order_by(None))
+        return self.session.execute(stmt).scalar()
+
+    def pluck(self, column, **kwargs) -> list:
+        """
+        Return a list of the values of a single column for the rows matching
+        the given filters (no model instances are loaded)
+
+        :param column: The column attribute, or its name on the model
+        """
+        if isinstance(column, str):
+            column = getattr(self._entity, column)
+        return [value for value, in
+                self.filter_by(**kwargs).with_entities(column)]
+
+    def to_columns(self, *columns, batch_size=1000, use_numpy=True,
+                   ) -> Dict[str, Union[array.array, list]]:
+        """
+        Return the query results as a dict of column names to columnar
+        containers. Numeric (and datetime) columns are returned as compact
+        :class:`array.array` instances (datetimes as float seconds since the
+        epoch, NULLs as NaN), or as NumPy arrays if NumPy is installed and
+        ``use_numpy`` is True. All other columns are returned as lists.
+
+        Rows are fetched straight from the DB-API cursor in batches, so no
+        model instances or result row objects are ever created.
+
+        :param columns: The column attributes (or their names on the model) to
+                        select. Defaults to all of the model's columns.
+        :param batch_size: How many rows to fetch from the cursor at a time.
+        :param use_numpy: Whether or not to return NumPy arrays when available.
+        """
+        entity = self._entity
+        columns = [getattr(entity, c) if isinstance(c, str) else c
+                   for c in columns
+                   or [prop.key for prop in sa_inspect(entity).column_attrs]]
+        names = [c.key for c in columns]
+
+        if self.session.autoflush:
+            self.session.flush()
+
+        stmt = self.with_entities(*columns).statement
+        conn = self.session.connection(mapper=sa_inspect(entity))
+        dialect = conn.dialect
+
+        python_types = []
+        processors = []
+        containers = []
+        for col in stmt.columns:
+            try:
+                python_type = col.type.python_type
+            except NotImplementedError:
+                python_type = None
+            python_types.append(python_type)
+            processors.append(col.type.dialect_impl(dialect)
+                              .result_processor(dialect, None))
+            typecode = _ARRAY_TYPECODES.get(python_type)
+            containers.append(array.array(typecode) if typecode else [])
+
+        result = conn.execute(stmt)
+        cursor = result.cursor
+        try:
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for i, values in enumerate(zip(*rows)):
+                    if processors[i]:
+                        values = map(processors[i], values)
+                    containers[i] = _extend_column(containers[i], values,
+                                                   python_types[i])
+        finally:
+            result.close()
+
+        if np is not None and use_numpy:
+            containers = [_to_numpy(c) if isinstance(c, array.array) else c
+                          for c in containers]
+        return dict(zip(names, containers))
+
+    def as_readonly(self) -> 'BaseQuery':
+        """
+        Return a copy of this query that loads lightweight, read-only row
+        objects instead of model instances. The row objects are not tracked
+        by the session (so any eager loading options are ignored).
+        See :mod:`flask_sqlalchemy_bundle.readonly`.
+        """
+        query = self._clone()
+        query._readonly = True
+        return query
+
+    def _iter_readonly(self):
+        model = self._entity
+        row_cls = readonly_class(model)
+
+        if self.session.autoflush:
+            self.session.flush()
+
+        stmt = self.with_entities(
+            *[getattr(model, column) for column in row_cls.__slots__]
+        ).statement
+        result = self.session.execute(stmt, mapper=sa_inspect(model))
+        return map(row_cls._from_row, result)
+
+    @property
+    def _is_model_query(self):
+        # only queries for a single model class get loaded as read-only rows
+        # (eg the queries generated by count, or after with_entities, do not)
+        descriptions = self.column_descriptions
+        return (len(descriptions) == 1
+                and not descriptions[0]['aliased']
+                and descriptions[0]['type'] is descriptions[0]['entity'])
+
+    @property
+    def _entity(self):
+        return self.column_descriptions[0]['entity']
+
+
+def _extend_column(container, values, python_type):
+    if not isinstance(container, array.array):
+        container.extend(values)
+        return container
+
+    if python_type is dt.datetime:
+        values = [_NAN if v is None else v.timestamp() for v in values]
+    elif container.typecode == 'd':
+        values = [_NAN if v is None else float(v) for v in values]
+    else:
+        values = list(values)
+        if None in values:
+            # integer arrays cannot hold NULLs, so fall back to floats
+            container = array.array('d', container)
+            values = [_NAN if v is None else float(v) for v in values]
+    container.extend(values)
+    return container
+
+
+def _to_numpy(container: array.array):
+    dtype = _NUMPY_DTYPES[container.typecode]
+    if not container:
+        return np.empty(0, dtype=dtype)
+    return np.frombuffer(container, dtype=dtype)
@@ -1,26 +1,126 @@
 import click
+import functools
 import os
 
 from alembic import command as alembic
+from alembic.migration import MigrationContext
+from alembic.script import ScriptDirectory
 from flask import current_app
 from flask.cli import with_appcontext
+from flask_migrate import upgrade
 from flask_migrate.cli import db
 from flask_unchained import unchained, injectable
 from py_yaml_fixtures import FixturesLoader
 from py_yaml_fixtures.factories import SQLAlchemyModelFactory
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.exc import DBAPIError
 
+from . import sqla
+from .alembic.analyzer import (RISK_LEVELS, analyze_revisions,
+                               get_pending_revisions, get_table_row_estimates)
+from .alembic.snapshot import BASELINE_FILENAME, VERSION_TABLE, Baseline
 from .extensions import SQLAlchemy, migrate
 
 
+def target_options(fn):
+    """
+    Add the options for running a command on all of the migration targets
+    (see :meth:`Migrate.get_targets`)
+    """
+    options = [
+        click.option('--all-targets', is_flag=True, default=False,
+                     help='Run on all of the binds and tenant schemas configured '
+                          'by SQLALCHEMY_MIGRATION_BINDS/SCHEMAS.'),
+        click.option('--processes', type=int, default=None,
+                     help='How many targets to run concurrently (defaults to '
+                          'SQLALCHEMY_MIGRATION_PROCESSES).'),
+        click.option('--continue-on-error', is_flag=True, default=False,
+                     help='Keep going when a target fails.'),
+        click.option('--log-dir', default=None,
+                     help='The directory to write the per-target logs to '
+                          '(defaults to a new temporary directory).'),
+    ]
+    for option in reversed(options):
+        fn = option(fn)
+    return fn
+
+
+def run_for_targets(action, processes=None, continue_on_error=False,
+                    log_dir=None):
+    """
+    Run the action on all of the migration targets, and echo a summary
+    (exiting non-zero if any of them failed)
+    """
+    if processes is None:
+        processes = current_app.config.get('SQLALCHEMY_MIGRATION_PROCESSES', 4)
+    results = migrate.run_for_targets(action, processes=processes,
+                                      fail_fast=not continue_on_error,
+                                      log_dir=log_dir)
+
+    width = max(len(result.target.name) for result in results)
+    for result in results:
+        line = f'  {result.target.name:<{width}}  {result.status:<7}'
+        if result.status != 'skipped':
+            line += f'  {result.duration:>7.2f}s  {result.log_path}'
+        if result.error:
+            line += f'\n  {"":<{width}}  {result.error}'
+        click.echo(line)
+
+    failed = [result for result in results if result.status != 'ok']
+    if failed:
+        exit(f'{len(failed)} of {len(results)} target(s) failed or were skipped.')
+    click.echo(f'Done ({len(results)} targets).')
+
+
+@db.command('upgrade')
+@click.option('-d', '--directory', default=None,
+              help='migration script directory (default is "migrations")')
+@click.option('--sql', is_flag=True,
+              help="Don't emit SQL to database - dump to standard output instead")
+@click.option('--tag', default=None,
+              help='Arbitrary "tag" name - can be used by custom env.py scripts')
+@click.option('-x', '--x-arg', multiple=True,
+              help='Additional arguments consumed by custom env.py scripts')
+@click.argument('revision', default='head')
+@target_options
+@with_appcontext
+def upgrade_command(directory, sql, tag, x_arg, revision, all_targets,
+                    processes, continue_on_error, log_dir):
+    """Upgrade to a later version"""
+    if not all_targets:
+        load_baseline_if_unversioned(directory, revision, sql)
+        return upgrade(directory, revision, sql, tag, x_arg)
+
+    click.echo('Running DB migrations on all targets.')
+    run_for_targets(functools.partial(upgrade_target, directory=directory,
+                                      revision=revision, sql=sql, tag=tag,
+                                      x_arg=x_arg),
+                    processes, continue_on_error, log_dir)
+
+
+def upgrade_target(target, directory=None, revision='head', sql=False, tag=None,
+                   x_arg=None):
+    create_schema(target)
+    load_baseline_if_unversioned(directory, revision, sql)
+    alembic.upgrade(migrate.get_config(directory, x_arg=x_arg), revision,
+                    sql=sql, tag=tag)
+
+
 @db.command('drop')
 @click.option('--drop', is_flag=True, expose_value=True,
               prompt='Drop DB tables?')
+@target_options
 @with_appcontext
-def drop_command(drop):
+def drop_command(drop, all_targets, processes, continue_on_error, log_dir):
     """Drop database tables."""
     if not drop:
         exit('Cancelled.')
 
+    if all_targets:
+        click.echo('Dropping DB tables on all targets.')
+        run_for_targets(drop_target, processes, continue_on_error, log_dir)
+        return
+
     click.echo('Dropping DB tables.')
     drop_all()
 
@@ -28,29 +128,227 @@ def drop_command(drop):
 
 
 @unchained.inject('db')
-def drop_all(db: SQLAlchemy = injectable):
-    db.drop_all()
+def drop_all(bind='__all__', db: SQLAlchemy = injectable):
+    db.drop_all(bind=bind)
     db.engine.execute('DROP TABLE IF EXISTS alembic_version;')
 
 
+def drop_target(target):
+    # every target gets the same migrations, ie the default bind's tables
+    drop_all(bind=None)
+
+
 @db.command('reset')
 @click.option('--reset', is_flag=True, expose_value=True,
               prompt='Drop DB tables and run migrations?')
+@click.option('--no-baseline', is_flag=True, default=False,
+              help='Run all migrations, even if there is a schema baseline.')
+@target_options
 @with_appcontext
-def reset_command(reset):
+def reset_command(reset, no_baseline, all_targets, processes, continue_on_error,
+                  log_dir):
     """Drop database tables and run migrations."""
     if not reset:
         exit('Cancelled.')
 
+    if all_targets:
+        click.echo('Resetting all targets.')
+        run_for_targets(functools.partial(reset_target, no_baseline=no_baseline),
+                        processes, continue_on_error, log_dir)
+        return
+
     click.echo('Dropping DB tables.')
     drop_all()
 
+    if not no_baseline:
+        load_baseline()
+
     click.echo('Running DB migrations.')
     alembic.upgrade(migrate.get_config(None), 'head')
 
     click.echo('Done.')
 
 
+def reset_target(target, no_baseline=False):
+    create_schema(target)
+    drop_target(target)
+    if not no_baseline:
+        load_baseline()
+    alembic.upgrade(migrate.get_config(None), 'head')
+
+
+@unchained.inject('db')
+def create_schema(target, db: SQLAlchemy = injectable):
+    if target is not None and target.schema:
+        db.engine.execute(f'CREATE SCHEMA IF NOT EXISTS "{target.schema}"')
+
+
+@db.command('snapshot')
+@with_appcontext
+@unchained.inject('db')
+def snapshot_command(db: SQLAlchemy = injectable):
+    """Save the migrated schema as the baseline for `flask db reset`."""
+    script = ScriptDirectory.from_config(migrate.get_config(None))
+    with db.engine.connect() as conn:
+        baseline = Baseline.from_connection(conn, script)
+    if set(baseline.revisions) != set(script.get_heads()):
+        exit('The database is not at the migration head, '
+             'please run `flask db upgrade` first.')
+
+    path = get_baseline_path()
+    baseline.write(path)
+    click.echo(f'Saved the schema baseline at revision '
+               f'{", ".join(baseline.revisions)} to {path}')
+
+
+def get_baseline_path(directory=None):
+    return os.path.join(directory or migrate.directory, BASELINE_FILENAME)
+
+
+@unchained.inject('db')
+def load_baseline(directory=None, db: SQLAlchemy = injectable):
+    """
+    Load the schema baseline (if there is one, and if it's still part of the
+    migration history) into the (empty) database
+    """
+    path = get_baseline_path(directory)
+    if not os.path.exists(path):
+        return
+
+    baseline = Baseline.read(path)
+    try:
+        newer = baseline.check(
+            ScriptDirectory.from_config(migrate.get_config(directory)))
+    except ValueError as e:
+        click.echo(f'Ignoring the schema baseline: {e}')
+        return
+
+    click.echo(f'Loading the schema baseline at revision '
+               f'{", ".join(baseline.revisions)} '
+               f'({len(newer)} newer revision(s) to run).')
+    with db.engine.connect() as conn:
+        baseline.load(conn)
+
+
+@unchained.inject('db')
+def load_baseline_if_unversioned(directory=None, revision='head', sql=False,
+                                 db: SQLAlchemy = injectable):
+    """
+    Load the schema baseline before upgrading a database that hasn't been
+    migrated yet (ie that has no ``alembic_version`` table) to the head
+    """
+    if sql or revision not in {'head', 'heads'}:
+        return
+    if VERSION_TABLE not in sa_inspect(db.engine).get_table_names():
+        load_baseline(directory)
+
+
+@db.command('analyze-migrations')
+@click.option('--threshold', type=click.Choice(RISK_LEVELS), default=None,
+              help='The risk level at or above which to fail '
+                   '(defaults to SQLALCHEMY_MIGRATION_RISK_THRESHOLD).')
+@with_appcontext
+def analyze_migrations_command(threshold):
+    """Analyze the lock impact of pending migrations (without running them)."""
+    threshold = threshold or current_app.config.get(
+        'SQLALCHEMY_MIGRATION_RISK_THRESHOLD', 'high')
+    impacts = analyze_pending_migrations()
+    if not impacts:
+        click.echo('No pending migration operations.')
+        return
+
+    revision = None
+    for impact in impacts:
+        if impact.revision != revision:
+            revision = impact.revision
+            click.echo(f'Revision {revision}:')
+        rows = f' (~{impact.rows} rows)' if impact.rows is not None else ''
+        click.echo(f'  [{impact.risk}] {impact.description}{rows}: '
+                   f'{impact.lock or "no lock"}, {impact.reason}')
+
+    exceeding = [impact for impact in impacts if impact.exceeds(threshold)]
+    if exceeding:
+        exit(f'{len(exceeding)} operation(s) at or above the '
+             f'{threshold!r} risk threshold.')
+
+
+@unchained.inject('db')
+def analyze_pending_migrations(db: SQLAlchemy = injectable):
+    script = ScriptDirectory.from_config(migrate.get_config(None))
+    try:
+        with db.engine.connect() as conn:
+            heads = MigrationContext.configure(conn).get_current_heads()
+            table_rows = get_table_row_estimates(conn)
+    except DBAPIError:
+        heads, table_rows = (), None  # no db connection, analyze all revisions
+
+    large_table_rows = current_app.config.get(
+        'SQLALCHEMY_MIGRATION_LARGE_TABLE_ROWS', 100000)
+    return analyze_revisions(script, get_pending_revisions(script, heads),
+                             db.engine.dialect.name, table_rows=table_rows,
+                             large_table_rows=large_table_rows)
+
+
+@db.command('refresh-worker')
+@click.option('--poll-interval', default=1.0, show_default=True,
+              help='Maximum seconds to wait between checks for due refreshes.')
+@with_appcontext
+def refresh_worker_command(poll_interval):
+    """Refresh materialized views with Meta.refresh = 'async' as requested."""
+    worker = make_refresh_worker(poll_interval=poll_interval)
+    if not worker.views:
+        exit("No materialized views with Meta.refresh = 'async' were found.")
+
+    click.echo(f'Listening for refresh requests for: {", ".join(worker.views)}')
+    try:
+        worker.run()
+    except KeyboardInterrupt:
+        click.echo('Stopped.')
+
+
+@unchained.inject('db')
+def make_refresh_worker(app=None, poll_interval=1.0, db: SQLAlchemy = injectable):
+    views = [model for model in unchained.flask_sqlalchemy_bundle.models.values()
+             if issubclass(model, db.MaterializedView)
+             and model._meta.refresh == 'async']
+    config = (app or current_app).config
+    return sqla.MaterializedViewRefreshWorker(
+        db.get_engine(app), views, poll_interval=poll_interval,
+        refresh_options=sqla.get_refresh_options(config))
+
+
+@db.command('views-status')
+@with_appcontext
+@unchained.inject('db')
+def views_status_command(db: SQLAlchemy = injectable):
+    """Show the refresh statistics of the materialized views."""
+    views = sorted(model.__tablename__
+                   for model in unchained.flask_sqlalchemy_bundle.models.values()
+                   if issubclass(model, db.MaterializedView))
+    if not views:
+        exit('No materialized views were found.')
+
+    stats = {row['name']: row
+             for row in sqla.get_all_freshness(db.session, db.metadata)}
+    width = max(len(name) for name in views)
+    click.echo(f'{"view":<{width}}  {"last refreshed (UTC)":<19}  {"age (s)":>9}'
+               f'  {"duration (s)":>12}  {"trigger":<9}  {"rows":>9}'
+               f'  {"refreshes":>9}')
+    for name in views:
+        row = stats.get(name, {})
+        stale = ' (stale)' if row.get('stale_since') else ''
+        if not row.get('last_refreshed_at'):
+            click.echo(f'{name:<{width}}  never refreshed{stale}')
+            continue
+
+        refreshed_at = row['last_refreshed_at'].strftime('%Y-%m-%d %H:%M:%S')
+        # the row count is unknown for views postgres hasn't analyzed yet
+        rows = '-' if row['row_count'] is None else row['row_count']
+        click.echo(f'{name:<{width}}  {refreshed_at}  {row["age"]:>9.0f}'
+                   f'  {row["last_duration"]:>12.3f}  {row["last_trigger"]:<9}'
+                   f'  {rows:>9}  {row["refresh_count"]:>9}{stale}')
+
+
 @db.command()
 @with_appcontext
 @unchained.inject('db')
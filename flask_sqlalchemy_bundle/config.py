@@ -9,6 +9,37 @@ def render_migration_item(type_, obj, autogen_context):
 class Config:
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # run a background thread to refresh Meta.refresh = 'async' materialized
+    # views, in single-process deployments (every app process would run one;
+    # otherwise, run the `flask db refresh-worker` command instead)
+    SQLALCHEMY_MATERIALIZED_VIEW_REFRESH_WORKER = False
+
+    # timeouts (in seconds) for materialized view refreshes, and what to do
+    # when another process is already refreshing a view ('coalesce' or 'skip')
+    SQLALCHEMY_MATERIALIZED_VIEW_REFRESH_LOCK_TIMEOUT = None
+    SQLALCHEMY_MATERIALIZED_VIEW_REFRESH_STATEMENT_TIMEOUT = None
+    SQLALCHEMY_MATERIALIZED_VIEW_REFRESH_ON_LOCKED = 'coalesce'
+
+    # how often (in seconds) reads of Meta.refresh = 'on_read' materialized
+    # views check whether another process marked them stale
+    SQLALCHEMY_MATERIALIZED_VIEW_STALE_CHECK_INTERVAL = 5
+
+    # the risk level ('low', 'medium' or 'high') at or above which the
+    # `flask db analyze-migrations` command fails, and the (estimated) number
+    # of rows from which scanning or rewriting a table counts as high risk
+    SQLALCHEMY_MIGRATION_RISK_THRESHOLD = 'high'
+    SQLALCHEMY_MIGRATION_LARGE_TABLE_ROWS = 100000
+
+    # additional targets for the `flask db upgrade/reset/drop --all-targets`
+    # commands: the SQLALCHEMY_BINDS keys to run the migrations on as well
+    # (or True for all of them, they must share the default bind's schema), and
+    # the tenant schemas to run them in on PostgreSQL (a list, or a callable
+    # taking the app and returning one), along with how many targets to
+    # migrate concurrently
+    SQLALCHEMY_MIGRATION_BINDS = None
+    SQLALCHEMY_MIGRATION_SCHEMAS = None
+    SQLALCHEMY_MIGRATION_PROCESSES = 4
+
     db_file = 'db/dev.sqlite'  # relative path to PROJECT_ROOT/db/dev.sqlite
     SQLALCHEMY_DATABASE_URI = f'sqlite:///{db_file}'
 
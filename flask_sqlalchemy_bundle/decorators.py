@@ -1,15 +1,23 @@
 import inspect
 
+from collections import deque
 from enum import Enum
 from functools import wraps
 from http import HTTPStatus
 
-from flask import abort, request
+from datetime import timezone
+from flask import abort, current_app, make_response, request
 from flask_sqlalchemy.model import Model
 from flask_unchained.string_utils import snake_case
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.orm.interfaces import MANYTOONE
+from typing import *
 
+from .base_model import make_etag
 
-def param_converter(*decorator_args, **decorator_kwargs):
+
+def param_converter(*decorator_args, check_related=False, conditional=False,
+                    **decorator_kwargs):
     """
     Call with the url parameter names as keyword argument keys, their values
     being the model to convert to.
@@ -21,14 +29,17 @@ def param_converter(*decorator_args, **decorator_kwargs):
 
     The action's argument names must match the snake-cased model names.
 
+    Lookups by primary key use ``Model.query.get``, so instances already in the
+    session's identity map do not require a query.
+
     For example::
 
         @bp.route('/users/<int:user_id>/posts/<int:id>')
         @param_converter(user_id=User, id=Post)
         def show_post(user, post):
             # the param converter does the database lookups:
-            # user = User.query.filter_by(id=user_id).first()
-            # post = Post.query.filter_by(id=id).first()
+            # user = User.query.get(user_id)
+            # post = Post.query.get(id)
             # and calls the decorated action: show_post(user, post)
 
         # or to customize the argument names passed to the action:
@@ -38,6 +49,26 @@ def param_converter(*decorator_args, **decorator_kwargs):
         def show_post(user_arg_name, post_arg_name):
             # do stuff ...
 
+    Pass ``check_related=True`` to load related url models (eg a post and the
+    user it belongs to) with a single joined query, which also verifies that
+    they actually are related (aborting with a 404 if they are not)::
+
+        @bp.route('/users/<int:user_id>/posts/<int:post_id>')
+        @param_converter(user_id=User, post_id=Post, check_related=True)
+        def show_post(user, post):
+            # SELECT ... FROM user JOIN post ON user.id = post.user_id
+            # WHERE user.id = :user_id AND post.id = :post_id
+
+    Pass ``conditional=True`` to support conditional GET requests. Before
+    loading the url models, only their primary keys and ``updated_at`` columns
+    get selected, and if the ``If-None-Match`` (or ``If-Modified-Since``)
+    request header shows the client already has the current version, a 304
+    Not Modified response is returned without loading the models or calling
+    the view. Otherwise the view's response gets ``ETag`` and ``Last-Modified``
+    headers added. (All of the url models must have an ``updated_at`` column.
+    With ``check_related=True``, the columns of related url models get selected
+    with the same joined query used to load them.)
+
     Also supports parsing arguments from the query string. For query string
     keyword arguments, use a lookup (dict, Enum) or callable::
 
@@ -46,13 +77,39 @@ def param_converter(*decorator_args, **decorator_kwargs):
         def show_user(user, foo, optional=10):
             # GET /users/1?foo=bar
             # calls show_user(user=User.get(1), foo='bar')
+
+    Lists of ids in the query string can be converted to lists of models (with
+    a single query) using :class:`Many`, or the ``[Model]`` shorthand::
+
+        @bp.route('/posts')
+        @param_converter(ids=[Post])  # or ids=Many(Post, max_length=50)
+        def list_posts(ids=None):
+            # GET /posts?ids=3&ids=1
+            # calls list_posts(ids=[Post.get(3), Post.get(1)])
     """
+    plan = _ConversionPlan(decorator_kwargs, check_related)
+
     def wrapped(fn):
         @wraps(fn)
         def decorated(*view_args, **view_kwargs):
-            view_kwargs = _convert_models(view_kwargs, decorator_kwargs)
-            view_kwargs = _convert_query_params(view_kwargs, decorator_kwargs)
-            return fn(*view_args, **view_kwargs)
+            validators = None
+            if conditional and request.method in {'GET', 'HEAD'}:
+                validators = plan.get_cache_validators(view_kwargs)
+                if validators and _is_not_modified(*validators):
+                    return _not_modified_response(*validators)
+
+            view_kwargs = plan.convert_models(view_kwargs)
+            if plan.query_converters:
+                view_kwargs = _convert_query_params(view_kwargs,
+                                                    plan.query_converters)
+            rv = fn(*view_args, **view_kwargs)
+            if not validators:
+                return rv
+
+            response = make_response(rv)
+            response.set_etag(validators[0])
+            response.last_modified = validators[1]
+            return response
         return decorated
 
     if decorator_args and callable(decorator_args[0]):
@@ -60,33 +117,249 @@ def param_converter(*decorator_args, **decorator_kwargs):
     return wrapped
 
 
-def _convert_models(view_kwargs: dict,
-                    url_param_names_to_models: dict,
-                    ) -> dict:
-    for url_param_name, model_mapping in url_param_names_to_models.items():
-        arg_name = None
-        model = model_mapping
-        if isinstance(model_mapping, dict):
-            arg_name, model = list(model_mapping.items())[0]
+class Many:
+    """
+    A param_converter marker to convert a list of ids from the query string
+    into a list of model instances, using a single ``IN`` query. The order of
+    the ids is preserved.
+
+    :param model: The model class to convert to.
+    :param by: The model attribute to look up by (defaults to the primary key).
+    :param max_length: The maximum number of ids allowed (aborts with a 400
+                       Bad Request if there are more).
+    :param error: The HTTP status code to abort with if any of the ids are not
+                  found (defaults to 404 Not Found).
+    """
+    def __init__(self, model, by: Optional[str] = None, max_length: int = 100,
+                 error: int = HTTPStatus.NOT_FOUND):
+        self.model = model
+        self.by = by
+        self.max_length = max_length
+        self.error = error
+
+    def __call__(self, values: List[str]) -> list:
+        if len(values) > self.max_length:
+            abort(HTTPStatus.BAD_REQUEST)
 
-        if not (inspect.isclass(model) and issubclass(model, Model)):
-            continue
+        column = getattr(self.model,
+                         self.by or sa_inspect(self.model).primary_key[0].key)
+        try:
+            python_type = column.type.python_type
+            keys = [python_type(value) for value in values]
+        except NotImplementedError:
+            keys = values
+        except (TypeError, ValueError):
+            abort(self.error)
 
-        if not arg_name:
-            arg_name = snake_case(model.__name__)
+        query = self.model.query.filter(column.in_(set(keys)))
+        instances = {getattr(instance, column.key): instance
+                     for instance in query}
+        try:
+            return [instances[key] for key in keys]
+        except KeyError:
+            abort(self.error)
 
-        filter_by = url_param_name.replace(
+    def __repr__(self):
+        return f'Many({self.model.__name__})'
+
+
+class _ModelConverter:
+    def __init__(self, url_param_name, model, arg_name=None):
+        self.url_param_name = url_param_name
+        self.model = model
+        self.arg_name = arg_name or snake_case(model.__name__)
+        self.filter_by = url_param_name.replace(
             snake_case(model.__name__) + '_', '')
-        instance = model.query.filter_by(**{
-            filter_by: view_kwargs.pop(url_param_name),
-        }).first()
 
-        if not instance:
-            abort(HTTPStatus.NOT_FOUND)
+    @property
+    def is_pk_lookup(self) -> bool:
+        # the mapper isn't necessarily configured yet at decoration time
+        if not hasattr(self, '_is_pk_lookup'):
+            pk = sa_inspect(self.model).primary_key
+            # BaseQuery.get coerces ids to int, so it only works for int pks
+            self._is_pk_lookup = (len(pk) == 1
+                                  and pk[0].key == self.filter_by
+                                  and _get_python_type(pk[0]) is int)
+        return self._is_pk_lookup
 
-        view_kwargs[arg_name] = instance
+    def convert(self, value):
+        if not self.is_pk_lookup:
+            return self.model.query.filter_by(**{self.filter_by: value}).first()
 
-    return view_kwargs
+        try:
+            return self.model.query.get(value)
+        except (TypeError, ValueError):
+            return None
+
+
+def _get_python_type(column):
+    try:
+        return column.type.python_type
+    except NotImplementedError:
+        return None
+
+
+class _ConversionPlan:
+    """
+    Everything param_converter needs to know about its arguments, computed
+    once (at decoration time where possible, otherwise on first use)
+    """
+    def __init__(self, decorator_kwargs: dict, check_related: bool = False):
+        self.model_converters: List[_ModelConverter] = []
+        self.query_converters: Dict[str, Any] = {}
+        for name, converter in decorator_kwargs.items():
+            arg_name, model = None, converter
+            if isinstance(converter, dict) and converter:
+                arg_name, model = next(iter(converter.items()))
+
+            if inspect.isclass(model) and issubclass(model, Model):
+                self.model_converters.append(
+                    _ModelConverter(name, model, arg_name))
+            elif (isinstance(converter, list) and len(converter) == 1
+                    and inspect.isclass(converter[0])
+                    and issubclass(converter[0], Model)):
+                self.query_converters[name] = Many(converter[0])
+            else:
+                self.query_converters[name] = converter
+
+        self.check_related = check_related
+        self._groups = None
+
+    @property
+    def groups(self) -> List[Tuple[List[_ModelConverter], list]]:
+        """
+        The model converters, grouped by which ones are related to each other
+        (a list of tuples of the converters in join order, and the join
+        conditions between them)
+        """
+        if self._groups is None:
+            if not self.check_related:
+                self._groups = [([c], []) for c in self.model_converters]
+            else:
+                self._groups = _group_related(self.model_converters)
+        return self._groups
+
+    def get_cache_validators(self, view_kwargs: dict):
+        """
+        Select only the primary keys and updated_at columns of the url models
+        (with one query per group of related models), returning a tuple of
+        the ETag and Last-Modified values for them (or None if any of the
+        models do not have an updated_at column)
+        """
+        if not self.model_converters or not all(
+                c.model._meta.pk and c.model._meta.updated_at
+                for c in self.model_converters):
+            return None
+
+        validators = {}
+        for converters, joins in self.groups:
+            columns = []
+            for c in converters:
+                columns += [getattr(c.model, c.model._meta.pk),
+                            getattr(c.model, c.model._meta.updated_at)]
+            row = _joined_query(converters, joins, columns, [
+                view_kwargs[c.url_param_name] for c in converters]).first()
+            if row is None:
+                abort(HTTPStatus.NOT_FOUND)
+
+            for i, c in enumerate(converters):
+                validators[c] = tuple(row[i * 2:i * 2 + 2])
+                if validators[c][1] is None:
+                    return None
+
+        pks_and_updated_ats = [validators[c] for c in self.model_converters]
+        return (make_etag(*pks_and_updated_ats),
+                max(updated_at for _, updated_at in pks_and_updated_ats))
+
+    def convert_models(self, view_kwargs: dict) -> dict:
+        for converters, joins in self.groups:
+            values = [view_kwargs.pop(c.url_param_name) for c in converters]
+            if not joins:
+                instances = [converters[0].convert(values[0])]
+            else:
+                instances = _load_joined(converters, joins, values)
+
+            if not instances or any(i is None for i in instances):
+                abort(HTTPStatus.NOT_FOUND)
+
+            for converter, instance in zip(converters, instances):
+                view_kwargs[converter.arg_name] = instance
+
+        return view_kwargs
+
+
+def _group_related(converters: List[_ModelConverter]):
+    # find many-to-one relationships between the url models
+    edges = {}
+    for child in converters:
+        for rel in sa_inspect(child.model).relationships:
+            if rel.direction is not MANYTOONE:
+                continue
+            for parent in converters:
+                if (parent is not child and parent.model is not child.model
+                        and issubclass(parent.model, rel.mapper.class_)):
+                    edges.setdefault((child, parent), rel.primaryjoin)
+                    edges.setdefault((parent, child), rel.primaryjoin)
+
+    # breadth-first traversal of each connected group of converters
+    groups = []
+    visited = set()
+    for root in converters:
+        if root in visited:
+            continue
+        visited.add(root)
+        ordered, joins = [root], []
+        queue = deque([root])
+        while queue:
+            current = queue.popleft()
+            for other in converters:
+                if other not in visited and (current, other) in edges:
+                    visited.add(other)
+                    ordered.append(other)
+                    joins.append(edges[(current, other)])
+                    queue.append(other)
+        groups.append((ordered, joins))
+    return groups
+
+
+def _load_joined(converters: List[_ModelConverter], joins: list, values: list):
+    return _joined_query(converters, joins, [c.model for c in converters],
+                         values).first()
+
+
+def _joined_query(converters: List[_ModelConverter], joins: list,
+                  entities: list, values: list):
+    first = converters[0].model
+    query = first.query.session.query(*entities).select_from(first)
+    for converter, onclause in zip(converters[1:], joins):
+        query = query.join(converter.model, onclause)
+    for converter, value in zip(converters, values):
+        query = query.filter(
+            getattr(converter.model, converter.filter_by) == value)
+    return query
+
+
+def _is_not_modified(etag, last_modified) -> bool:
+    # If-None-Match takes precedence over If-Modified-Since (RFC 7232)
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    elif request.if_modified_since:
+        return (_as_naive_utc(last_modified).replace(microsecond=0)
+                <= _as_naive_utc(request.if_modified_since))
+    return False
+
+
+def _not_modified_response(etag, last_modified):
+    response = current_app.response_class(status=HTTPStatus.NOT_MODIFIED)
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    return response
+
+
+def _as_naive_utc(value):
+    if value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
 
 
 def _convert_query_params(view_kwargs: dict,
@@ -97,7 +370,10 @@ def _convert_query_params(view_kwargs: dict,
             continue
 
         value = request.args.getlist(name)
-        if len(value) == 1:
+        if isinstance(converter, Many):
+            view_kwargs[name] = converter(value)
+            continue
+        elif len(value) == 1:
             value = value[0]
 
         if isinstance(converter, (dict, Enum)):
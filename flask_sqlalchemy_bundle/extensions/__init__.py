@@ -1,6 +1,6 @@
 from sqlalchemy import MetaData
 
-from .migrate import Migrate
+from .migrate import Migrate, MigrationTarget
 from .sqlalchemy import SQLAlchemy
 
 
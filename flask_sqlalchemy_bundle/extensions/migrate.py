@@ -1,10 +1,83 @@
-from flask import Flask
+import multiprocessing
+import os
+import tempfile
+import time
+import traceback
+
+from contextlib import contextmanager, redirect_stderr, redirect_stdout
+from flask import Flask, current_app
 from flask_migrate import Migrate as BaseMigrate
 from flask_unchained import unchained, injectable
+from sqlalchemy.engine.url import make_url
+from typing import *
 
 from .sqlalchemy import SQLAlchemy
 
 
+class MigrationTarget:
+    """
+    A database (and optionally a schema in it) to run the migrations on.
+
+    Every target gets the same migrations (those of the migrations directory,
+    autogenerated from the default bind's metadata), so the binds used as
+    targets must all share one schema (eg per-customer or per-shard copies of
+    the default database), rather than hold tables of their own.
+
+    :param bind: The ``SQLALCHEMY_BINDS`` key of the database (or None for
+                 ``SQLALCHEMY_DATABASE_URI``).
+    :param schema: The (tenant) schema to run the migrations in (using the
+                   PostgreSQL ``search_path``), or None for the default one.
+    """
+    def __init__(self, bind: Optional[str] = None, schema: Optional[str] = None):
+        self.bind = bind
+        self.schema = schema
+
+    @property
+    def name(self):
+        name = self.bind or 'default'
+        return f'{name}/{self.schema}' if self.schema else name
+
+    def get_url(self, app: Flask) -> str:
+        url = _get_bind_url(app, self.bind)
+        if self.schema:
+            url.query['options'] = f'-csearch_path={self.schema}'
+        return str(url)
+
+    @contextmanager
+    def activate(self, app: Flask):
+        """
+        Point ``SQLALCHEMY_DATABASE_URI`` (and therefore the default engine,
+        and the engine used by ``env.py``) at this target within the block
+        """
+        uri = app.config['SQLALCHEMY_DATABASE_URI']
+        app.config['SQLALCHEMY_DATABASE_URI'] = self.get_url(app)
+        try:
+            yield
+        finally:
+            app.config['SQLALCHEMY_DATABASE_URI'] = uri
+
+    def __repr__(self):
+        return f'<MigrationTarget {self.name}>'
+
+
+class MigrationResult:
+    """
+    :param target: The target.
+    :param status: One of ``'ok'``, ``'failed'`` or ``'skipped'``.
+    :param duration: How long running the action on the target took.
+    :param error: The error message (when it failed).
+    :param log_path: The path of the target's log file.
+    """
+    def __init__(self, target: MigrationTarget, status: str,
+                 duration: float = 0.0, error: Optional[str] = None,
+                 log_path: Optional[str] = None):
+        self.target = target
+        self.status = status
+        self.duration = duration
+        self.error = error
+        self.log_path = log_path
+
+
 class Migrate(BaseMigrate):
     @unchained.inject('db')
     def init_app(self, app: Flask, db: SQLAlchemy = injectable):
@@ -14,3 +87,107 @@ class Migrate(BaseMigrate):
         super().init_app(app, db=db,
                          directory=alembic_config.get('script_location'),
                          **app.config.get('ALEMBIC_CONTEXT', {}))
+
+    def get_targets(self, app: Optional[Flask] = None) -> List[MigrationTarget]:
+        """
+        Get the migration targets: the default database and the binds listed
+        in ``SQLALCHEMY_MIGRATION_BINDS`` (or all of them if it's True), each
+        with every schema of ``SQLALCHEMY_MIGRATION_SCHEMAS`` (a list, or a
+        callable taking the app and returning one). Schemas only apply to
+        PostgreSQL databases, other ones are only migrated once.
+        """
+        app = app or current_app
+        binds = app.config.get('SQLALCHEMY_MIGRATION_BINDS') or []
+        if binds is True:
+            binds = sorted(app.config.get('SQLALCHEMY_BINDS') or {})
+
+        schemas = app.config.get('SQLALCHEMY_MIGRATION_SCHEMAS')
+        if callable(schemas):
+            schemas = schemas(app)
+        return [MigrationTarget(bind, schema)
+                for bind in [None, *binds]
+                for schema in (schemas if _get_bind_url(app, bind)
+                               .get_backend_name() == 'postgresql' else None)
+                or [None]]
+
+    def run_for_targets(self, action: Callable[[MigrationTarget], Any],
+                        targets: Optional[List[MigrationTarget]] = None,
+                        processes: int = 1, fail_fast: bool = True,
+                        log_dir: Optional[str] = None,
+                        app: Optional[Flask] = None) -> List[MigrationResult]:
+        """
+        Run the action for every target (with the target activated and in an
+        app context), concurrently in a pool of forked worker processes. The
+        output of each target gets written to its own log file in ``log_dir``.
+
+        With ``fail_fast``, the remaining targets get skipped (and any running
+        ones get terminated) as soon as one fails.
+        """
+        app = app or current_app._get_current_object()
+        targets = self.get_targets(app) if targets is None else targets
+        log_dir = log_dir or tempfile.mkdtemp(prefix='migrations-')
+        os.makedirs(log_dir, exist_ok=True)
+
+        tasks = [(action, target, os.path.join(
+                    log_dir, f'{target.name.replace("/", "-")}.log'))
+                 for target in targets]
+        results = {}
+
+        if processes > 1:
+            # don't share pooled connections with the forked processes
+            for bind in [None, *(app.config.get('SQLALCHEMY_BINDS') or {})]:
+                self.db.get_engine(app, bind).dispose()
+
+        global _pool_app
+        _pool_app = app
+        try:
+            if processes <= 1:
+                for task in tasks:
+                    result = _run_target(task)
+                    results[result.target.name] = result
+                    if fail_fast and result.status == 'failed':
+                        break
+            else:
+                pool = multiprocessing.get_context('fork').Pool(processes)
+                try:
+                    for result in pool.imap_unordered(_run_target, tasks):
+                        results[result.target.name] = result
+                        if fail_fast and result.status == 'failed':
+                            pool.terminate()
+                            break
+                    else:
+                        pool.close()
+                finally:
+                    pool.join()
+        finally:
+            _pool_app = None
+
+        return [results.get(target.name)
+                or MigrationResult(target, 'skipped', log_path=log_path)
+                for _, target, log_path in tasks]
+
+
+def _get_bind_url(app, bind):
+    if bind is None:
+        return make_url(app.config['SQLALCHEMY_DATABASE_URI'])
+    return make_url(app.config['SQLALCHEMY_BINDS'][bind])
+
+
+# the app to run actions with (inherited by the forked worker processes)
+_pool_app = None
+
+
+def _run_target(task):
+    action, target, log_path = task
+    started = time.perf_counter()
+    with open(log_path, 'w') as log, redirect_stdout(log), redirect_stderr(log):
+        try:
+            with _pool_app.app_context(), target.activate(_pool_app):
+                action(target)
+        except (Exception, SystemExit) as e:
+            traceback.print_exc()
+            return MigrationResult(target, 'failed',
+                                   time.perf_counter() - started,
+                                   f'{e.__class__.__name__}: {e}', log_path)
+    return MigrationResult(target, 'ok', time.perf_counter() - started,
+                           log_path=log_path)
@@ -1,5 +1,6 @@
-from flask_sqlalchemy import DefaultMeta, SQLAlchemy as BaseSQLAlchemy
-from sqlalchemy import event
+from flask_sqlalchemy import (DefaultMeta, SQLAlchemy as BaseSQLAlchemy,
+                              _QueryProperty)
+from sqlalchemy import event, inspect as sa_inspect
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import Session
 from sqlalchemy.sql.naming import (ConventionDict, _get_convention,
@@ -14,6 +15,35 @@ from ..validation import (
     BaseValidator, Required, ValidationError, ValidationErrors, validates)
 
 
+def _listen_for_incremental_changes(view, Parent):
+    def record(op):
+        def record_change(mapper, connection, target):
+            sqla.record_incremental_view_change(view, mapper, target, op)
+        return record_change
+
+    # updates and deletes must be recorded before their old values are gone
+    event.listen(Parent, 'after_insert', record('insert'))
+    event.listen(Parent, 'before_update', record('update'))
+    event.listen(Parent, 'before_delete', record('delete'))
+
+
+def _if_changed(columns, listener):
+    def listen_if_changed(mapper, connection, target):
+        state = sa_inspect(target)
+        for column in columns:
+            key = mapper.get_property_by_column(column).key
+            if state.attrs[key].history.has_changes():
+                return listener(mapper, connection, target)
+    return listen_if_changed
+
+
+class _MaterializedViewQueryProperty(_QueryProperty):
+    def __get__(self, obj, type):
+        if type is not None and type._meta.refresh == 'on_read':
+            sqla.refresh_on_read_view_if_stale(type)
+        return super().__get__(obj, type)
+
+
 class SQLAlchemy(BaseSQLAlchemy):
     def __init__(self, app=None, use_native_unicode=True, session_options=None,
                  metadata=None, query_class=BaseQuery, model_class=BaseModel):
@@ -50,13 +80,18 @@ class SQLAlchemy(BaseSQLAlchemy):
 
         class MaterializedViewMetaclass(BaseModelMetaclass):
             def _pre_mcs_init(cls):
-                cls.__table__ = sqla.create_materialized_view(cls._meta.table,
-                                                              cls.selectable())
+                cls.__table__ = sqla.create_materialized_view(
+                    cls._meta.table, cls.selectable(),
+                    incremental=cls._meta.refresh == 'incremental')
 
             def _post_mcs_init(cls):
+                plan = cls.__table__.info.get('incremental_view_plan')
+
                 # create a unique index for the primary key(s) of __table__
+                # (incrementally maintained views use a real primary key)
                 cls._meta._refresh_concurrently = False
-                for pk in cls.__table__.primary_key.columns:
+                pks = cls.__table__.primary_key.columns if plan is None else []
+                for pk in pks:
                     pk_idx = self.Index(pk.name,
                                         getattr(cls, pk.name),
                                         unique=True)
@@ -76,13 +111,31 @@ class SQLAlchemy(BaseSQLAlchemy):
                     if isinstance(Parent, str):
                         Parent = cls._decl_class_registry[Parent]
 
-                    def refresh_mv(mapper, connection, target):
-                        cls.refresh()
+                    if plan is not None:
+                        _listen_for_incremental_changes(cls, Parent)
+                        continue
+
+                    if cls._meta.refresh == 'immediate':
+                        # refresh within the flush's transaction
+                        def refresh_mv(mapper, connection, target):
+                            cls.refresh(bind=connection, trigger='event')
+                    else:
+                        def refresh_mv(mapper, connection, target):
+                            sqla.mark_materialized_view_stale(cls, target)
 
                     event.listen(Parent, 'after_insert', refresh_mv)
-                    event.listen(Parent, 'after_update', refresh_mv)
                     event.listen(Parent, 'after_delete', refresh_mv)
 
+                    # only refresh on updates of columns the view actually uses
+                    columns = sqla.get_selected_columns(
+                        cls.__table__.info['selectable'],
+                        sa_inspect(Parent).tables)
+                    if columns is None:
+                        event.listen(Parent, 'after_update', refresh_mv)
+                    elif columns:
+                        event.listen(Parent, 'after_update',
+                                     _if_changed(columns, refresh_mv))
+
         class MaterializedView(self.Model, metaclass=MaterializedViewMetaclass):
             class Meta:
                 abstract = True
@@ -90,6 +143,8 @@ class SQLAlchemy(BaseSQLAlchemy):
                 created_at = None
                 updated_at = None
 
+            query = _MaterializedViewQueryProperty(self)
+
             @sqla.declared_attr
             def __tablename__(self):
                 return self.__table__.fullname
@@ -107,10 +162,35 @@ class SQLAlchemy(BaseSQLAlchemy):
                 return []
 
             @classmethod
-            def refresh(cls, concurrently=None):
+            def refresh(cls, concurrently=None, bind=None, trigger='manual',
+                        **kwargs):
+                """
+                Refresh the view (see :func:`refresh_materialized_view` for
+                the supported keyword arguments)
+                """
+                plan = cls.__table__.info.get('incremental_view_plan')
+                if plan is not None:
+                    sqla.rebuild_incremental_view(plan, bind=bind,
+                                                  trigger=trigger)
+                    return True
+
                 concurrently = (concurrently if concurrently is not None
                                 else cls._meta._refresh_concurrently)
-                sqla.refresh_materialized_view(cls.__tablename__, concurrently)
+                return sqla.refresh_materialized_view(
+                    cls.__tablename__, concurrently, bind=bind,
+                    trigger=trigger, **kwargs)
+
+            @classmethod
+            def freshness(cls):
+                """
+                Get the statistics of the view's last refresh (its
+                ``last_refreshed_at``, ``age`` in seconds, ``last_duration``,
+                ``last_trigger``, ``row_count``, ``refresh_count`` and, for
+                ``Meta.refresh = 'on_read'``, ``stale_since``), or None if it
+                has never been refreshed
+                """
+                return sqla.get_freshness(self.session, self.metadata,
+                                          cls.__tablename__)
 
         self.MaterializedView = MaterializedView
 
@@ -0,0 +1,134 @@
+"""
+Request-scoped, DataLoader-style batching of primary key lookups. Instead of
+issuing one query per ``Model.query.get(id)`` call, ``Model.loader.load(id)``
+returns a deferred handle. Keys are collected until the first time any handle
+gets accessed, at which point all of the pending keys for the model are
+resolved with a single ``IN`` query. Results are cached for the rest of the
+request (or for the lifetime of the app context, when used outside of one)::
+
+    authors = [Author.loader.load(post.author_id) for post in posts]
+    # no queries yet...
+    authors[0].name  # one query: SELECT ... WHERE author.id IN (...)
+    authors[1].name  # cached
+
+Only models with a single-column primary key are supported.
+"""
+from flask import _app_ctx_stack, _request_ctx_stack
+from sqlalchemy import inspect as sa_inspect
+from typing import *
+
+
+class DeferredInstance:
+    """
+    A handle to a model instance that will be loaded (in a batch) by a
+    :class:`ModelLoader` upon first access. Attribute access is proxied to the
+    loaded instance, and the handle is falsy if no instance was found.
+    """
+    __slots__ = ('_loader', '_key')
+
+    def __init__(self, loader: 'ModelLoader', key):
+        self._loader = loader
+        self._key = key
+
+    def resolve(self):
+        """Get the loaded model instance (or None if it was not found)"""
+        return self._loader._resolve(self._key)
+
+    def __getattr__(self, name):
+        instance = self.resolve()
+        if instance is None:
+            raise AttributeError(
+                f'{self._loader.model.__name__} with primary key '
+                f'{self._key!r} not found (accessing {name!r})')
+        return getattr(instance, name)
+
+    def __bool__(self):
+        return self.resolve() is not None
+
+    def __repr__(self):
+        return f'<DeferredInstance model={self._loader.model.__name__} ' \
+               f'key={self._key!r}>'
+
+
+class ModelLoader:
+    def __init__(self, model):
+        self.model = model
+        self._pending = set()
+        self._cache = {}
+
+    def load(self, id) -> DeferredInstance:
+        """
+        Get a deferred handle to the model instance with the given primary key.
+        """
+        key = int(id)
+        if key not in self._cache:
+            self._pending.add(key)
+        return DeferredInstance(self, key)
+
+    def load_many(self, ids: Iterable[Any]) -> List[DeferredInstance]:
+        return [self.load(id) for id in ids]
+
+    def prime(self, instance):
+        """Add an already-loaded instance to the cache"""
+        key = sa_inspect(self.model).primary_key_from_instance(instance)[0]
+        self._cache[key] = instance
+        self._pending.discard(key)
+
+    def clear(self):
+        self._pending = set()
+        self._cache = {}
+
+    def dispatch(self):
+        """
+        Resolve all of the pending keys (from the session's identity map
+        where possible, otherwise with a single ``IN`` query)
+        """
+        pending = self._pending - self._cache.keys()
+        self._pending = set()
+        if not pending:
+            return
+
+        mapper = sa_inspect(self.model)
+        session = self.model.query.session
+        for key in list(pending):
+            instance = session.identity_map.get(
+                mapper.identity_key_from_primary_key([key]))
+            if instance is not None:
+                self._cache[key] = instance
+                pending.discard(key)
+
+        if pending:
+            pk = mapper.primary_key[0]
+            for instance in self.model.query.filter(pk.in_(pending)):
+                self.prime(instance)
+
+        for key in pending:
+            self._cache.setdefault(key, None)
+
+    def _resolve(self, key):
+        if key not in self._cache:
+            self._pending.add(key)
+            self.dispatch()
+        return self._cache[key]
+
+
+class LoaderDescriptor:
+    def __get__(self, instance, cls) -> ModelLoader:
+        return get_loader(cls)
+
+
+def get_loader(model) -> ModelLoader:
+    """
+    Get the :class:`ModelLoader` for the given model class for the current
+    request (creating it if necessary)
+    """
+    ctx = _request_ctx_stack.top or _app_ctx_stack.top
+    if ctx is None:
+        raise RuntimeError('Model loaders require an active request or '
+                           'application context')
+
+    if not hasattr(ctx, '_sqlalchemy_bundle_loaders'):
+        ctx._sqlalchemy_bundle_loaders = {}
+    if model not in ctx._sqlalchemy_bundle_loaders:
+        ctx._sqlalchemy_bundle_loaders[model] = ModelLoader(model)
+    return ctx._sqlalchemy_bundle_loaders[model]
@@ -8,6 +8,7 @@ from .model_meta_options import (
     AbstractMetaOption,
     LazyMappedMetaOption,
     RelationshipsMetaOption,
+    SerializedRelationshipsMetaOption,
     PolymorphicMetaOption,
     PolymorphicOnColumnMetaOption,
     PolymorphicIdentityMetaOption,
@@ -19,6 +20,9 @@ from .model_meta_options import (
     MetaOption,
     TableMetaOption,
     MaterializedViewForMetaOption,
+    MaterializedViewRefreshMetaOption,
+    MaterializedViewMinIntervalMetaOption,
+    MaterializedViewMaxStalenessMetaOption,
 )
 from .types import McsArgs
 
@@ -47,8 +51,12 @@ class ModelMetaFactory:
             AbstractMetaOption(),  # required; must be first
             LazyMappedMetaOption(),
             RelationshipsMetaOption(),  # requires lazy_mapped
+            SerializedRelationshipsMetaOption(),
             TableMetaOption(),
             MaterializedViewForMetaOption(),
+            MaterializedViewRefreshMetaOption(),
+            MaterializedViewMinIntervalMetaOption(),
+            MaterializedViewMaxStalenessMetaOption(),
 
             PolymorphicMetaOption(),  # must be first of all polymorphic options
             PolymorphicOnColumnMetaOption(),
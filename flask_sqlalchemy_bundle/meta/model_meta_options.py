@@ -113,6 +113,12 @@ class LazyMappedMetaOption(MetaOption):
         super().__init__(name=name, default=default, inherit=inherit)
 
 
+class SerializedRelationshipsMetaOption(MetaOption):
+    def __init__(self, name='serialized_relationships', default=(),
+                 inherit=True):
+        super().__init__(name=name, default=default, inherit=inherit)
+
+
 class RelationshipsMetaOption(MetaOption):
     def __init__(self):
         super().__init__('relationships', inherit=True)
@@ -306,3 +312,61 @@ class MaterializedViewForMetaOption(MetaOption):
 
     def get_value(self, meta, base_model_meta, mcs_args: McsArgs):
         return super().get_value(meta, base_model_meta, mcs_args) or []
+
+
+class MaterializedViewRefreshMetaOption(MetaOption):
+    """
+    When to refresh a materialized view after its ``mv_for`` parent tables
+    change:
+
+    - ``'on_commit'`` (the default): at most once per transaction, after commit
+    - ``'immediate'``: once for every changed row, during the flush
+    - ``'async'``: committed changes only enqueue a refresh request, which a
+      background :class:`~flask_sqlalchemy_bundle.sqla.refresh_worker.MaterializedViewRefreshWorker`
+      handles (see also the ``min_interval`` and ``max_staleness`` options)
+    - ``'incremental'``: keep the view in a summary table that gets updated
+      with the changed rows on every flush (only for single-table ``GROUP BY``
+      views with count/sum/min/max aggregates, other views use ``'on_commit'``)
+    - ``'on_read'``: committed changes only mark the view as stale, and it gets
+      refreshed upon the next access of its ``query`` property
+    """
+    choices = ('on_commit', 'immediate', 'async', 'incremental', 'on_read')
+
+    def __init__(self):
+        super().__init__(name='refresh', default='on_commit', inherit=True)
+
+    def check_value(self, value, mcs_args: McsArgs):
+        msg = '{name} Meta option on {model} must be one of {choices}'.format(
+            name=self.name,
+            model=mcs_args.model_repr,
+            choices=', '.join(f'{c!r}' for c in self.choices))
+        assert value in self.choices, msg
+
+
+class MaterializedViewMinIntervalMetaOption(MetaOption):
+    """
+    The minimum number of seconds between (asynchronous) refreshes of a
+    materialized view
+    """
+    def __init__(self):
+        super().__init__(name='min_interval', default=0, inherit=True)
+
+    def check_value(self, value, mcs_args: McsArgs):
+        msg = f'{self.name} Meta option on {mcs_args.model_repr} ' \
+              f'must be a non-negative number'
+        assert isinstance(value, (int, float)) and value >= 0, msg
+
+
+class MaterializedViewMaxStalenessMetaOption(MetaOption):
+    """
+    The maximum number of seconds an (asynchronously refreshed) materialized
+    view may be stale for, regardless of its ``min_interval``
+    """
+    def __init__(self):
+        super().__init__(name='max_staleness', default=None, inherit=True)
+
+    def check_value(self, value, mcs_args: McsArgs):
+        msg = f'{self.name} Meta option on {mcs_args.model_repr} ' \
+              f'must be None or a non-negative number'
+        assert value is None or (isinstance(value, (int, float))
+                                 and value >= 0), msg
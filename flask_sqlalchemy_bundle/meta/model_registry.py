@@ -9,6 +9,7 @@ from sqlalchemy.ext.declarative import declared_attr
 from sqlalchemy.orm.interfaces import MapperProperty
 from typing import *
 
+from ..serializer import ModelSerializer
 from .types import McsArgs, McsInitArgs
 
 
@@ -86,7 +87,12 @@ class _ModelRegistry:
                 super(DefaultMeta, model_cls).__init__(name, bases, clsdict)
                 model_cls._post_mcs_init()
                 self._initialized.add(name)
-        return {name: self._models[name].cls for name in self._initialized}
+
+        models = {name: self._models[name].cls for name in self._initialized}
+        for model_cls in models.values():
+            if '__serializer__' not in model_cls.__dict__:
+                model_cls.__serializer__ = ModelSerializer(model_cls)
+        return models
 
     def should_initialize(self, model_name):
         if model_name in self._initialized:
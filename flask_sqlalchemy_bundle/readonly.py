@@ -0,0 +1,81 @@
+"""
+Lightweight, read-only row objects for models. These are plain ``__slots__``
+classes (generated once per model) with the same column attribute names as the
+model they represent. They support the model's ``__repr_props__``, its
+``@property`` methods and the instance-level getters of its hybrid properties,
+but they are not instrumented by SQLAlchemy nor tracked by the session.
+"""
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.ext.hybrid import hybrid_property
+from typing import *
+
+
+class ReadonlyRow:
+    """
+    Base class for the read-only row classes generated by :func:`readonly_class`
+    """
+    __slots__ = ()
+    __model__ = None
+    __repr_props__ = ()
+
+    def __setattr__(self, key, value):
+        raise AttributeError(f'{self!r} is read-only')
+
+    def __delattr__(self, key):
+        raise AttributeError(f'{self!r} is read-only')
+
+    def __repr__(self):
+        properties = [f'{prop}={getattr(self, prop)!r}'
+                      for prop in self.__repr_props__ if hasattr(self, prop)]
+        return f"<{self.__model__.__name__} {' '.join(properties)}>"
+
+    @classmethod
+    def _from_row(cls, row):
+        """
+        Create an instance from a result row (overridden for each generated
+        class with code specific to its columns)
+        """
+        raise NotImplementedError
+
+
+def readonly_class(model) -> Type[ReadonlyRow]:
+    """
+    Get (or generate) the read-only row class for the given model class
+    """
+    cls = model.__dict__.get('__readonly_class__')
+    if cls is None:
+        cls = _make_readonly_class(model)
+        setattr(model, '__readonly_class__', cls)
+    return cls
+
+
+def _make_readonly_class(model) -> Type[ReadonlyRow]:
+    columns = tuple(prop.key for prop in sa_inspect(model).column_attrs)
+
+    clsdict = {'__slots__': columns,
+               '__model__': model,
+               '_meta': model._meta,
+               '__module__': model.__module__,
+               '__repr_props__': getattr(model, '__repr_props__', ())}
+    for base in reversed(model.__mro__):
+        for name, value in vars(base).items():
+            if name in columns:
+                continue
+            elif isinstance(value, property):
+                clsdict[name] = value
+            elif isinstance(value, hybrid_property):
+                clsdict[name] = property(value.fget)
+
+    cls = type(f'Readonly{model.__name__}', (ReadonlyRow,), clsdict)
+
+    # setting slots through their descriptors bypasses our __setattr__
+    namespace = {'_new': object.__new__, 'cls': cls}
+    lines = ['def _from_row(row):', '    self = _new(cls)']
+    for i, column in enumerate(columns):
+        namespace[f'_set_{i}'] = getattr(cls, column).__set__
+        lines.append(f'    _set_{i}(self, row[{i}])')
+    lines.append('    return self')
+    exec('\n'.join(lines), namespace)
+
+    cls._from_row = staticmethod(namespace['_from_row'])
+    return cls
@@ -0,0 +1,157 @@
+"""
+Compiled, per-model serializers. Every model gets a :class:`ModelSerializer`
+instance on its ``__serializer__`` attribute once the model registry has
+finalized its mappings. For example::
+
+    class User(db.Model):
+        class Meta:
+            serialized_relationships = ('roles',)
+
+        email = db.Column(db.String)
+        roles = db.relationship('Role')
+
+    User.__serializer__.to_dict(user)
+    # {'id': 1, 'email': 'foo@bar.com', ..., 'roles': [{'id': 1, ...}]}
+
+    User.__serializer__.to_json(user, fields=('id', 'email'))
+    # b'{"id":1,"email":"foo@bar.com"}'
+
+    # stream a JSON array (eg from a Flask view)
+    return Response(User.__serializer__.iter_json(User.query.as_readonly()),
+                    mimetype='application/json')
+"""
+import datetime as dt
+import json
+import uuid
+
+from decimal import Decimal
+from enum import Enum
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.ext.hybrid import HYBRID_PROPERTY
+from typing import *
+
+from .readonly import ReadonlyRow
+
+
+class ModelSerializer:
+    """
+    Converts instances of a model (or its read-only rows) to dicts and JSON,
+    using code generated (once per set of fields) specifically for the model.
+
+    By default, the serialized fields are the model's columns, its hybrid
+    properties, and the relationships listed in its
+    ``Meta.serialized_relationships``. Related instances are serialized using
+    their own model's columns and hybrid properties. (Relationships are always
+    skipped when serializing read-only rows, because they do not have them.)
+    """
+    def __init__(self, model):
+        self.model = model
+        self._compiled = {}
+
+    @property
+    def column_fields(self) -> Tuple[str, ...]:
+        mapper = sa_inspect(self.model)
+        hybrids = [name for name, descriptor in mapper.all_orm_descriptors.items()
+                   if descriptor.extension_type is HYBRID_PROPERTY]
+        return tuple(prop.key for prop in mapper.column_attrs) + tuple(hybrids)
+
+    @property
+    def fields(self) -> Tuple[str, ...]:
+        return (self.column_fields
+                + tuple(self.model._meta.serialized_relationships or ()))
+
+    def to_dict(self, obj, fields: Optional[Iterable[str]] = None) -> dict:
+        """
+        :param obj: The model instance (or read-only row) to serialize.
+        :param fields: An optional subset of field names to serialize.
+        """
+        readonly = isinstance(obj, ReadonlyRow)
+        return self._get_compiled(fields, readonly)(obj)
+
+    def to_json(self, obj, fields: Optional[Iterable[str]] = None) -> bytes:
+        return _dumps(self.to_dict(obj, fields))
+
+    def iter_json(self, objs: Iterable[Any],
+                  fields: Optional[Iterable[str]] = None,
+                  chunk_size: int = 100,
+                  ) -> Iterator[bytes]:
+        """
+        Serialize the instances (or read-only rows) from the given iterable
+        (for example, a query) as a JSON array, yielding it in chunks of
+        ``chunk_size`` objects (so the whole array never needs to be in memory).
+        """
+        yield b'['
+        chunk = []
+        separator = b''
+        for obj in objs:
+            chunk.append(self.to_json(obj, fields))
+            if len(chunk) >= chunk_size:
+                yield separator + b','.join(chunk)
+                separator = b','
+                chunk = []
+        if chunk:
+            yield separator + b','.join(chunk)
+        yield b']'
+
+    def _get_compiled(self, fields, readonly):
+        fields = tuple(fields) if fields is not None else self.fields
+        key = (fields, readonly)
+        if key not in self._compiled:
+            self._compiled[key] = self._compile(fields, readonly)
+        return self._compiled[key]
+
+    def _compile(self, fields, readonly):
+        mapper = sa_inspect(self.model)
+        column_fields = set(self.column_fields)
+
+        namespace = {}
+        items = []
+        for i, name in enumerate(fields):
+            if name in column_fields:
+                items.append(f'{name!r}: obj.{name}')
+                continue
+            elif name not in mapper.relationships:
+                raise ValueError(f'{self.model.__name__} has no column, hybrid '
+                                 f'property or relationship named {name!r}')
+            elif readonly:
+                continue
+
+            relationship = mapper.relationships[name]
+            related_serializer = _get_serializer(relationship.mapper.class_)
+            namespace[f'_dump_{i}'] = related_serializer._get_compiled(
+                related_serializer.column_fields, readonly=False)
+            if relationship.uselist:
+                items.append(f'{name!r}: [_dump_{i}(o) for o in obj.{name}]')
+            else:
+                items.append(f'{name!r}: (None if obj.{name} is None '
+                             f'else _dump_{i}(obj.{name}))')
+
+        exec('def to_dict(obj):\n'
+             '    return {%s}' % ', '.join(items), namespace)
+        return namespace['to_dict']
+
+
+def _get_serializer(model) -> ModelSerializer:
+    serializer = model.__dict__.get('__serializer__')
+    if serializer is None:
+        serializer = ModelSerializer(model)
+        setattr(model, '__serializer__', serializer)
+    return serializer
+
+
+def _json_default(value):
+    if isinstance(value, (dt.date, dt.datetime, dt.time)):
+        return value.isoformat()
+    elif isinstance(value, Decimal):
+        return float(value)
+    elif isinstance(value, Enum):
+        return value.value
+    elif isinstance(value, uuid.UUID):
+        return str(value)
+    raise TypeError(f'Object of type {type(value).__name__} '
+                    'is not JSON serializable')
+
+
+def _dumps(data) -> bytes:
+    return json.dumps(data, default=_json_default,
+                      separators=(',', ':')).encode('utf-8')
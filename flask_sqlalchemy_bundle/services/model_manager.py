@@ -1,4 +1,11 @@
+from collections import defaultdict
 from flask_unchained import unchained
+from sqlalchemy import inspect as sa_inspect, tuple_
+from sqlalchemy.orm import aliased
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.sql import operators
+from sqlalchemy.sql.elements import BinaryExpression, BooleanClauseList
+from sqlalchemy.schema import Column
 from typing import *
 
 from ..base_model import BaseModel as Model
@@ -56,5 +63,164 @@ class ModelManager(SessionManager):
     def find_all(self) -> List[model]:
         return self.q.all()
 
-    def find_by(self, **kwargs) -> List[model]:
-        return self.q.filter_by(**kwargs).all()
+    def find_by(self, readonly=False, **kwargs) -> List[model]:
+        """
+        :param readonly: Whether or not to return lightweight, read-only row
+                         objects instead of model instances
+        """
+        q = self.q.filter_by(**kwargs)
+        if readonly:
+            q = q.as_readonly()
+        return q.all()
+
+    def exists_by(self, **kwargs) -> bool:
+        return self.q.exists_by(**kwargs)
+
+    def count_by(self, **kwargs) -> int:
+        return self.q.count_by(**kwargs)
+
+    def pluck(self, column, **kwargs) -> list:
+        return self.q.pluck(column, **kwargs)
+
+    def load_related(self, instances: List[model], *paths: str) -> List[model]:
+        """
+        Batch-load relationships for already-fetched instances, using one
+        ``IN`` query per relationship path (instead of one lazy load per
+        instance). The loaded values are set as committed state, so nothing
+        gets marked as dirty. Relationships which are already loaded on an
+        instance are left untouched.
+
+        For example::
+
+            users = user_manager.find_all()
+            user_manager.load_related(users, 'roles', 'posts.tags')
+
+        Relationship names may also be given by the related model's class name,
+        as recorded in the model's ``Meta.relationships``.
+
+        :param instances: The instances to load the relationships for.
+        :param paths: Dot-separated relationship paths to load.
+        """
+        tree = {}
+        for path in paths:
+            node = tree
+            for name in path.split('.'):
+                node = node.setdefault(name, {})
+
+        self._load_related(self.model, instances, tree)
+        return instances
+
+    def _load_related(self, model, instances, tree):
+        mapper = sa_inspect(model)
+        for name, subtree in tree.items():
+            prop = _get_relationship(mapper, name)
+            unloaded = [instance for instance in instances
+                        if prop.key in sa_inspect(instance).unloaded]
+            if unloaded:
+                self._load_relationship(prop, unloaded)
+
+            if subtree:
+                related = {}
+                for instance in instances:
+                    value = getattr(instance, prop.key)
+                    for obj in (value if prop.uselist else [value]):
+                        if obj is not None:
+                            related[id(obj)] = obj
+                self._load_related(prop.mapper.class_, list(related.values()),
+                                   subtree)
+
+    def _load_relationship(self, prop, instances):
+        if (_is_column_equality(prop.primaryjoin)
+                and (prop.secondary is None
+                     or _is_column_equality(prop.secondaryjoin))):
+            keys_by_instance, query = self._query_by_join_keys(prop, instances)
+        else:
+            # joins with other criteria (eg on the parent's columns) need the
+            # parent in the query, so select the related rows through it
+            keys_by_instance, query = self._query_through_parent(prop,
+                                                                 instances)
+
+        related = defaultdict(list)
+        if query is not None:
+            if prop.order_by:
+                query = query.order_by(*prop.order_by)
+            for obj, *key in query:
+                related[tuple(key)].append(obj)
+
+        for instance in instances:
+            values = related.get(keys_by_instance.get(id(instance)), [])
+            if not prop.uselist:
+                values = values[0] if values else None
+            set_committed_value(instance, prop.key, values)
+
+    def _query_by_join_keys(self, prop, instances):
+        if prop.secondary is not None:
+            pairs = prop.synchronize_pairs
+        else:
+            pairs = prop.local_remote_pairs
+        local_keys = [prop.parent.get_property_by_column(local).key
+                      for local, _ in pairs]
+        remote_cols = [remote for _, remote in pairs]
+
+        keys_by_instance = {}
+        for instance in instances:
+            key = tuple(getattr(instance, k) for k in local_keys)
+            if None not in key:
+                keys_by_instance[id(instance)] = key
+        keys = set(keys_by_instance.values())
+        if not keys:
+            return keys_by_instance, None
+
+        query = self.db.session.query(prop.mapper, *remote_cols)
+        if prop.secondary is not None:
+            query = query.join(prop.secondary, prop.secondaryjoin)
+        if len(remote_cols) == 1:
+            return keys_by_instance, query.filter(
+                remote_cols[0].in_([k for k, in keys]))
+        return keys_by_instance, query.filter(
+            tuple_(*remote_cols).in_(list(keys)))
+
+    def _query_through_parent(self, prop, instances):
+        keys_by_instance = {}
+        for instance in instances:
+            identity = sa_inspect(instance).identity
+            if identity is not None:
+                keys_by_instance[id(instance)] = identity
+        keys = set(keys_by_instance.values())
+        if not keys:
+            return keys_by_instance, None
+
+        parent = aliased(prop.parent)
+        pk_cols = [getattr(parent, prop.parent.get_property_by_column(col).key)
+                   for col in prop.parent.primary_key]
+        query = (self.db.session.query(prop.mapper, *pk_cols)
+                 .select_from(parent)
+                 .join(getattr(parent, prop.key)))
+        if len(pk_cols) == 1:
+            return keys_by_instance, query.filter(
+                pk_cols[0].in_([k for k, in keys]))
+        return keys_by_instance, query.filter(
+            tuple_(*pk_cols).in_(list(keys)))
+
+
+def _is_column_equality(clause):
+    """Whether the join condition only equates columns (``a = b AND ...``)"""
+    if (isinstance(clause, BooleanClauseList)
+            and clause.operator is operators.and_):
+        return all(_is_column_equality(c) for c in clause.clauses)
+    return (isinstance(clause, BinaryExpression)
+            and clause.operator is operators.eq
+            and isinstance(clause.left, Column)
+            and isinstance(clause.right, Column))
+
+
+def _get_relationship(mapper, name):
+    if name not in mapper.relationships:
+        # support using the related model's name, as declared in (or
+        # discovered for) the model's Meta.relationships
+        name = (mapper.class_._meta.relationships or {}).get(name, name)
+    try:
+        return mapper.relationships[name]
+    except KeyError:
+        raise ValueError(f'{mapper.class_.__name__} has no relationship '
+                         f'named {name!r}')
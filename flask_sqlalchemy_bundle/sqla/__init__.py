@@ -5,9 +5,20 @@ from sqlalchemy.ext.hybrid import hybrid_method, hybrid_property
 
 from .column import Column
 from .events import attach_events, on, slugify
+from .incremental_view import (IncrementalViewPlan,
+                               rebuild_incremental_view,
+                               record_incremental_view_change)
 from .materialized_view import (create_materialized_view,
+                                get_refresh_options,
+                                get_selected_columns,
+                                mark_materialized_view_stale,
+                                mark_on_read_view_stale,
                                 refresh_materialized_view,
-                                refresh_all_materialized_views)
+                                refresh_all_materialized_views,
+                                refresh_on_read_view_if_stale,
+                                request_materialized_view_refresh)
+from .refresh_stats import get_all_freshness, get_freshness
+from .refresh_worker import MaterializedViewRefreshWorker
 from .relationships import foreign_key
 from .types import BigInteger, DateTime
 
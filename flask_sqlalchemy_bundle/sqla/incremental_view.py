@@ -0,0 +1,338 @@
+"""
+Incrementally maintained materialized views (``Meta.refresh = 'incremental'``).
+
+Views whose ``selectable()`` is a single-table ``GROUP BY`` query selecting
+only its group by columns and ``count``, ``sum``, ``min`` or ``max`` aggregates
+of the table's columns are stored in a real (summary) table instead of a
+materialized view. Changes to the parent table are applied to the summary table
+at the end of every flush (in the same transaction), so the cost of keeping
+the view up to date scales with the number of changed rows rather than with
+the size of the parent table:
+
+- ``count`` and ``sum`` (of non-nullable columns) are maintained with deltas
+- ``min`` and ``max`` are maintained with deltas for inserts, but the affected
+  groups get recomputed when their rows are updated or deleted
+
+Deltas get upserted with ``INSERT ... ON CONFLICT`` on PostgreSQL. On other
+dialects (eg SQLite, which serializes writers) they're applied with an
+``UPDATE`` of the group, followed by an ``INSERT`` if the group didn't exist.
+
+Summary tables get populated when they're created by ``db.create_all()``, and
+autogenerated migrations creating them populate them as well (see
+:class:`~flask_sqlalchemy_bundle.alembic.PopulateIncrementalViewOp`). Summary
+tables created any other way must be rebuilt before use (eg with
+``MaterializedView.refresh()``), because deltas applied to an empty summary
+table yield wrong totals.
+
+Views with ``Meta.refresh = 'incremental'`` whose selectable has any other shape
+fall back to regular materialized views (refreshed once per transaction).
+"""
+import time
+
+from flask_unchained import unchained, injectable
+from sqlalchemy import (and_, case, event, exists, func, inspect as sa_inspect,
+                        or_)
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session, object_session
+from sqlalchemy.schema import Column, Table
+from sqlalchemy.sql.elements import ColumnClause, Label
+from sqlalchemy.sql.expression import Select
+from sqlalchemy.sql.functions import FunctionElement
+from typing import *
+
+from .refresh_stats import get_refresh_stats_table, record_refresh
+
+
+_AGGREGATES = ('count', 'sum', 'min', 'max')
+
+
+class IncrementalViewPlan:
+    """
+    Describes how to incrementally maintain a view's summary table.
+
+    :param selectable: The view's selectable.
+    :param parent: The (parent) table the selectable groups.
+    :param keys: ``(label, parent_column)`` tuples for the group by columns.
+    :param aggregates: ``(label, function_name, parent_column)`` tuples for the
+                       aggregates (the column is None for ``count(*)``).
+    """
+    def __init__(self, selectable, parent: Table,
+                 keys: List[Tuple[str, Column]],
+                 aggregates: List[Tuple[str, str, Optional[Column]]]):
+        self.selectable = selectable
+        self.parent = parent
+        self.keys = keys
+        self.aggregates = aggregates
+        self.table = None
+
+        # whether removing rows can be applied as (negative) deltas
+        self.invertible = all(fn == 'count' or (fn == 'sum' and not col.nullable)
+                              for _, fn, col in aggregates)
+
+        columns = [col for _, col in keys]
+        columns += [col for _, _, col in aggregates
+                    if col is not None and col not in columns]
+        self.columns = columns
+
+    @classmethod
+    def from_selectable(cls, selectable) -> Optional['IncrementalViewPlan']:
+        """
+        Get the plan for the given selectable, or None if it cannot be
+        incrementally maintained
+        """
+        if not isinstance(selectable, Select):
+            return None
+
+        froms = selectable.froms
+        if len(froms) != 1 or not isinstance(froms[0], Table):
+            return None
+        parent = froms[0]
+
+        if (selectable._whereclause is not None
+                or selectable._having is not None
+                or selectable._distinct
+                or selectable._limit_clause is not None
+                or selectable._offset_clause is not None):
+            return None
+
+        group_by = list(selectable._group_by_clause.clauses)
+        if not group_by or not all(_is_column_of(col, parent)
+                                   for col in group_by):
+            return None
+        group_by_names = {col.name for col in group_by}
+
+        keys, aggregates = [], []
+        for column in selectable.inner_columns:
+            element = column.element if isinstance(column, Label) else column
+            if _is_column_of(element, parent) and element.name in group_by_names:
+                keys.append((column.name, parent.c[element.name]))
+                continue
+            elif (not isinstance(element, FunctionElement)
+                  or element.name not in _AGGREGATES):
+                return None
+
+            args = list(element.clauses)
+            if (element.name == 'count' and len(args) == 1
+                    and isinstance(args[0], ColumnClause) and args[0].name == '*'):
+                aggregates.append((column.name, 'count', None))
+            elif len(args) == 1 and _is_column_of(args[0], parent):
+                aggregates.append((column.name, element.name,
+                                   parent.c[args[0].name]))
+            else:
+                return None
+
+        if {col.name for _, col in keys} != group_by_names:
+            return None
+        return cls(selectable, parent, keys, aggregates)
+
+    def get_values(self, mapper, target, old=False) -> Dict[str, Any]:
+        """
+        Get the values of the relevant parent columns from the target
+        instance (optionally their values from before the current flush)
+        """
+        values = {}
+        for col in self.columns:
+            key = mapper.get_property_by_column(col).key
+            if old:
+                history = _history(target, key)
+                if history.deleted:
+                    values[col.name] = history.deleted[0]
+                    continue
+            values[col.name] = getattr(target, key)
+        return values
+
+    def apply(self, conn, changes: List[Tuple[int, Dict[str, Any]]]):
+        """
+        Apply the given ``(sign, values)`` changes of parent rows (+1 for
+        added rows, -1 for removed rows) to the summary table
+        """
+        groups = {}
+        for sign, values in changes:
+            key = tuple(values[col.name] for _, col in self.keys)
+            groups.setdefault(key, []).append((sign, values))
+
+        for key, rows in groups.items():
+            removed = any(sign < 0 for sign, _ in rows)
+            if removed and not self.invertible:
+                self._recompute_group(conn, key)
+                continue
+
+            self._upsert_delta(conn, key, rows)
+            if removed:
+                conn.execute(self.table.delete().where(and_(
+                    self._key_clause(self.table, key),
+                    ~exists().where(self._key_clause(self.parent, key)))))
+
+    def rebuild(self, conn):
+        """Fully rebuild the summary table, returning its row count"""
+        conn.execute(self.table.delete())
+        return self._insert_from_select(conn, self.selectable)
+
+    def _upsert_delta(self, conn, key, rows):
+        values = {label: value for (label, _), value in zip(self.keys, key)}
+        for label, fn, col in self.aggregates:
+            if fn == 'count':
+                values[label] = sum(sign for sign, row in rows
+                                    if col is None or row[col.name] is not None)
+                continue
+
+            column_values = [(sign, row[col.name]) for sign, row in rows
+                             if row[col.name] is not None]
+            if not column_values:
+                values[label] = None
+            elif fn == 'sum':
+                values[label] = sum(sign * value for sign, value in column_values)
+            else:
+                values[label] = (min if fn == 'min' else max)(
+                    value for _, value in column_values)
+
+        if conn.dialect.name != 'postgresql':
+            self._update_or_insert_delta(conn, key, values)
+            return
+
+        stmt = pg_insert(self.table).values(**values)
+        set_ = {}
+        for label, fn, _ in self.aggregates:
+            current, delta = self.table.c[label], stmt.excluded[label]
+            if fn == 'count':
+                set_[label] = current + delta
+            elif fn == 'sum':
+                set_[label] = func.coalesce(current + delta, current, delta)
+            else:
+                set_[label] = (func.least if fn == 'min'
+                               else func.greatest)(current, delta)
+        conn.execute(stmt.on_conflict_do_update(
+            index_elements=[label for label, _ in self.keys], set_=set_))
+
+    def _update_or_insert_delta(self, conn, key, values):
+        set_ = {}
+        for label, fn, _ in self.aggregates:
+            current, delta = self.table.c[label], values[label]
+            if fn == 'count':
+                set_[label] = current + delta
+            elif delta is None:
+                continue
+            elif fn == 'sum':
+                set_[label] = func.coalesce(current, 0) + delta
+            else:
+                replace = current > delta if fn == 'min' else current < delta
+                set_[label] = case([(or_(current.is_(None), replace), delta)],
+                                   else_=current)
+
+        result = conn.execute(self.table.update()
+                              .where(self._key_clause(self.table, key))
+                              .values(**set_))
+        if not result.rowcount:
+            conn.execute(self.table.insert().values(**values))
+
+    def _recompute_group(self, conn, key):
+        conn.execute(self.table.delete().where(
+            self._key_clause(self.table, key)))
+        self._insert_from_select(conn, self.selectable.where(
+            self._key_clause(self.parent, key)))
+
+    def _insert_from_select(self, conn, selectable):
+        return conn.execute(self.table.insert().from_select(
+            [column.name for column in self.selectable.inner_columns],
+            selectable)).rowcount
+
+    def _key_clause(self, table, key):
+        if table is self.parent:
+            columns = [col for _, col in self.keys]
+        else:
+            columns = [table.c[label] for label, _ in self.keys]
+        return and_(*[col == value for col, value in zip(columns, key)])
+
+
+@unchained.inject('db')
+def create_incremental_view(name, plan: IncrementalViewPlan, db=injectable):
+    """
+    Create the summary table for an incrementally maintained view (in the
+    regular metadata, so it gets created, dropped and migrated like any other
+    table). The table's primary key is the view's group by columns.
+    """
+    key_labels = {label for label, _ in plan.keys}
+    table = db.Table(name, db.metadata, *[
+        db.Column(col.name, col.type, primary_key=col.name in key_labels,
+                  nullable=col.name not in key_labels)
+        for col in plan.selectable.c
+    ], info={'incremental_view_plan': plan})
+    plan.table = table
+    get_refresh_stats_table(db.metadata)
+
+    # to support using db.create_all()
+    @db.event.listens_for(db.metadata, 'after_create')
+    def populate(target, connection, **kwargs):
+        plan.rebuild(connection)
+
+    return table
+
+
+@unchained.inject('db')
+def rebuild_incremental_view(plan: IncrementalViewPlan, bind=None,
+                             trigger='manual', db=injectable):
+    """
+    Fully rebuild an incrementally maintained view's summary table, using
+    ``db.session`` by default (or in its own transaction on ``bind``).
+    """
+    started = time.perf_counter()
+    if bind is None:
+        row_count = plan.rebuild(db.session)
+        record_refresh(db.session, db.metadata, plan.table.name, trigger,
+                       time.perf_counter() - started, row_count)
+        return
+
+    with bind.connect() as conn, conn.begin():
+        row_count = plan.rebuild(conn)
+        record_refresh(conn, db.metadata, plan.table.name, trigger,
+                       time.perf_counter() - started, row_count)
+
+
+def record_incremental_view_change(view, mapper, target, op):
+    """
+    Record the change (``op`` is one of ``'insert'``, ``'update'`` or
+    ``'delete'``) of the target parent instance, to be applied to the view's
+    summary table once the current flush finishes. (Updates and deletes must
+    be recorded before they get flushed, and inserts after.)
+    """
+    plan = view.__table__.info['incremental_view_plan']
+    if op == 'update':
+        if not any(_history(target, mapper.get_property_by_column(col).key)
+                   .has_changes() for col in plan.columns):
+            return
+        changes = [(-1, plan.get_values(mapper, target, old=True)),
+                   (1, plan.get_values(mapper, target))]
+    elif op == 'delete':
+        changes = [(-1, plan.get_values(mapper, target, old=True))]
+    else:
+        changes = [(1, plan.get_values(mapper, target))]
+
+    session = object_session(target)
+    session.info.setdefault(_CHANGES_KEY, {}).setdefault(view, []).extend(changes)
+
+
+_CHANGES_KEY = 'incremental_view_changes'
+
+
+@event.listens_for(Session, 'after_flush')
+def _apply_incremental_view_changes(session, flush_context):
+    changes = session.info.pop(_CHANGES_KEY, None)
+    if not changes:
+        return
+
+    for view, view_changes in changes.items():
+        conn = session.connection(mapper=view.__mapper__)
+        view.__table__.info['incremental_view_plan'].apply(conn, view_changes)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _clear_incremental_view_changes(session):
+    session.info.pop(_CHANGES_KEY, None)
+
+
+def _history(target, key):
+    return sa_inspect(target).attrs[key].history
+
+
+def _is_column_of(element, table):
+    return isinstance(element, Column) and element.table is table
@@ -1,16 +1,49 @@
+import datetime as dt
+import logging
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
 from flask_unchained import unchained, injectable
+from sqlalchemy import MetaData, event, inspect as sa_inspect, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.ext.compiler import compiles
-from sqlalchemy.schema import DDLElement
+from sqlalchemy.orm import Session, object_session
+from sqlalchemy.schema import Column, CreateTable, DDLElement
+from sqlalchemy.sql import visitors
+from sqlalchemy.sql.elements import ColumnClause, TextClause
+from sqlalchemy.sql.util import find_tables
+from typing import *
+
+from .incremental_view import IncrementalViewPlan, create_incremental_view
+from .refresh_stats import (claim_stale, get_refresh_stats_table, is_stale,
+                            mark_stale, record_refresh, refreshed_since)
+
+
+logger = logging.getLogger(__name__)
 
 
 # SQLAlchemy PostgreSQL Materialized Views
 # http://www.jeffwidman.com/blog/847/using-sqlalchemy-to-create-and-manage-postgresql-materialized-views/
 
+# on other dialects (eg SQLite), materialized views are emulated using regular
+# tables (created from the views' table definitions) storing the results of
+# their selectables. refreshing them concurrently builds a new table and swaps
+# it in place of the old one (within a single transaction), otherwise their
+# rows get replaced in place.
+
 # the db extension must be injected both to prevent circular imports, and to
 # make sure we're getting the correct instance (if the user has overridden ours)
 
 @unchained.inject('db')
-def create_materialized_view(name, selectable, db=injectable):
+def create_materialized_view(name, selectable, incremental=False, db=injectable):
+    if incremental:
+        plan = IncrementalViewPlan.from_selectable(selectable)
+        if plan is not None:
+            return create_incremental_view(name, plan)
+
     # must use a temporary metadata here so that SQLAlchemy doesn't detect the
     # table as "standalone". (it will still use the correct metadata once
     # attached to the __table__ attribute of the declarative base model)
@@ -23,9 +56,10 @@ def create_materialized_view(name, selectable, db=injectable):
         table.append_constraint(
             db.PrimaryKeyConstraint(*[col.name for col in selectable.c]))
 
-    # # to support using db.create_all()
-    db.event.listen(db.metadata, 'after_create',
-                    _CreateMaterializedView(name, selectable))
+    # to support using db.create_all()
+    @db.event.listens_for(db.metadata, 'after_create')
+    def create_view(target, connection, **kwargs):
+        _create_view(connection, name, selectable, table)
 
     # to support using db.create_all()
     @db.event.listens_for(db.metadata, 'after_create')
@@ -34,27 +68,416 @@ def create_materialized_view(name, selectable, db=injectable):
             idx.create(connection)
 
     # to support using db.drop_all()
-    db.event.listen(db.metadata, 'before_drop',
-                    db.DDL(f'DROP MATERIALIZED VIEW IF EXISTS {name}'))
+    db.event.listen(db.metadata, 'before_drop', _DropMaterializedView(name))
+
+    # to support column-aware invalidation
+    table.info['selectable'] = selectable
 
     # to support auto-generated migrations
     db.metadata.info.setdefault('materialized_views', set()).add((name, selectable))
     db.metadata.info.setdefault('materialized_tables', {})[name] = table
+    get_refresh_stats_table(db.metadata)
 
     return table
 
 
 @unchained.inject('db')
-def refresh_materialized_view(name, concurrently=True, db=injectable):
+def refresh_materialized_view(name, concurrently=True, bind=None,
+                              trigger='manual', lock_timeout=None,
+                              statement_timeout=None, on_locked=None,
+                              db=injectable):
+    """
+    Refresh the named materialized view, returning whether it got refreshed.
+    The refresh gets recorded (see :mod:`~flask_sqlalchemy_bundle.sqla.refresh_stats`)
+    with the given ``trigger``.
+
+    On PostgreSQL, views get refreshed in their own short transaction on a
+    dedicated connection (from ``bind`` if it's an engine, otherwise from the
+    engine of ``db.session``), so the caller's transaction (and its locks)
+    doesn't have to wait for the refresh. Each view is guarded by an advisory
+    lock, so that only one process refreshes it at a time. If the lock is
+    held by somebody else, ``on_locked`` determines what happens:
+
+    - ``'coalesce'`` (the default): wait for the lock, and then only refresh
+      if the other refresh started before this one was requested
+    - ``'skip'``: don't refresh at all
+
+    ``lock_timeout`` and ``statement_timeout`` (in seconds) optionally limit the
+    time spent waiting for locks and refreshing, respectively. The defaults of
+    these three options come from the ``SQLALCHEMY_MATERIALIZED_VIEW_REFRESH_*``
+    config settings (see :func:`get_refresh_options`).
+
+    If ``bind`` is a connection (or session), the view gets refreshed on it
+    as-is, within whatever transaction it may be in.
+    """
+    started = time.perf_counter()
+    if not _is_native(bind or db.session.get_bind()):
+        if bind is None:
+            row_count = _refresh_emulated_view(db.session.connection(), name,
+                                               concurrently, db.metadata)
+            record_refresh(db.session, db.metadata, name, trigger,
+                           time.perf_counter() - started, row_count)
+        else:
+            with bind.connect() as conn, conn.begin():
+                row_count = _refresh_emulated_view(conn, name, concurrently,
+                                                   db.metadata)
+                record_refresh(conn, db.metadata, name, trigger,
+                               time.perf_counter() - started, row_count)
+        return True
+
     concurrently = concurrently and 'CONCURRENTLY ' or ''
-    db.session.execute(f'REFRESH MATERIALIZED VIEW {concurrently}{name}')
+    sql = f'REFRESH MATERIALIZED VIEW {concurrently}{name}'
+    bind = bind if bind is not None else db.session.get_bind()
+    if not isinstance(bind, Engine):
+        bind.execute(text(sql).execution_options(autocommit=True))
+        record_refresh(bind, db.metadata, name, trigger,
+                       time.perf_counter() - started)
+        return True
+
+    defaults = get_refresh_options()
+    if lock_timeout is None:
+        lock_timeout = defaults['lock_timeout']
+    if statement_timeout is None:
+        statement_timeout = defaults['statement_timeout']
+    if on_locked is None:
+        on_locked = defaults['on_locked']
+    assert on_locked in {'coalesce', 'skip'}, \
+        "on_locked must be one of 'coalesce' or 'skip'"
+
+    requested_at = dt.datetime.now(dt.timezone.utc)
+    with bind.connect() as conn, conn.begin():
+        for setting, seconds in [('lock_timeout', lock_timeout),
+                                 ('statement_timeout', statement_timeout)]:
+            if seconds is not None:
+                conn.execute(f"SET LOCAL {setting} = '{int(seconds * 1000)}ms'")
+
+        lock_key = f'materialized_view:{name}'
+        if not conn.execute(_TRY_LOCK_SQL, key=lock_key).scalar():
+            if on_locked == 'skip':
+                return False
+            conn.execute(_LOCK_SQL, key=lock_key)
+            if refreshed_since(conn, db.metadata, name, requested_at):
+                return False
+
+        started = time.perf_counter()
+        conn.execute(sql)
+        record_refresh(conn, db.metadata, name, trigger,
+                       time.perf_counter() - started)
+    return True
+
+
+def get_refresh_options(config=None) -> Dict[str, Any]:
+    """
+    Get the default ``lock_timeout``, ``statement_timeout`` and ``on_locked``
+    options of :func:`refresh_materialized_view` from the given config (or
+    from the current app's, if any). Threads without an app context must get
+    them passed from their caller.
+    """
+    if config is None:
+        config = current_app.config if current_app else {}
+    return {
+        'lock_timeout': config.get(
+            'SQLALCHEMY_MATERIALIZED_VIEW_REFRESH_LOCK_TIMEOUT'),
+        'statement_timeout': config.get(
+            'SQLALCHEMY_MATERIALIZED_VIEW_REFRESH_STATEMENT_TIMEOUT'),
+        'on_locked': config.get(
+            'SQLALCHEMY_MATERIALIZED_VIEW_REFRESH_ON_LOCKED', 'coalesce'),
+    }
+
+
+# transaction-level advisory locks (released upon commit or rollback)
+_TRY_LOCK_SQL = text('SELECT pg_try_advisory_xact_lock(hashtext(:key))')
+_LOCK_SQL = text('SELECT pg_advisory_xact_lock(hashtext(:key))')
 
 
 @unchained.inject('db')
-def refresh_all_materialized_views(concurrently=True, db=injectable):
-    materialized_views = db.inspect(db.engine).get_view_names(include='materialized')
-    for materialized_view in materialized_views:
-        refresh_materialized_view(materialized_view, concurrently)
+def refresh_all_materialized_views(concurrently=True, max_workers=4,
+                                   trigger='manual', db=injectable):
+    """
+    Refresh all of the materialized views in the database, respecting the
+    dependencies between them: views are refreshed level by level, such that
+    every view gets refreshed after the views it selects from. The views of
+    each level are refreshed in parallel (each on its own pooled connection,
+    using up to ``max_workers`` threads), and each refresh gets committed
+    separately (see :func:`refresh_materialized_view`).
+
+    Emulated views (on dialects without materialized views) always get
+    refreshed serially, since they're refreshed with regular DDL.
+    """
+    engine = db.engine
+    levels = _get_refresh_levels(engine, db.metadata)
+    if not _is_native(engine):
+        max_workers = 1
+
+    # the worker threads don't have an app context
+    options = get_refresh_options()
+
+    def refresh(name):
+        refresh_materialized_view(name, concurrently, bind=engine,
+                                  trigger=trigger, **options)
+
+    if max_workers <= 1:
+        for level in levels:
+            for name in level:
+                refresh(name)
+        return
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for level in levels:
+            # wait for (and re-raise any errors from) the entire level before
+            # moving on to the views that depend upon it
+            for future in [executor.submit(refresh, name) for name in level]:
+                future.result()
+
+
+def _get_refresh_levels(bind, metadata) -> List[List[str]]:
+    """
+    Group the names of the materialized views in the database into levels,
+    such that each view only depends upon views in previous levels.
+    """
+    if _is_native(bind):
+        names = set(sa_inspect(bind).get_view_names(include='materialized'))
+    else:
+        names = {name for name, _ in metadata.info.get('materialized_views', ())}
+    depends_on = {name: set() for name in names}
+
+    # dependencies of (and through) views, as recorded by postgres
+    view_deps = {}
+    if _is_native(bind):
+        for dependent, source in bind.execute(_VIEW_DEPENDENCIES_SQL):
+            view_deps.setdefault(dependent, set()).add(source)
+
+    def sources(name, seen):
+        for source in view_deps.get(name, ()):
+            if source in seen:
+                continue
+            seen.add(source)
+            if source in names:
+                yield source
+            else:  # a plain view, look through it
+                yield from sources(source, seen)
+
+    for name in names:
+        depends_on[name].update(sources(name, {name}))
+
+    # dependencies declared by our selectables (not necessarily created yet),
+    # including the tables inside of their joins and subqueries
+    for name, selectable in metadata.info.get('materialized_views', ()):
+        if name in names:
+            depends_on[name].update(
+                table.name for table in find_tables(selectable)
+                if table.name in names and table.name != name)
+
+    levels = []
+    while depends_on:
+        level = sorted(name for name, deps in depends_on.items() if not deps)
+        if not level:
+            raise Exception('Cyclic dependencies between materialized views: '
+                            + ', '.join(sorted(depends_on)))
+        levels.append(level)
+        for name in level:
+            del depends_on[name]
+        for deps in depends_on.values():
+            deps.difference_update(level)
+    return levels
+
+
+_VIEW_DEPENDENCIES_SQL = text("""
+    SELECT DISTINCT dependent.relname, source.relname
+    FROM pg_depend d
+    JOIN pg_rewrite r ON r.oid = d.objid
+    JOIN pg_class dependent ON dependent.oid = r.ev_class
+    JOIN pg_class source ON source.oid = d.refobjid
+    WHERE dependent.relkind IN ('m', 'v')
+      AND source.relkind IN ('m', 'v')
+      AND dependent.oid != source.oid
+      AND pg_table_is_visible(dependent.oid)
+""")
+
+
+def get_selected_columns(selectable, tables) -> Optional[Set[Column]]:
+    """
+    Get the columns of the given tables that the selectable reads (anywhere,
+    eg in its columns, joins, where or group by clauses, or subqueries), or
+    None if it cannot be determined (because it contains literal SQL)
+    """
+    tables = set(tables)
+    columns = set()
+    for element in visitors.iterate(selectable, {'column_collections': False}):
+        if isinstance(element, TextClause):
+            return None
+        elif not isinstance(element, ColumnClause):
+            continue
+        elif element.is_literal:
+            if element.name != '*':
+                return None
+        elif isinstance(element, Column):
+            table = getattr(element.table, 'original', element.table)
+            if table in tables:
+                columns.add(table.c[element.name])
+    return columns
+
+
+# the PostgreSQL NOTIFY channel used to request asynchronous refreshes of
+# materialized views (see the refresh_worker module)
+REFRESH_CHANNEL = 'refresh_materialized_view'
+
+
+def request_materialized_view_refresh(name, bind):
+    """
+    Ask the background refresh worker(s) to refresh the named materialized
+    view. (The request only gets delivered once the statement is committed.)
+    """
+    bind.execute(text('SELECT pg_notify(:channel, :name)')
+                 .execution_options(autocommit=True),
+                 channel=REFRESH_CHANNEL, name=name)
+
+
+# support coalescing refreshes of materialized views to happen (at most) once
+# per transaction, after it has been committed (see the Meta.refresh option)
+_STALE_VIEWS_KEY = 'stale_materialized_views'
+
+
+def mark_materialized_view_stale(view, target):
+    """
+    Mark the materialized view class as needing a refresh once the session
+    the (changed) target instance belongs to gets committed.
+    """
+    session = object_session(target)
+    # use a dict as an ordered set, to refresh views in a predictable order
+    session.info.setdefault(_STALE_VIEWS_KEY, {})[view] = None
+
+
+@event.listens_for(Session, 'after_commit')
+def _refresh_stale_materialized_views(session):
+    stale_views = session.info.pop(_STALE_VIEWS_KEY, None)
+    if not stale_views:
+        return
+
+    # the session can't emit any more SQL in this event, so we refresh the
+    # views directly on the bind instead. the transaction has already been
+    # committed, so failures only get logged, and the failed views get marked
+    # stale again (to be retried after the session's next commit)
+    for view in stale_views:
+        bind = session.get_bind(mapper=view.__mapper__)
+        try:
+            if view._meta.refresh == 'async' and _is_native(bind):
+                request_materialized_view_refresh(view.__tablename__, bind)
+            elif view._meta.refresh == 'on_read':
+                mark_on_read_view_stale(view, bind)
+            else:
+                view.refresh(bind=bind, trigger='event')
+        except Exception:
+            logger.exception(f'Failed to refresh materialized view '
+                             f'{view.__tablename__!r} after commit')
+            session.info.setdefault(_STALE_VIEWS_KEY, {})[view] = None
+
+
+@event.listens_for(Session, 'after_rollback')
+def _clear_stale_materialized_views(session):
+    session.info.pop(_STALE_VIEWS_KEY, None)
+
+
+# support lazily refreshing views (with Meta.refresh = 'on_read') upon reads.
+# views get marked stale both in memory (for this process) and with a marker
+# row (for all processes), and the first reader to claim the marker refreshes.
+# readers only poll the marker rows (of other processes' writes) at most once
+# per SQLALCHEMY_MATERIALIZED_VIEW_STALE_CHECK_INTERVAL seconds
+_on_read_stale = set()
+_on_read_polled = {}
+_on_read_locks = {}
+_on_read_locks_lock = threading.Lock()
+
+
+@unchained.inject('db')
+def mark_on_read_view_stale(view, bind, db=injectable):
+    _on_read_stale.add(view.__tablename__)
+    mark_stale(bind, db.metadata, view.__tablename__)
+
+
+@unchained.inject('db')
+def refresh_on_read_view_if_stale(view, db=injectable):
+    """
+    Refresh the view if it's stale. Concurrent readers (of this process) wait
+    for a single refresh, while readers in other processes keep reading the
+    view as it is until the refresh completes.
+    """
+    name = view.__tablename__
+    bind = db.session.get_bind(mapper=view.__mapper__)
+    if name not in _on_read_stale and not _poll_stale_marker(bind, db.metadata,
+                                                             name):
+        return
+
+    with _on_read_locks_lock:
+        lock = _on_read_locks.setdefault(name, threading.Lock())
+    with lock:
+        _on_read_stale.discard(name)
+        if not claim_stale(bind, db.metadata, name):
+            return  # somebody else already refreshed (or is refreshing) it
+
+        try:
+            view.refresh(bind=bind, trigger='event')
+        except Exception:
+            mark_on_read_view_stale(view, bind)
+            raise
+
+
+def _poll_stale_marker(bind, metadata, name):
+    interval = (current_app.config.get(
+        'SQLALCHEMY_MATERIALIZED_VIEW_STALE_CHECK_INTERVAL', 5)
+        if current_app else 5)
+    now = time.monotonic()
+    if name in _on_read_polled and now - _on_read_polled[name] < interval:
+        return False
+    _on_read_polled[name] = now
+
+    # a missing refresh stats table (eg not migrated yet) counts as not stale
+    try:
+        if isinstance(bind, Connection) and bind.in_transaction():
+            with bind.begin_nested():
+                return is_stale(bind, metadata, name)
+        return is_stale(bind, metadata, name)
+    except DBAPIError:
+        return False
+
+
+def _is_native(bind):
+    """Whether the bind's dialect natively supports materialized views"""
+    return bind.dialect.name == 'postgresql'
+
+
+def _refresh_emulated_view(conn, name, concurrently, metadata):
+    selectable = dict(metadata.info['materialized_views'])[name]
+    table = metadata.info['materialized_tables'][name]
+    if not concurrently:
+        conn.execute(table.delete())
+        return conn.execute(table.insert().from_select(
+            [col.name for col in selectable.c], selectable)).rowcount
+
+    # build the new table first, so the old one is only locked for the swap
+    new_name = f'{name}__refresh'
+    conn.execute(f'DROP TABLE IF EXISTS {new_name}')
+    row_count = _create_view(conn, new_name, selectable, table)
+    conn.execute(f'DROP TABLE {name}')
+    conn.execute(f'ALTER TABLE {new_name} RENAME TO {name}')
+    for idx in table.indexes:
+        idx.create(conn)
+    return row_count
+
+
+def _create_view(conn, name, selectable, table):
+    if _is_native(conn):
+        conn.execute(_CreateMaterializedView(name, selectable))
+        return
+
+    # create the table from its definition (rather than with CREATE TABLE AS),
+    # so it gets the declared column types and primary key. (CreateTable
+    # doesn't create the indexes, so copies of the table don't conflict with
+    # the original's index names)
+    table = table.tometadata(MetaData(), name=name)
+    conn.execute(CreateTable(table))
+    return conn.execute(table.insert().from_select(
+        [col.name for col in selectable.c], selectable)).rowcount
 
 
 # to support using db.create_all()
@@ -64,11 +487,27 @@ class _CreateMaterializedView(DDLElement):
         self.selectable = selectable
 
 
+# to support using db.drop_all()
+class _DropMaterializedView(DDLElement):
+    def __init__(self, name):
+        self.name = name
+
+
 # to support using db.create_all()
-@compiles(_CreateMaterializedView)
+@compiles(_CreateMaterializedView, 'postgresql')
 def _compile_create_materialized_view(element, compiler, **kwargs):
     return 'CREATE MATERIALIZED VIEW {name} AS {query}'.format(
         name=element.name,
         query=compiler.sql_compiler.process(element.selectable,
                                             literal_binds=True)
     )
+
+
+@compiles(_DropMaterializedView, 'postgresql')
+def _compile_drop_materialized_view(element, compiler, **kwargs):
+    return f'DROP MATERIALIZED VIEW IF EXISTS {element.name} CASCADE'
+
+
+@compiles(_DropMaterializedView)
+def _compile_drop_emulated_materialized_view(element, compiler, **kwargs):
+    return f'DROP TABLE IF EXISTS {element.name}'
@@ -0,0 +1,169 @@
+"""
+Bookkeeping of materialized view refreshes. Every refresh records its duration,
+what triggered it, the view's row count afterwards and when it happened, in the
+``materialized_view_refreshes`` table (which gets added to the metadata along
+with the first materialized view, so it gets created and migrated with it).
+
+The bookkeeping is best-effort: it happens in a savepoint, and failures (eg
+because the table hasn't been migrated yet) only get logged, so they never
+affect the refreshes themselves. The row counts of native (PostgreSQL) views
+are the planner's estimates (from ``pg_class.reltuples``, which is unknown
+until the view gets analyzed), rather than counted.
+
+The same table holds the cross-process stale markers of views with
+``Meta.refresh = 'on_read'`` (in its ``stale_since`` column).
+
+The trigger of a refresh is one of:
+
+- ``'event'``: changes to the view's parent tables (see ``Meta.refresh``)
+- ``'scheduled'``: the background refresh worker
+- ``'manual'``: anything else (eg calling ``MaterializedView.refresh()``)
+"""
+import datetime as dt
+import logging
+
+from sqlalchemy import (Column, Float, Integer, MetaData, String, Table, and_,
+                        select, text)
+from sqlalchemy.orm import Session
+from typing import *
+
+from .types import DateTime
+
+
+TRIGGERS = ('event', 'manual', 'scheduled')
+REFRESH_STATS_TABLE = 'materialized_view_refreshes'
+
+logger = logging.getLogger(__name__)
+
+
+def get_refresh_stats_table(metadata: MetaData) -> Table:
+    if REFRESH_STATS_TABLE in metadata.tables:
+        return metadata.tables[REFRESH_STATS_TABLE]
+
+    return Table(REFRESH_STATS_TABLE, metadata,
+                 Column('name', String(255), primary_key=True),
+                 Column('last_refreshed_at', DateTime, nullable=True),
+                 Column('last_duration', Float, nullable=True),
+                 Column('last_trigger', String(16), nullable=True),
+                 Column('row_count', Integer, nullable=True),
+                 Column('refresh_count', Integer, nullable=False),
+                 Column('stale_since', DateTime, nullable=True))
+
+
+def record_refresh(conn, metadata: MetaData, name: str, trigger: str,
+                   duration: float, row_count: Optional[int] = None):
+    """
+    Record a refresh of the named view (using the same connection or session
+    the view got refreshed with, in a savepoint of its transaction). The row
+    count of native views defaults to the planner's estimate.
+    """
+    assert trigger in TRIGGERS, f'trigger must be one of {TRIGGERS}'
+    try:
+        with conn.begin_nested():
+            _record_refresh(conn, metadata, name, trigger, duration, row_count)
+    except Exception:
+        logger.exception(f'Failed to record the refresh of materialized view '
+                         f'{name!r}')
+
+
+def _record_refresh(conn, metadata, name, trigger, duration, row_count):
+    stats = get_refresh_stats_table(metadata)
+    if row_count is None and _get_dialect(conn).name == 'postgresql':
+        row_count = conn.execute(_ROW_ESTIMATE_SQL, name=name).scalar()
+        row_count = int(row_count) if row_count is not None and row_count >= 0 \
+            else None
+    values = dict(last_refreshed_at=dt.datetime.now(dt.timezone.utc),
+                  last_duration=duration,
+                  last_trigger=trigger,
+                  row_count=row_count)
+
+    result = conn.execute(stats.update()
+                          .where(stats.c.name == name)
+                          .values(refresh_count=stats.c.refresh_count + 1,
+                                  **values))
+    if not result.rowcount:
+        conn.execute(stats.insert().values(name=name, refresh_count=1, **values))
+
+
+def _get_dialect(conn):
+    if isinstance(conn, Session):
+        return conn.get_bind().dialect
+    return conn.dialect
+
+
+_ROW_ESTIMATE_SQL = text("""
+    SELECT reltuples FROM pg_class
+    WHERE oid = to_regclass(:name)
+""")
+
+
+def refreshed_since(conn, metadata: MetaData, name: str,
+                    since: dt.datetime) -> bool:
+    """
+    Whether the last recorded refresh of the named view started after ``since``
+    """
+    stats = get_refresh_stats_table(metadata)
+    row = conn.execute(select([stats.c.last_refreshed_at, stats.c.last_duration])
+                       .where(stats.c.name == name)).first()
+    if row is None or row.last_refreshed_at is None:
+        return False
+    started = row.last_refreshed_at - dt.timedelta(seconds=row.last_duration)
+    return started >= since
+
+
+def mark_stale(conn, metadata: MetaData, name: str):
+    """
+    Set the stale marker of the named view (unless it's already set)
+    """
+    stats = get_refresh_stats_table(metadata)
+    result = conn.execute(stats.update()
+                          .where(and_(stats.c.name == name,
+                                      stats.c.stale_since.is_(None)))
+                          .values(stale_since=dt.datetime.now(dt.timezone.utc)))
+    if not result.rowcount and not is_stale(conn, metadata, name):
+        conn.execute(stats.insert().values(
+            name=name, refresh_count=0,
+            stale_since=dt.datetime.now(dt.timezone.utc)))
+
+
+def is_stale(conn, metadata: MetaData, name: str) -> bool:
+    stats = get_refresh_stats_table(metadata)
+    return conn.execute(select([stats.c.stale_since])
+                        .where(stats.c.name == name)).scalar() is not None
+
+
+def claim_stale(conn, metadata: MetaData, name: str) -> bool:
+    """
+    Clear the stale marker of the named view, returning whether it was set.
+    (Only one of any concurrent callers can successfully claim a marker.)
+    """
+    stats = get_refresh_stats_table(metadata)
+    result = conn.execute(stats.update()
+                          .where(and_(stats.c.name == name,
+                                      stats.c.stale_since.isnot(None)))
+                          .values(stale_since=None))
+    return bool(result.rowcount)
+
+
+def get_freshness(conn, metadata: MetaData, name: str) -> Optional[Dict[str, Any]]:
+    """
+    Get the recorded refresh statistics of the named view (or None if it has
+    never been refreshed nor marked stale), including its ``age`` in seconds
+    """
+    stats = get_refresh_stats_table(metadata)
+    row = conn.execute(stats.select().where(stats.c.name == name)).first()
+    return row and _to_dict(row)
+
+
+def get_all_freshness(conn, metadata: MetaData) -> List[Dict[str, Any]]:
+    stats = get_refresh_stats_table(metadata)
+    return [_to_dict(row)
+            for row in conn.execute(stats.select().order_by(stats.c.name))]
+
+
+def _to_dict(row):
+    data = dict(row.items())
+    data['age'] = data['last_refreshed_at'] and (
+        dt.datetime.now(dt.timezone.utc)
+        - data['last_refreshed_at']).total_seconds()
+    return data
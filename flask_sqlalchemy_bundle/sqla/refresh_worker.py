@@ -0,0 +1,155 @@
+"""
+Background refreshing of materialized views with ``Meta.refresh = 'async'``.
+
+Committed changes to the parent tables of such views only send a refresh
+request (using PostgreSQL's ``NOTIFY``). A :class:`MaterializedViewRefreshWorker`
+listens for these requests on its own dedicated connection, and refreshes
+the stale views while respecting their ``Meta.min_interval`` and
+``Meta.max_staleness`` options: a stale view gets refreshed no sooner than
+``min_interval`` seconds after its previous refresh, unless it has been stale
+for ``max_staleness`` seconds already. Any requests received in the meantime
+are coalesced into a single refresh.
+
+The worker can either run in a thread of the app process (by setting
+``SQLALCHEMY_MATERIALIZED_VIEW_REFRESH_WORKER = True`` in your config), or
+in its own process using the ``flask db refresh-worker`` command.
+
+The former is meant for single-process deployments (and the development
+server): every app process runs its own worker thread (except when running
+CLI commands), so with multiple processes (eg gunicorn workers) they'd all
+receive every request, and only the advisory locks of the refreshes would
+keep them from refreshing views repeatedly. Run a single ``flask db
+refresh-worker`` process instead.
+"""
+import logging
+import select
+import threading
+import time
+
+from typing import *
+
+from .materialized_view import REFRESH_CHANNEL
+
+
+logger = logging.getLogger(__name__)
+
+
+class MaterializedViewRefreshWorker:
+    """
+    :param engine: The engine to open the dedicated connection with.
+    :param views: The materialized view classes to handle refresh requests for.
+    :param poll_interval: The maximum number of seconds to wait for
+                          notifications before checking for due refreshes
+                          (and whether the worker has been stopped).
+    :param refresh_options: The options to refresh the views with (see
+                            :func:`~flask_sqlalchemy_bundle.sqla.get_refresh_options`,
+                            the worker's thread has no app context to get
+                            them from).
+    """
+    def __init__(self, engine, views: Iterable[Any], poll_interval: float = 1.0,
+                 refresh_options: Optional[Dict[str, Any]] = None):
+        self.engine = engine
+        self.views = {view.__tablename__: view for view in views}
+        self.poll_interval = poll_interval
+        self.refresh_options = refresh_options or {}
+        self._stale_since = {}
+        self._last_refreshed = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def mark_stale(self, name: str, now: Optional[float] = None):
+        """
+        Record a refresh request for the named view (repeated requests for a
+        view that is already stale are coalesced)
+        """
+        if name not in self.views:
+            logger.warning(f'Ignoring refresh request for unknown '
+                           f'materialized view {name!r}')
+            return
+        now = time.monotonic() if now is None else now
+        self._stale_since.setdefault(name, now)
+
+    def due_at(self, name: str) -> Optional[float]:
+        """
+        Get the (monotonic) time the named view is due to be refreshed at, or
+        None if it isn't stale
+        """
+        stale_since = self._stale_since.get(name)
+        if stale_since is None:
+            return None
+
+        meta = self.views[name]._meta
+        due = stale_since
+        if name in self._last_refreshed:
+            due = max(due, self._last_refreshed[name] + meta.min_interval)
+        if meta.max_staleness is not None:
+            due = min(due, stale_since + meta.max_staleness)
+        return due
+
+    def refresh_due(self, bind, now: Optional[float] = None) -> List[str]:
+        """
+        Refresh all of the stale views that are due, returning the names of
+        the ones that got refreshed (failed refreshes get retried later)
+        """
+        now = time.monotonic() if now is None else now
+        refreshed = []
+        for name in list(self._stale_since):
+            if self.due_at(name) > now:
+                continue
+
+            del self._stale_since[name]
+            try:
+                self.views[name].refresh(bind=bind, trigger='scheduled',
+                                         **self.refresh_options)
+            except Exception:
+                logger.exception(f'Failed to refresh materialized view {name!r}')
+                # retry it (no sooner than) the next time around
+                self._stale_since.setdefault(name, now + self.poll_interval)
+                continue
+            self._last_refreshed[name] = now
+            refreshed.append(name)
+        return refreshed
+
+    def run(self):
+        """
+        Listen for refresh requests and refresh the stale views (blocks until
+        :meth:`stop` gets called)
+        """
+        self._stop.clear()
+        with self.engine.connect() as conn:
+            conn = conn.execution_options(isolation_level='AUTOCOMMIT')
+            conn.execute(f'LISTEN {REFRESH_CHANNEL}')
+            dbapi_conn = conn.connection.connection
+            while not self._stop.is_set():
+                self._receive(dbapi_conn, self._get_timeout())
+                self.refresh_due(self.engine)
+
+    def start(self) -> threading.Thread:
+        """
+        Run the worker in a (daemon) thread
+        """
+        self._thread = threading.Thread(target=self.run, daemon=True,
+                                        name='materialized-view-refresh-worker')
+        self._thread.start()
+        return self._thread
+
+    def stop(self, timeout: Optional[float] = None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _get_timeout(self):
+        due = [self.due_at(name) for name in self._stale_since]
+        if not due:
+            return self.poll_interval
+        return max(0, min(min(due) - time.monotonic(), self.poll_interval))
+
+    def _receive(self, dbapi_conn, timeout):
+        if select.select([dbapi_conn], [], [], timeout) == ([], [], []):
+            return
+
+        dbapi_conn.poll()
+        while dbapi_conn.notifies:
+            notify = dbapi_conn.notifies.pop(0)
+            self.mark_stale(notify.payload)
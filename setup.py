@@ -29,6 +29,7 @@ setup(
     zip_safe=False,
     python_requires='>=3.6',
     install_requires=[
+        'alembic>=1.2',
         'flask-migrate>=2.1.1',
         'flask-unchained>=0.2.0',
         'flask-sqlalchemy>=2.3',
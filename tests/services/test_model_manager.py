@@ -3,6 +3,7 @@ import pytest
 from flask_sqlalchemy_bundle import ModelManager, SQLAlchemy
 from flask_sqlalchemy_bundle.meta.model_registry import _model_registry
 from flask_unchained import unchained
+from sqlalchemy import inspect as sa_inspect
 from sqlalchemy.orm.exc import MultipleResultsFound
 
 
@@ -131,3 +132,170 @@ class TestModelManager:
 
         ones = [foo1, foo_1]
         assert foo_manager.find_by(name='one') == ones
+
+    def test_exists_by(self, db: SQLAlchemy):
+        Foo, foo_manager = setup(db)
+
+        foo_manager.create(name='one')
+        foo_manager.commit()
+
+        assert foo_manager.exists_by(name='one') is True
+        assert foo_manager.exists_by(name='fail') is False
+        assert foo_manager.exists_by() is True
+
+    def test_count_by(self, db: SQLAlchemy):
+        Foo, foo_manager = setup(db)
+
+        foo_manager.create(name='one')
+        foo_manager.create(name='one')
+        foo_manager.create(name='two')
+        foo_manager.commit()
+
+        assert foo_manager.count_by(name='one') == 2
+        assert foo_manager.count_by(name='fail') == 0
+        assert foo_manager.count_by() == 3
+
+        # the total isn't limited to the current page
+        assert Foo.query.limit(1).offset(1).count_by(name='one') == 2
+
+    def test_pluck(self, db: SQLAlchemy):
+        Foo, foo_manager = setup(db)
+
+        foo1 = foo_manager.create(name='one')
+        foo2 = foo_manager.create(name='two')
+        foo_manager.commit()
+
+        assert foo_manager.pluck('name') == ['one', 'two']
+        assert foo_manager.pluck(Foo.id, name='two') == [foo2.id]
+        assert foo_manager.pluck('id', name='fail') == []
+
+    def test_find_by_readonly(self, db: SQLAlchemy):
+        Foo, foo_manager = setup(db)
+
+        foo1 = foo_manager.create(name='one')
+        foo2 = foo_manager.create(name='two')
+        foo_manager.commit()
+
+        ones = foo_manager.find_by(name='one', readonly=True)
+        assert len(ones) == 1
+        assert not isinstance(ones[0], Foo)
+        assert ones[0].id == foo1.id
+        assert ones[0].name == 'one'
+
+
+def setup_related(db: SQLAlchemy, join_criteria: bool = False):
+    class Author(db.Model):
+        name = db.Column(db.String)
+        books = db.relationship('Book', back_populates='author',
+                                order_by='Book.title')
+        if join_criteria:
+            a_books = db.relationship(
+                'Book', viewonly=True,
+                primaryjoin="and_(Author.id == Book.author_id, "
+                            "Book.title == 'a')")
+            books_if_two = db.relationship(
+                'Book', viewonly=True,
+                primaryjoin="and_(Author.id == Book.author_id, "
+                            "Author.name == 'two')")
+
+    book_tags = db.Table(
+        'book_tags',
+        db.Column('book_id', db.Integer, db.ForeignKey('book.id')),
+        db.Column('tag_id', db.Integer, db.ForeignKey('tag.id')))
+
+    class Book(db.Model):
+        title = db.Column(db.String)
+        author_id = db.foreign_key('Author')
+        author = db.relationship('Author', back_populates='books')
+        tags = db.relationship('Tag', secondary=book_tags)
+
+    class Tag(db.Model):
+        name = db.Column(db.String)
+
+    class AuthorManager(ModelManager):
+        model = Author
+
+    class BookManager(ModelManager):
+        model = Book
+
+    _model_registry.finalize_mappings()
+    db.create_all()
+
+    return Author, Book, Tag, AuthorManager(), BookManager()
+
+
+class TestLoadRelated:
+    def _create(self, db, Author, Book, Tag):
+        red, blue = Tag(name='red'), Tag(name='blue')
+        one, two = Author(name='one'), Author(name='two')
+        db.session.add_all([
+            Book(title='b', author=one, tags=[red, blue]),
+            Book(title='a', author=one, tags=[red]),
+            Book(title='c', author=two),
+            Author(name='three'),
+        ])
+        db.session.commit()
+        db.session.expunge_all()
+
+    def _count_queries(self, db):
+        from sqlalchemy import event
+        statements = []
+        event.listen(db.session.bind, 'before_cursor_execute',
+                     lambda *args: statements.append(args[2]))
+        return statements
+
+    def test_one_to_many_and_many_to_many(self, db: SQLAlchemy):
+        Author, Book, Tag, author_manager, _ = setup_related(db)
+        self._create(db, Author, Book, Tag)
+
+        authors = author_manager.q.order_by(Author.id).all()
+        statements = self._count_queries(db)
+        author_manager.load_related(authors, 'books', 'books.tags')
+        assert len(statements) == 2
+
+        assert [[b.title for b in a.books] for a in authors] == [
+            ['a', 'b'], ['c'], []]
+        assert sorted(t.name for t in authors[0].books[1].tags) == [
+            'blue', 'red']
+        assert authors[1].books[0].tags == []
+        assert len(statements) == 2
+        assert not db.session.dirty
+
+    def test_many_to_one(self, db: SQLAlchemy):
+        Author, Book, Tag, _, book_manager = setup_related(db)
+        self._create(db, Author, Book, Tag)
+
+        books = book_manager.q.order_by(Book.title).all()
+        statements = self._count_queries(db)
+        book_manager.load_related(books, 'author')
+        assert len(statements) == 1
+        assert [b.author.name for b in books] == ['one', 'one', 'two']
+        assert books[0].author is books[1].author
+        assert len(statements) == 1
+
+    def test_additional_join_criteria(self, db: SQLAlchemy):
+        Author, Book, Tag, author_manager, _ = setup_related(
+            db, join_criteria=True)
+        self._create(db, Author, Book, Tag)
+
+        authors = author_manager.q.order_by(Author.id).all()
+        statements = self._count_queries(db)
+        author_manager.load_related(authors, 'a_books', 'books_if_two')
+        assert len(statements) == 2
+
+        assert [[b.title for b in a.a_books] for a in authors] == [
+            ['a'], [], []]
+        assert [[b.title for b in a.books_if_two] for a in authors] == [
+            [], ['c'], []]
+        assert len(statements) == 2
+
+    def test_by_related_model_name(self, db: SQLAlchemy):
+        Author, Book, Tag, author_manager, _ = setup_related(db)
+        self._create(db, Author, Book, Tag)
+
+        authors = author_manager.find_all()
+        author_manager.load_related(authors, 'Book')
+        assert 'books' not in sa_inspect(authors[0]).unloaded
+
+        with pytest.raises(ValueError):
+            author_manager.load_related(authors, 'fail')
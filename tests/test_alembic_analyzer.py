@@ -0,0 +1,120 @@
+import pytest
+
+from alembic.script import ScriptDirectory
+from flask.cli import ScriptInfo
+from flask_sqlalchemy_bundle.alembic.analyzer import (
+    analyze_revisions, get_pending_revisions, get_table_row_estimates)
+from flask_sqlalchemy_bundle.commands import analyze_migrations_command
+from flask_sqlalchemy_bundle.extensions import migrate
+from tests.conftest import POSTGRES
+
+
+_REVISION = """
+import sqlalchemy as sa
+from alembic import op
+
+revision = {revision!r}
+down_revision = {down_revision!r}
+
+
+def upgrade():
+{upgrade}
+"""
+
+
+def _script(tmpdir, revisions):
+    versions = tmpdir.mkdir('versions')
+    down_revision = None
+    for revision, upgrade in revisions:
+        versions.join(f'{revision}.py').write(_REVISION.format(
+            revision=revision, down_revision=down_revision,
+            upgrade='\n'.join(f'    {line}' for line in upgrade)))
+        down_revision = revision
+    return ScriptDirectory(str(tmpdir))
+
+
+def _analyze(script, heads=(), table_rows=None):
+    return [(impact.revision, impact.description, impact.lock, impact.risk)
+            for impact in analyze_revisions(
+                script, get_pending_revisions(script, heads), 'postgresql',
+                table_rows=table_rows, large_table_rows=1000)]
+
+
+def test_analyze_revisions(tmpdir, capsys):
+    script = _script(tmpdir, [
+        ('aaa', ["op.create_table('item', sa.Column('id', sa.Integer))"]),
+        ('bbb', [
+            "op.add_column('item', sa.Column('a', sa.Integer, nullable=True))",
+            "op.add_column('item', sa.Column('b', sa.Integer, nullable=False,",
+            "                                server_default='0'))",
+            "op.alter_column('item', 'a', type_=sa.BigInteger)",
+            "op.create_index('ix_item_b', 'item', ['b'])",
+            "op.create_index_concurrently('ix_item_a', 'item', ['a'])",
+            "op.backfill('item', set_={'a': 1})",
+            "op.execute('VACUUM item')",
+            "with op.batch_alter_table('item') as batch_op:",
+            "    batch_op.alter_column('b', nullable=False)",
+        ]),
+        ('ccc', ["op.get_bind().execute('SELECT 1')"]),
+    ])
+
+    assert _analyze(script, heads=['aaa']) == [
+        ('bbb', 'add_column item.a', 'ACCESS EXCLUSIVE', 'low'),
+        ('bbb', 'add_column item.b', 'ACCESS EXCLUSIVE', 'high'),
+        ('bbb', 'alter_column item.a', 'ACCESS EXCLUSIVE', 'high'),
+        ('bbb', 'create_index item', 'SHARE', 'medium'),
+        ('bbb', 'create_index_concurrently item', 'SHARE UPDATE EXCLUSIVE', 'low'),
+        ('bbb', 'backfill item', 'ROW EXCLUSIVE', 'low'),
+        ('bbb', 'execute', None, 'medium'),
+        ('bbb', 'alter_column item.b', 'ACCESS EXCLUSIVE', 'medium'),
+        ('ccc', 'upgrade()', None, 'medium'),
+    ]
+    # nothing got executed (nor printed as SQL)
+    assert capsys.readouterr().out == ''
+
+    # with row count estimates, scans and rewrites depend on the table size
+    for rows, risk in [(10, 'low'), (5000, 'high')]:
+        impacts = _analyze(script, heads=['aaa'], table_rows={'item': rows})
+        assert [impact[3] for impact in impacts[1:4]] == [risk] * 3
+
+    # without current heads, all revisions are pending
+    assert _analyze(script)[0] == ('aaa', 'create_table item', None, 'low')
+
+
+def test_analyze_migrations_command(app, tmpdir, monkeypatch, capsys):
+    _script(tmpdir, [
+        ('aaa', ["op.create_index('ix_item_b', 'item', ['b'])"]),
+    ])
+    monkeypatch.setattr(migrate, 'directory', str(tmpdir))
+
+    def analyze(*args):
+        ctx = analyze_migrations_command.make_context(
+            'analyze-migrations', list(args),
+            obj=ScriptInfo(create_app=lambda info: app))
+        with ctx:
+            analyze_migrations_command.invoke(ctx)
+
+    analyze()
+    assert capsys.readouterr().out.splitlines() == [
+        'Revision aaa:',
+        '  [medium] create_index item: SHARE, '
+        'a non-concurrent index build blocks writes',
+    ]
+
+    with pytest.raises(SystemExit) as e:
+        analyze('--threshold', 'medium')
+    assert e.value.code == \
+        "1 operation(s) at or above the 'medium' risk threshold."
+
+
+@pytest.mark.options(SQLALCHEMY_DATABASE_URI=POSTGRES)
+def test_get_table_row_estimates(db):
+    conn = db.session.connection()
+    conn.execute('CREATE TABLE never_analyzed (id INTEGER PRIMARY KEY)')
+    conn.execute('CREATE TABLE analyzed (id INTEGER PRIMARY KEY)')
+    conn.execute('INSERT INTO analyzed SELECT generate_series(1, 50)')
+    conn.execute('ANALYZE analyzed')
+
+    estimates = get_table_row_estimates(conn)
+    assert 'never_analyzed' not in estimates
+    assert estimates['analyzed'] == 50
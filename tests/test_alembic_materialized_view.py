@@ -0,0 +1,206 @@
+import pytest
+
+from alembic.autogenerate import produce_migrations
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+from alembic.script import ScriptDirectory
+from flask_sqlalchemy_bundle.alembic import PopulateIncrementalViewOp
+from flask_sqlalchemy_bundle.alembic.materialized_view import (
+    CreateMaterializedViewOp, DropMaterializedViewOp, MaterializedViewMigration,
+    SwapMaterializedViewOp, create_replaceable_sql_for_existing,
+    reflect_replaceable_sql_for_existing, render_create_sql, render_drop_sql)
+from flask_sqlalchemy_bundle.alembic.revision_index import RevisionIndex
+from flask_sqlalchemy_bundle.meta.model_registry import _model_registry
+from sqlalchemy import create_engine, func, inspect as sa_inspect
+from tests.conftest import POSTGRES
+
+
+def _view(query, prev=None, name='item_stats'):
+    return MaterializedViewMigration(
+        name,
+        f'CREATE MATERIALIZED VIEW {name} AS {query}',
+        f'DROP MATERIALIZED VIEW IF EXISTS {name}',
+        columns=[],
+        indexes=[{'name': f'ix_{name}_id'[-63:], 'unique': True,
+                  'column_names': ['id']}],
+        prev=prev)
+
+
+class _AutogenContext:
+    def __init__(self, **opts):
+        self.imports = set()
+        self.migration_context = type('MigrationContext', (), {})()
+        self.migration_context.opts = dict(
+            template_args={'migration_variables': []}, **opts)
+
+
+@pytest.mark.options(SQLALCHEMY_DATABASE_URI=POSTGRES)
+class TestSwapMaterializedView:
+    @pytest.mark.parametrize('with_no_data', [False, True])
+    def test_swap(self, db, with_no_data):
+        conn = db.session.connection()
+        conn.execute('CREATE TABLE item (id INTEGER PRIMARY KEY, price INTEGER)')
+        conn.execute('INSERT INTO item VALUES (1, 10), (2, 20)')
+
+        op = Operations(MigrationContext.configure(conn))
+        old = _view('SELECT id, price FROM item')
+        op.create_sql(old)
+
+        new = _view('SELECT id, price * 2 AS price FROM item')
+        op.invoke(SwapMaterializedViewOp(new, old, with_no_data=with_no_data))
+
+        inspector = sa_inspect(conn)
+        assert inspector.get_view_names(include='materialized') == ['item_stats']
+        assert [idx['name'] for idx in inspector.get_indexes('item_stats')] \
+            == ['ix_item_stats_id']
+        assert list(conn.execute('SELECT id, price FROM item_stats ORDER BY id')) \
+            == [(1, 20), (2, 40)]
+
+        # and back again
+        op.invoke(SwapMaterializedViewOp(new, old).reverse())
+        assert list(conn.execute('SELECT id, price FROM item_stats ORDER BY id')) \
+            == [(1, 10), (2, 20)]
+
+    def test_swap_long_names(self, db):
+        conn = db.session.connection()
+        conn.execute('CREATE TABLE item (id INTEGER PRIMARY KEY, price INTEGER)')
+        conn.execute('INSERT INTO item VALUES (1, 10)')
+
+        # the suffixed names would get truncated to the same identifier
+        name = 'item_stats_' + 'x' * 50
+        op = Operations(MigrationContext.configure(conn))
+        old = _view('SELECT id, price FROM item', name=name)
+        op.create_sql(old)
+        new = _view('SELECT id, price * 2 AS price FROM item', name=name)
+        op.invoke(SwapMaterializedViewOp(new, old))
+
+        inspector = sa_inspect(conn)
+        assert inspector.get_view_names(include='materialized') == [name]
+        assert [idx['name'] for idx in inspector.get_indexes(name)] \
+            == [new.indexes[0]['name']]
+        assert list(conn.execute(f'SELECT id, price FROM {name}')) == [(1, 20)]
+
+
+@pytest.mark.options(SQLALCHEMY_DATABASE_URI=POSTGRES)
+def test_reflect_replaceable_sql_for_existing(db):
+    conn = db.session.connection()
+    conn.execute('CREATE TABLE item (id INTEGER PRIMARY KEY, price INTEGER)')
+    op = Operations(MigrationContext.configure(conn))
+    op.create_sql(_view('SELECT id, price FROM item'))
+    conn.execute('CREATE INDEX ix_item_stats_price_id ON item_stats (price, id)')
+
+    inspector = sa_inspect(conn)
+    [view] = reflect_replaceable_sql_for_existing(inspector, [None])
+    expected = create_replaceable_sql_for_existing('item_stats', inspector)
+    assert view == expected and hash(view) == hash(expected)
+    assert [(c['name'], c['nullable']) for c in view.columns] \
+        == [('id', True), ('price', True)]
+    assert sorted(view.indexes, key=lambda idx: idx['name']) == [
+        {'name': 'ix_item_stats_id', 'unique': True, 'column_names': ['id']},
+        {'name': 'ix_item_stats_price_id', 'unique': False,
+         'column_names': ['price', 'id']},
+    ]
+
+
+def test_render_swap():
+    view = _view('SELECT 1 AS id', prev='abc123.item_stats')
+    for context, replace in [(_AutogenContext(), 'replace_sql'),
+                             (_AutogenContext(materialized_view_swap=True),
+                              'swap_sql')]:
+        assert render_create_sql(context, CreateMaterializedViewOp(view)) == \
+            f"op.{replace}(item_stats, replaces='abc123.item_stats')"
+        assert render_drop_sql(context, DropMaterializedViewOp(view)) == \
+            f"op.{replace}(item_stats, replace_with='abc123.item_stats')"
+
+
+def test_populate_incremental_view(db):
+    class Item(db.Model):
+        category = db.Column(db.String)
+
+    class CategoryStats(db.MaterializedView):
+        class Meta:
+            mv_for = 'Item'
+            refresh = 'incremental'
+
+        @classmethod
+        def selectable(cls):
+            return (db.select([Item.category.label('id'),
+                               func.count(Item.id).label('count')])
+                    .group_by(Item.category))
+
+    _model_registry.finalize_mappings()
+
+    # a database with existing rows, migrated to add the view
+    conn = create_engine('sqlite://').connect()
+    Item.__table__.create(conn)
+    conn.execute(Item.__table__.insert(), [{'category': category}
+                                           for category in 'aab'])
+
+    context = MigrationContext.configure(
+        conn, opts={'target_metadata': db.metadata})
+    upgrade_ops = produce_migrations(context, db.metadata).upgrade_ops
+    populate = upgrade_ops.ops[-1]
+    assert isinstance(populate, PopulateIncrementalViewOp)
+    assert populate.sqltext.startswith(
+        'INSERT INTO category_stats (id, count) SELECT')
+    assert populate.reverse().sqltext == 'DELETE FROM category_stats'
+
+    operations = Operations(context)
+    for op in upgrade_ops.ops:
+        for op in getattr(op, 'ops', [op]):
+            operations.invoke(op)
+    assert sorted(conn.execute('SELECT id, count FROM category_stats')) == [
+        ('a', 2), ('b', 1)]
+
+
+_REVISION = """
+import flask_sqlalchemy_bundle
+
+revision = {revision!r}
+down_revision = {down_revision!r}
+
+{views}
+"""
+
+
+def _write_revisions(tmpdir, revisions):
+    versions = tmpdir.mkdir('versions')
+    down_revision = None
+    for revision, views in revisions:
+        views = '\n'.join(f"{attr} = flask_sqlalchemy_bundle.MaterializedViewMigration("
+                          f"{name!r}, 'CREATE', 'DROP', [], [])"
+                          for attr, name in views)
+        versions.join(f'{revision}.py').write(_REVISION.format(
+            revision=revision, down_revision=down_revision, views=views))
+        down_revision = revision
+    return ScriptDirectory(str(tmpdir))
+
+
+class TestRevisionIndex:
+    def test_index(self, tmpdir):
+        script = _write_revisions(tmpdir, [
+            ('aaa', [('item_stats', 'item_stats')]),
+            ('bbb', []),
+            ('ccc', [('item_stats', 'item_stats'), ('totals', 'user_totals')]),
+        ])
+        index = RevisionIndex.for_script(script)
+        assert RevisionIndex.for_script(script) is index
+        assert index.get_revisions('item_stats') == [('aaa', 'item_stats'),
+                                                     ('ccc', 'item_stats')]
+        assert index.get_revisions('user_totals') == [('ccc', 'totals')]
+        assert index.find('item_stats') == ('ccc', 'item_stats')
+        assert index.find('item_stats', before='bbb') == ('aaa', 'item_stats')
+        assert index.find('user_totals', before='bbb') is None
+
+        assert index.get_object('aaa.item_stats') \
+            is script.get_revision('aaa').module.item_stats
+        assert index.get_object('user_totals') \
+            is script.get_revision('ccc').module.totals
+        with pytest.raises(AttributeError):
+            index.get_object('bbb.item_stats')
+
+        # objects of other types aren't indexed, but can still be looked up
+        assert index.get_object('bbb.revision') == 'bbb'
+
+        # the index only lives in memory
+        assert [path.basename for path in tmpdir.listdir()] == ['versions']
@@ -0,0 +1,68 @@
+import pytest
+
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+from flask_sqlalchemy_bundle.alembic import (
+    BackfillOp, CreateIndexConcurrentlyOp, DropIndexConcurrentlyOp)
+from sqlalchemy import inspect as sa_inspect, text
+from tests.conftest import POSTGRES
+
+
+@pytest.fixture()
+def migration(db):
+    # these ops commit the migration's transaction, so they can't use the
+    # (rolled back) connection of the db_session fixture
+    conn = db.engine.connect()
+    conn.execute('CREATE TABLE online_item (id INTEGER PRIMARY KEY, '
+                 'price INTEGER, cents INTEGER)')
+    conn.execute('INSERT INTO online_item (id, price) '
+                 'SELECT i, i FROM generate_series(1, 25) AS i')
+    context = MigrationContext.configure(conn)
+    transaction = context.begin_transaction()
+    try:
+        yield conn, Operations(context)
+    finally:
+        transaction.rollback()
+        conn.execute('DROP TABLE online_item')
+        conn.close()
+
+
+@pytest.mark.options(SQLALCHEMY_DATABASE_URI=POSTGRES)
+class TestOnlineOps:
+    def test_create_index_concurrently(self, migration):
+        conn, op = migration
+        op.create_index_concurrently('ix_online_item_price', 'online_item',
+                                     ['price'])
+        assert [idx['name'] for idx in sa_inspect(conn)
+                .get_indexes('online_item')] == ['ix_online_item_price']
+
+        op.invoke(CreateIndexConcurrentlyOp(
+            'ix_online_item_price', 'online_item', ['price']).reverse())
+        assert sa_inspect(conn).get_indexes('online_item') == []
+
+        with pytest.raises(ValueError):
+            DropIndexConcurrentlyOp('ix_online_item_price').reverse()
+
+    def test_backfill(self, migration, capsys):
+        conn, op = migration
+        op.backfill('online_item', set_={'cents': text('price * 100')},
+                    where='id > 3', batch_size=10)
+
+        assert list(conn.execute('SELECT id, cents FROM online_item '
+                                 'WHERE id IN (3, 4, 25) ORDER BY id')) \
+            == [(3, None), (4, 400), (25, 2500)]
+        assert capsys.readouterr().out.splitlines() == [
+            'Backfill of online_item: id 4-13 of 4-25 (10 rows updated)',
+            'Backfill of online_item: id 14-23 of 4-25 (20 rows updated)',
+            'Backfill of online_item: id 24-25 of 4-25 (22 rows updated)',
+        ]
+
+        # reversing only reverts the rows matching the where clause
+        conn.execute('UPDATE online_item SET cents = 1 WHERE id <= 3')
+        reverse = BackfillOp('online_item', {'cents': text('price * 100')},
+                             where='id > 3').reverse()
+        assert reverse.where == 'id > 3'
+        op.invoke(reverse)
+        assert list(conn.execute('SELECT id FROM online_item '
+                                 'WHERE cents IS NOT NULL ORDER BY id')) \
+            == [(1,), (2,), (3,)]
@@ -0,0 +1,136 @@
+import pytest
+
+from alembic.script import ScriptDirectory
+from flask.cli import ScriptInfo
+from flask_migrate import init
+from flask_sqlalchemy_bundle.alembic.snapshot import (Baseline,
+                                                      get_revisions_checksum)
+from flask_sqlalchemy_bundle.commands import upgrade_command
+from sqlalchemy import create_engine, inspect as sa_inspect
+from tests.conftest import POSTGRES
+
+
+_REVISION = """
+revision = {revision!r}
+down_revision = {down_revision!r}
+"""
+
+
+def _engine(revision='bbb'):
+    engine = create_engine('sqlite://')
+    engine.execute('CREATE TABLE item (id INTEGER PRIMARY KEY, '
+                   "name VARCHAR(32) DEFAULT 'x' NOT NULL)")
+    engine.execute('CREATE TABLE item_tag (id INTEGER PRIMARY KEY, '
+                   'item_id INTEGER REFERENCES item (id), tag VARCHAR(16))')
+    engine.execute('CREATE INDEX ix_item_tag_tag ON item_tag (tag)')
+    engine.execute('CREATE TABLE alembic_version (version_num VARCHAR(32) '
+                   'NOT NULL PRIMARY KEY)')
+    engine.execute(f"INSERT INTO alembic_version VALUES ('{revision}')")
+    return engine
+
+
+def test_snapshot_and_load(tmpdir):
+    with _engine().connect() as conn:
+        baseline = Baseline.from_connection(conn)
+    assert baseline.revisions == ('bbb',)
+    assert baseline.statements[-1] == \
+        "INSERT INTO alembic_version (version_num) VALUES ('bbb')"
+
+    path = str(tmpdir.join('baseline.sql'))
+    baseline.write(path)
+    loaded = Baseline.read(path)
+    assert loaded.revisions == baseline.revisions
+    assert loaded.statements == baseline.statements
+
+    with create_engine('sqlite://').connect() as conn:
+        loaded.load(conn)
+        assert Baseline.from_connection(conn).statements == baseline.statements
+        assert list(conn.execute('SELECT version_num FROM alembic_version')) \
+            == [('bbb',)]
+
+
+def _write_revisions(versions, revisions, body=''):
+    down_revision = None
+    for revision in revisions:
+        versions.join(f'{revision}.py').write(_REVISION.format(
+            revision=revision, down_revision=down_revision) + body)
+        down_revision = revision
+
+
+def test_check(tmpdir):
+    _write_revisions(tmpdir.mkdir('versions'), ['aaa', 'bbb', 'ccc', 'ddd'])
+    script = ScriptDirectory(str(tmpdir))
+
+    assert Baseline(('bbb',), []).check(script) == ['ccc', 'ddd']
+    assert Baseline(('ddd',), []).check(script) == []
+    with pytest.raises(ValueError):
+        Baseline(('zzz',), []).check(script)
+    with pytest.raises(ValueError):
+        Baseline((), []).check(script)
+
+
+def test_check_modified_revisions(tmpdir):
+    versions = tmpdir.mkdir('versions')
+    _write_revisions(versions, ['aaa', 'bbb', 'ccc'])
+    checksum = get_revisions_checksum(ScriptDirectory(str(tmpdir)), ('bbb',))
+
+    path = str(tmpdir.join('baseline.sql'))
+    Baseline(('bbb',), [], checksum).write(path)
+    baseline = Baseline.read(path)
+    assert baseline.checksum == checksum
+    assert baseline.check(ScriptDirectory(str(tmpdir))) == ['ccc']
+
+    # newer revisions may change, but the ones up to the baseline may not
+    versions.join('ccc.py').write('# changed\n', mode='a')
+    assert baseline.check(ScriptDirectory(str(tmpdir))) == ['ccc']
+    versions.join('aaa.py').write('# changed\n', mode='a')
+    with pytest.raises(ValueError):
+        baseline.check(ScriptDirectory(str(tmpdir)))
+
+
+_TABLE_REVISION = """
+from alembic import op
+
+
+def upgrade():
+    op.execute('CREATE TABLE from_' + revision + ' (id INTEGER)')
+
+
+def downgrade():
+    op.execute('DROP TABLE from_' + revision)
+"""
+
+
+@pytest.mark.options(SQLALCHEMY_DATABASE_URI=POSTGRES)
+def test_upgrade_loads_baseline(app, db, tmpdir):
+    directory = str(tmpdir.join('migrations'))
+    init(directory)
+    versions = tmpdir.join('migrations', 'versions')
+    _write_revisions(versions, ['aaa', 'bbb'], _TABLE_REVISION)
+
+    script = ScriptDirectory(directory)
+    Baseline(('aaa',), [
+        'CREATE TABLE from_baseline (id INTEGER)',
+        'CREATE TABLE alembic_version (version_num VARCHAR(32) NOT NULL)',
+        "INSERT INTO alembic_version (version_num) VALUES ('aaa')",
+    ], get_revisions_checksum(script, ('aaa',))).write(
+        tmpdir.join('migrations', 'baseline.sql'))
+
+    def upgrade(*args):
+        ctx = upgrade_command.make_context(
+            'upgrade', ['-d', directory, *args],
+            obj=ScriptInfo(create_app=lambda info: app))
+        upgrade_command.invoke(ctx)
+
+    try:
+        upgrade()
+        # the baseline replaced revision aaa, only bbb got run
+        assert {'from_baseline', 'from_bbb'} <= \
+            set(sa_inspect(db.engine).get_table_names())
+        assert 'from_aaa' not in sa_inspect(db.engine).get_table_names()
+
+        # versioned databases don't get the baseline loaded again
+        upgrade()
+    finally:
+        for table in ['from_baseline', 'from_bbb', 'alembic_version']:
+            db.engine.execute(f'DROP TABLE IF EXISTS {table}')
@@ -0,0 +1,176 @@
+import array
+import pytest
+
+from datetime import datetime, timezone
+from flask_sqlalchemy_bundle import SQLAlchemy
+from flask_sqlalchemy_bundle.meta.model_registry import _model_registry
+
+
+def setup(db: SQLAlchemy):
+    class Reading(db.Model):
+        class Meta:
+            created_at = None
+            updated_at = None
+
+        name = db.Column(db.String)
+        value = db.Column(db.Float, nullable=True)
+        count = db.Column(db.Integer, nullable=True)
+        taken_at = db.Column(db.DateTime)
+
+    _model_registry.finalize_mappings()
+    db.create_all()
+
+    return Reading
+
+
+class TestToColumns:
+    def test_it_works(self, db: SQLAlchemy):
+        Reading = setup(db)
+
+        first = datetime(2018, 1, 1, tzinfo=timezone.utc)
+        second = datetime(2018, 1, 2, tzinfo=timezone.utc)
+        db.session.add_all([
+            Reading(name='one', value=1.5, count=1, taken_at=first),
+            Reading(name='two', value=2.5, count=2, taken_at=second),
+        ])
+        db.session.commit()
+
+        columns = Reading.query.order_by(Reading.id).to_columns(
+            'name', Reading.value, 'count', 'taken_at',
+            batch_size=1, use_numpy=False)
+
+        assert list(columns) == ['name', 'value', 'count', 'taken_at']
+        assert columns['name'] == ['one', 'two']
+        assert columns['value'] == array.array('d', [1.5, 2.5])
+        assert columns['count'] == array.array('q', [1, 2])
+        assert columns['taken_at'] == array.array(
+            'd', [first.timestamp(), second.timestamp()])
+
+    def test_defaults_to_all_columns(self, db: SQLAlchemy):
+        Reading = setup(db)
+
+        db.session.add(Reading(name='one', value=1.0, count=1,
+                               taken_at=datetime.now(timezone.utc)))
+        db.session.commit()
+
+        columns = Reading.query.to_columns(use_numpy=False)
+        assert set(columns) == {'id', 'name', 'value', 'count', 'taken_at'}
+
+    def test_respects_filters(self, db: SQLAlchemy):
+        Reading = setup(db)
+
+        now = datetime.now(timezone.utc)
+        db.session.add_all([
+            Reading(name='one', value=1.0, count=1, taken_at=now),
+            Reading(name='two', value=2.0, count=2, taken_at=now),
+        ])
+        db.session.commit()
+
+        columns = Reading.query.filter_by(name='two').to_columns(
+            'count', use_numpy=False)
+        assert columns == {'count': array.array('q', [2])}
+
+        columns = Reading.query.filter_by(name='fail').to_columns(
+            'count', use_numpy=False)
+        assert columns == {'count': array.array('q')}
+
+    def test_nulls(self, db: SQLAlchemy):
+        Reading = setup(db)
+
+        now = datetime.now(timezone.utc)
+        db.session.add_all([
+            Reading(name='one', value=None, count=1, taken_at=now),
+            Reading(name='two', value=2.0, count=None, taken_at=now),
+        ])
+        db.session.commit()
+
+        columns = Reading.query.order_by(Reading.id).to_columns(
+            'value', 'count', use_numpy=False)
+        assert columns['value'][0] != columns['value'][0]  # NaN
+        assert columns['value'][1] == 2.0
+        assert columns['count'].typecode == 'd'
+        assert columns['count'][0] == 1.0
+        assert columns['count'][1] != columns['count'][1]  # NaN
+
+    def test_numpy(self, db: SQLAlchemy):
+        np = pytest.importorskip('numpy')
+        Reading = setup(db)
+
+        db.session.add(Reading(name='one', value=1.5, count=1,
+                               taken_at=datetime.now(timezone.utc)))
+        db.session.commit()
+
+        columns = Reading.query.to_columns('name', 'value', 'count')
+        assert columns['name'] == ['one']
+        assert isinstance(columns['value'], np.ndarray)
+        assert columns['value'].tolist() == [1.5]
+        assert columns['count'].dtype == np.int64
+
+
+class TestAsReadonly:
+    def test_it_works(self, db: SQLAlchemy):
+        Reading = setup(db)
+
+        now = datetime.now(timezone.utc)
+        db.session.add_all([
+            Reading(name='one', value=1.5, count=1, taken_at=now),
+            Reading(name='two', value=2.5, count=2, taken_at=now),
+        ])
+        db.session.commit()
+        db.session.expunge_all()
+
+        rows = Reading.query.order_by(Reading.id).as_readonly().all()
+        assert len(rows) == 2
+        assert not isinstance(rows[0], Reading)
+        assert rows[0].__model__ is Reading
+        assert [row.name for row in rows] == ['one', 'two']
+        assert rows[1].value == 2.5
+        assert rows[1].taken_at == now
+        assert not hasattr(rows[0], '__dict__')
+        assert len(db.session.identity_map) == 0
+
+        with pytest.raises(AttributeError):
+            rows[0].name = 'fail'
+
+    def test_repr_and_properties(self, db: SQLAlchemy):
+        class Person(db.Model):
+            __repr_props__ = ('id', 'first_name')
+
+            first_name = db.Column(db.String)
+            last_name = db.Column(db.String)
+
+            @property
+            def full_name(self):
+                return f'{self.first_name} {self.last_name}'
+
+            @db.hybrid_property
+            def initials(self):
+                return self.first_name[0] + self.last_name[0]
+
+        _model_registry.finalize_mappings()
+        db.create_all()
+
+        person = Person(first_name='John', last_name='Doe')
+        db.session.add(person)
+        db.session.commit()
+
+        row = Person.query.as_readonly().one()
+        assert repr(row) == repr(person)
+        assert row.full_name == 'John Doe'
+        assert row.initials == 'JD'
+
+    def test_other_query_methods_still_work(self, db: SQLAlchemy):
+        Reading = setup(db)
+
+        now = datetime.now(timezone.utc)
+        db.session.add_all([
+            Reading(name='one', value=1.5, count=1, taken_at=now),
+            Reading(name='two', value=2.5, count=2, taken_at=now),
+        ])
+        db.session.commit()
+
+        q = Reading.query.as_readonly()
+        assert q.count() == 2
+        assert q.count_by(name='one') == 1
+        assert q.pluck('name', name='two') == ['two']
+        assert q.filter_by(name='two').first().count == 2
@@ -1,8 +1,13 @@
 import pytest
 
-from flask_sqlalchemy_bundle.decorators import param_converter
+from datetime import timedelta
+from flask_sqlalchemy_bundle.decorators import Many, param_converter
+from flask_sqlalchemy_bundle.meta.model_registry import _model_registry
 from flask_sqlalchemy_bundle.pytest import ModelFactory
-from werkzeug.exceptions import NotFound
+from sqlalchemy import event
+from http import HTTPStatus
+from werkzeug.exceptions import BadRequest, NotFound
+from werkzeug.http import http_date
 
 
 @pytest.fixture()
@@ -121,3 +126,208 @@ class TestParamConverter:
                 assert one_user.id == user.id
                 assert foo == 42
             method(id=user.id)
+
+
+def setup(db):
+    class Author(db.Model):
+        name = db.Column(db.String)
+
+    class Book(db.Model):
+        title = db.Column(db.String)
+        author_id = db.foreign_key('Author')
+        author = db.relationship('Author')
+
+    _model_registry.finalize_mappings()
+    db.create_all()
+
+    one, two = Author(name='one'), Author(name='two')
+    book = Book(title='title', author=one)
+    db.session.add_all([one, two, book])
+    db.session.commit()
+    ids = [one.id, two.id, book.id]  # also refreshes the expired instances
+
+    statements = []
+    event.listen(db.session.bind, 'before_cursor_execute',
+                 lambda *args: statements.append(args[2]))
+
+    return Author, Book, one, two, book, ids, statements
+
+
+class TestParamConverterPlan:
+    def test_pk_lookups_use_the_identity_map(self, db):
+        Author, Book, one, two, book, ids, statements = setup(db)
+
+        @param_converter(id=Book, author_id=Author)
+        def method(book, author):
+            return book, author
+
+        assert method(id=book.id, author_id=one.id) == (book, one)
+        assert statements == []
+
+        db.session.expunge_all()
+        assert method(id=ids[2], author_id=ids[1])[1].name == 'two'
+        assert len(statements) == 2
+
+        with pytest.raises(NotFound):
+            method(id=0, author_id=ids[0])
+
+    def test_non_pk_lookup(self, db):
+        Author, Book, one, two, book, ids, statements = setup(db)
+
+        @param_converter(title=Book)
+        def method(book):
+            return book
+
+        assert method(title='title') == book
+        with pytest.raises(NotFound):
+            method(title='fail')
+
+    def test_non_integer_pk_lookup(self, db):
+        class Category(db.Model):
+            class Meta:
+                pk = None
+            name = db.Column(db.String, primary_key=True)
+
+        _model_registry.finalize_mappings()
+        db.create_all()
+        category = Category(name='books')
+        db.session.add(category)
+        db.session.commit()
+
+        @param_converter(name=Category)
+        def method(category):
+            return category
+
+        assert method(name='books') == category
+        with pytest.raises(NotFound):
+            method(name='fail')
+
+    def test_check_related(self, db):
+        Author, Book, one, two, book, ids, statements = setup(db)
+
+        @param_converter(author_id=Author, book_id=Book, check_related=True)
+        def method(author, book):
+            return author, book
+
+        db.session.expunge_all()
+        author, book = method(author_id=ids[0], book_id=ids[2])
+        assert (author.id, book.id) == (ids[0], ids[2])
+        assert len(statements) == 1
+        assert 'JOIN' in statements[0]
+
+        with pytest.raises(NotFound):
+            method(author_id=ids[1], book_id=ids[2])
+        with pytest.raises(NotFound):
+            method(author_id=ids[0], book_id=0)
+
+    def test_conditional(self, app, db):
+        Author, Book, one, two, book, ids, statements = setup(db)
+        db.session.expunge_all()
+
+        calls = []
+
+        @param_converter(id=Author, conditional=True)
+        def method(author):
+            calls.append(author)
+            return 'author'
+
+        with app.test_request_context():
+            response = method(id=ids[0])
+        assert response.status_code == 200
+        assert response.get_data() == b'author'
+        etag, _ = response.get_etag()
+        assert etag == calls[0].etag
+        assert response.last_modified
+        statements.clear()
+
+        with app.test_request_context(headers={'If-None-Match': f'"{etag}"'}):
+            response = method(id=ids[0])
+        assert response.status_code == 304
+        assert len(calls) == 1
+        assert len(statements) == 1
+        assert 'author.name' not in statements[0]
+
+        with app.test_request_context(headers={'If-None-Match': '"fail"'}):
+            assert method(id=ids[0]).status_code == 200
+        assert len(calls) == 2
+
+        last_modified = http_date(calls[0].updated_at + timedelta(hours=1))
+        with app.test_request_context(
+                headers={'If-Modified-Since': last_modified}):
+            assert method(id=ids[0]).status_code == 304
+
+        last_modified = http_date(calls[0].updated_at - timedelta(hours=1))
+        with app.test_request_context(
+                headers={'If-Modified-Since': last_modified}):
+            assert method(id=ids[0]).status_code == 200
+
+        with app.test_request_context(headers={'If-None-Match': f'"{etag}"'}):
+            with pytest.raises(NotFound):
+                method(id=0)
+
+    def test_conditional_check_related(self, app, db):
+        Author, Book, one, two, book, ids, statements = setup(db)
+        db.session.expunge_all()
+
+        @param_converter(author_id=Author, book_id=Book, check_related=True,
+                         conditional=True)
+        def method(author, book):
+            return 'book'
+
+        with app.test_request_context():
+            etag, _ = method(author_id=ids[0], book_id=ids[2]).get_etag()
+        statements.clear()
+
+        # the validators of both models get selected with one joined query
+        with app.test_request_context(headers={'If-None-Match': f'"{etag}"'}):
+            response = method(author_id=ids[0], book_id=ids[2])
+        assert response.status_code == 304
+        assert len(statements) == 1
+        assert 'JOIN' in statements[0]
+        assert 'book.title' not in statements[0]
+
+        with app.test_request_context(headers={'If-None-Match': f'"{etag}"'}):
+            with pytest.raises(NotFound):
+                method(author_id=ids[1], book_id=ids[2])
+
+    def test_many(self, app, db):
+        Author, Book, one, two, book, ids, statements = setup(db)
+        db.session.expunge_all()
+
+        @param_converter(ids=[Author])
+        def method(ids=None):
+            return ids
+
+        with app.test_request_context(f'/?ids={ids[1]}&ids={ids[0]}'):
+            assert [a.name for a in method()] == ['two', 'one']
+        assert len(statements) == 1
+
+        with app.test_request_context(f'/?ids={ids[0]}&ids=0'):
+            with pytest.raises(NotFound):
+                method()
+
+        with app.test_request_context('/?ids=fail'):
+            with pytest.raises(NotFound):
+                method()
+
+        with app.test_request_context('/'):
+            assert method() is None
+
+    def test_many_options(self, app, db):
+        Author, Book, one, two, book, ids, statements = setup(db)
+
+        @param_converter(names=Many(Author, by='name', max_length=2,
+                                    error=HTTPStatus.BAD_REQUEST))
+        def method(names):
+            return names
+
+        with app.test_request_context('/?names=one&names=one'):
+            assert method() == [one, one]
+
+        with app.test_request_context('/?names=one&names=fail'):
+            with pytest.raises(BadRequest):
+                method()
+
+        with app.test_request_context('/?names=one&names=two&names=one'):
+            with pytest.raises(BadRequest):
+                method()
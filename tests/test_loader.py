@@ -0,0 +1,77 @@
+import pytest
+
+from flask_sqlalchemy_bundle import SQLAlchemy
+from flask_sqlalchemy_bundle.loader import DeferredInstance
+from flask_sqlalchemy_bundle.meta.model_registry import _model_registry
+from sqlalchemy import event
+
+
+def setup(db: SQLAlchemy):
+    class Foo(db.Model):
+        name = db.Column(db.String)
+
+    _model_registry.finalize_mappings()
+    db.create_all()
+
+    foos = [Foo(name=name) for name in ['one', 'two', 'three']]
+    db.session.add_all(foos)
+    db.session.commit()
+    ids = [foo.id for foo in foos]
+    db.session.expunge_all()
+
+    statements = []
+    event.listen(db.session.bind, 'before_cursor_execute',
+                 lambda *args: statements.append(args[2]))
+
+    return Foo, ids, statements
+
+
+class TestModelLoader:
+    def test_it_batches_lookups(self, app, db: SQLAlchemy):
+        Foo, ids, statements = setup(db)
+
+        with app.test_request_context():
+            one = Foo.loader.load(ids[0])
+            two = Foo.loader.load(str(ids[1]))
+            missing = Foo.loader.load(42)
+            assert isinstance(one, DeferredInstance)
+            assert statements == []
+
+            assert one.name == 'one'
+            assert len(statements) == 1
+            assert two.resolve().name == 'two'
+            assert not missing
+            assert missing.resolve() is None
+            with pytest.raises(AttributeError):
+                missing.name
+            assert len(statements) == 1
+
+            # results are cached for the rest of the request
+            assert Foo.loader.load(ids[0]).resolve() is one.resolve()
+            assert len(statements) == 1
+
+            three = Foo.loader.load(ids[2])
+            assert three.name == 'three'
+            assert len(statements) == 2
+
+        db.session.expunge_all()
+        with app.test_request_context():
+            assert Foo.loader.load(ids[0]).name == 'one'
+            assert len(statements) == 3
+
+    def test_it_uses_the_identity_map(self, app, db: SQLAlchemy):
+        Foo, ids, statements = setup(db)
+
+        with app.test_request_context():
+            one = Foo.query.get(ids[0])
+            assert len(statements) == 1
+            assert Foo.loader.load(ids[0]).resolve() is one
+            assert len(statements) == 1
+
+    def test_load_many(self, app, db: SQLAlchemy):
+        Foo, ids, statements = setup(db)
+
+        with app.test_request_context():
+            foos = Foo.loader.load_many(ids)
+            assert [foo.name for foo in foos] == ['one', 'two', 'three']
+            assert len(statements) == 1
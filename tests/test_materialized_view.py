@@ -0,0 +1,633 @@
+import click
+import pytest
+import threading
+import time
+
+from flask_sqlalchemy_bundle import FlaskSQLAlchemyBundle, ModelManager
+from flask_sqlalchemy_bundle.commands import (make_refresh_worker,
+                                             views_status_command)
+from flask_sqlalchemy_bundle.meta.model_registry import _model_registry
+from flask_sqlalchemy_bundle.sqla import (MaterializedViewRefreshWorker,
+                                          request_materialized_view_refresh)
+from flask_sqlalchemy_bundle.sqla import materialized_view, refresh_stats
+from flask_sqlalchemy_bundle.sqla.refresh_stats import (
+    claim_stale, get_refresh_stats_table, mark_stale, record_refresh)
+from flask.cli import ScriptInfo
+from flask_unchained import unchained
+from sqlalchemy import event, func, inspect as sa_inspect, text
+from sqlalchemy.exc import OperationalError
+from tests.conftest import POSTGRES
+
+
+def setup(db, policy='on_commit'):
+    class Item(db.Model):
+        category = db.Column(db.String)
+        price = db.Column(db.Integer)
+
+    class CategoryStats(db.MaterializedView):
+        class Meta:
+            mv_for = 'Item'
+            refresh = policy
+
+        @classmethod
+        def selectable(cls):
+            return (db.select([Item.category.label('id'),
+                               func.count(Item.id).label('count')])
+                    .group_by(Item.category))
+
+    _model_registry.finalize_mappings()
+    db.create_all()
+
+    class ItemManager(ModelManager):
+        model = Item
+
+    statements = []
+    event.listen(db.session.bind, 'before_cursor_execute',
+                 lambda *args: statements.append(args[2]))
+
+    return Item, CategoryStats, ItemManager(), statements
+
+
+def _refreshes(statements):
+    return [s for s in statements if s.startswith('REFRESH')]
+
+
+@pytest.mark.options(SQLALCHEMY_DATABASE_URI=POSTGRES)
+class TestRefreshPolicies:
+    def test_on_commit(self, db):
+        Item, CategoryStats, item_manager, statements = setup(db)
+
+        for i in range(5):
+            item_manager.create(category='a', price=i)
+        item_manager.create(category='b', price=42)
+        db.session.flush()
+        assert _refreshes(statements) == []
+
+        item_manager.commit()
+        assert len(_refreshes(statements)) == 1
+        assert {row.id: row.count for row in CategoryStats.query} == {
+            'a': 5, 'b': 1}
+
+        item_manager.commit()
+        assert len(_refreshes(statements)) == 1
+
+    def test_on_commit_rollback(self, db):
+        Item, CategoryStats, item_manager, statements = setup(db)
+
+        item_manager.create(category='a', price=1)
+        db.session.flush()
+        db.session.rollback()
+        item_manager.commit()
+        assert _refreshes(statements) == []
+
+    def test_on_commit_failure(self, db, monkeypatch):
+        Item, CategoryStats, item_manager, statements = setup(db)
+        errors = []
+        monkeypatch.setattr(materialized_view.logger, 'exception',
+                            errors.append)
+
+        def fail(*args, **kwargs):
+            raise RuntimeError('boom')
+
+        with monkeypatch.context() as m:
+            m.setattr(CategoryStats, 'refresh', fail)
+            item_manager.create(category='a', price=1, commit=True)
+        assert errors == ["Failed to refresh materialized view "
+                          "'category_stats' after commit"]
+        assert not _refreshes(statements)
+
+        # the view stays stale until the session's next commit
+        db.session.commit()
+        assert len(_refreshes(statements)) == 1
+
+    def test_immediate(self, db):
+        Item, CategoryStats, item_manager, statements = setup(
+            db, policy='immediate')
+
+        for i in range(3):
+            item_manager.create(category='a', price=i)
+        db.session.flush()
+        assert len(_refreshes(statements)) == 3
+
+    def test_async(self, db):
+        Item, CategoryStats, item_manager, statements = setup(
+            db, policy='async')
+
+        for i in range(3):
+            item_manager.create(category='a', price=i)
+        item_manager.commit()
+        assert _refreshes(statements) == []
+        assert len([s for s in statements if 'pg_notify' in s]) == 1
+
+
+@pytest.mark.options(SQLALCHEMY_DATABASE_URI=POSTGRES)
+class TestRefreshWorker:
+    def test_bounds(self, db):
+        Item, CategoryStats, item_manager, statements = setup(
+            db, policy='async')
+        CategoryStats._meta.min_interval = 10
+        CategoryStats._meta.max_staleness = 15
+        worker = MaterializedViewRefreshWorker(db.engine, [CategoryStats])
+        name = CategoryStats.__tablename__
+
+        worker.mark_stale(name, now=100)
+        worker.mark_stale(name, now=101)
+        assert worker.refresh_due(db.session.bind, now=100) == [name]
+        assert len(_refreshes(statements)) == 1
+
+        # within min_interval of the previous refresh
+        worker.mark_stale(name, now=105)
+        assert worker.refresh_due(db.session.bind, now=109) == []
+        assert worker.due_at(name) == 110
+        assert worker.refresh_due(db.session.bind, now=110) == [name]
+
+        # max_staleness wins over min_interval
+        CategoryStats._meta.min_interval = 60
+        worker.mark_stale(name, now=111)
+        assert worker.due_at(name) == 126
+        assert worker.refresh_due(db.session.bind, now=126) == [name]
+        assert len(_refreshes(statements)) == 3
+        assert worker.due_at(name) is None
+
+    def test_failed_refreshes(self, db, monkeypatch):
+        Item, CategoryStats, item_manager, statements = setup(
+            db, policy='async')
+        worker = MaterializedViewRefreshWorker(db.engine, [CategoryStats])
+        name = CategoryStats.__tablename__
+
+        def fail(*args, **kwargs):
+            raise RuntimeError('boom')
+
+        monkeypatch.setattr(CategoryStats, 'refresh', fail)
+        worker.mark_stale(name, now=100)
+        assert worker.refresh_due(db.session.bind, now=100) == []
+        assert name not in worker._last_refreshed
+        assert worker.due_at(name) == 101  # retried after the poll interval
+
+    def test_not_started_for_cli_commands(self, app):
+        app.config['SQLALCHEMY_MATERIALIZED_VIEW_REFRESH_WORKER'] = True
+        with click.Context(click.Command('upgrade'), info_name='upgrade'):
+            FlaskSQLAlchemyBundle.after_init_app(app)
+        assert 'materialized_view_refresh_worker' not in app.extensions
+
+        with click.Context(click.Command('run'), info_name='run'):
+            FlaskSQLAlchemyBundle.after_init_app(app)
+        assert 'materialized_view_refresh_worker' in app.extensions
+
+    def test_listens_for_requests(self, db):
+        Item, CategoryStats, item_manager, statements = setup(
+            db, policy='async')
+        worker = MaterializedViewRefreshWorker(db.engine, [CategoryStats],
+                                               poll_interval=0.05)
+        name = CategoryStats.__tablename__
+        worker.start()
+        try:
+            time.sleep(0.2)
+            request_materialized_view_refresh(name, db.engine)
+            for _ in range(50):
+                if name in worker._last_refreshed:
+                    break
+                time.sleep(0.05)
+        finally:
+            worker.stop(timeout=5)
+        assert name in worker._last_refreshed
+
+
+@pytest.mark.options(SQLALCHEMY_DATABASE_URI=POSTGRES)
+class TestRefreshAll:
+    def test_refreshes_dependencies_first(self, db):
+        class Item(db.Model):
+            category = db.Column(db.String)
+
+        class CategoryStats(db.MaterializedView):
+            class Meta:
+                mv_for = 'Item'
+
+            @classmethod
+            def selectable(cls):
+                return (db.select([Item.category.label('id'),
+                                   func.count(Item.id).label('count')])
+                        .group_by(Item.category))
+
+        class TotalStats(db.MaterializedView):
+            class Meta:
+                mv_for = 'Item'
+
+            @classmethod
+            def selectable(cls):
+                stats = CategoryStats.__table__
+                return db.select([func.count(stats.c.id).label('id')])
+
+        class ItemStats(db.MaterializedView):
+            class Meta:
+                mv_for = 'Item'
+
+            @classmethod
+            def selectable(cls):
+                return db.select([func.count(Item.id).label('id')])
+
+        _model_registry.finalize_mappings()
+        db.create_all()
+
+        refreshes = []
+        event.listen(db.engine, 'before_cursor_execute',
+                     lambda *args: refreshes.append(args[2].split()[-1])
+                     if args[2].startswith('REFRESH') else None)
+
+        db.refresh_all_materialized_views(max_workers=2)
+        assert len(refreshes) == 3
+        assert (refreshes.index(CategoryStats.__tablename__)
+                < refreshes.index(TotalStats.__tablename__))
+
+
+class TestIncremental:
+    def test_deltas(self, db):
+        Item, CategoryStats, item_manager, statements = setup(
+            db, policy='incremental')
+        assert 'incremental_view_plan' in CategoryStats.__table__.info
+
+        def stats():
+            return dict(db.session.query(CategoryStats.id,
+                                         CategoryStats.count))
+
+        items = [item_manager.create(category='a', price=i) for i in range(5)]
+        item_manager.create(category='b', price=42)
+        db.session.flush()
+        assert stats() == {'a': 5, 'b': 1}
+
+        # one upsert per changed group, and no full rebuilds
+        assert len([s for s in statements
+                    if s.startswith('INSERT INTO category_stats')]) == 2
+        assert not [s for s in statements if 'GROUP BY' in s]
+
+        item_manager.update(items[0], category='b')
+        item_manager.update(items[1], price=100)  # irrelevant to the view
+        db.session.flush()
+        assert stats() == {'a': 4, 'b': 2}
+
+        for item in items[1:]:
+            item_manager.delete(item)
+        db.session.flush()
+        assert stats() == {'b': 2}
+
+        db.session.rollback()
+        assert stats() == {}
+
+    def test_min_max(self, db):
+        class Item(db.Model):
+            category = db.Column(db.String)
+            price = db.Column(db.Integer, nullable=True)
+
+        class PriceStats(db.MaterializedView):
+            class Meta:
+                mv_for = 'Item'
+                refresh = 'incremental'
+
+            @classmethod
+            def selectable(cls):
+                return (db.select([Item.category.label('id'),
+                                   func.count().label('count'),
+                                   func.sum(Item.price).label('total'),
+                                   func.min(Item.price).label('lowest'),
+                                   func.max(Item.price).label('highest')])
+                        .group_by(Item.category))
+
+        _model_registry.finalize_mappings()
+        db.create_all()
+
+        def stats():
+            return {row.id: (row.count, row.total, row.lowest, row.highest)
+                    for row in db.session.query(PriceStats.__table__)}
+
+        items = [Item(category='a', price=price) for price in (1, 5, None)]
+        db.session.add_all(items)
+        db.session.flush()
+        assert stats() == {'a': (3, 6, 1, 5)}
+
+        db.session.delete(items[1])
+        db.session.flush()
+        assert stats() == {'a': (2, 1, 1, 1)}
+
+        items[0].price = None
+        db.session.flush()
+        assert stats() == {'a': (2, None, None, None)}
+
+        db.session.add(Item(category='a', price=3))
+        db.session.flush()
+        assert stats() == {'a': (3, 3, 3, 3)}
+
+        PriceStats.refresh()
+        assert stats() == {'a': (3, 3, 3, 3)}
+
+
+@pytest.mark.options(SQLALCHEMY_DATABASE_URI=POSTGRES)
+class TestIncrementalPostgres(TestIncremental):
+    def test_falls_back_to_on_commit(self, db):
+        class Item(db.Model):
+            category = db.Column(db.String)
+
+        class FilteredStats(db.MaterializedView):
+            class Meta:
+                mv_for = 'Item'
+                refresh = 'incremental'
+
+            @classmethod
+            def selectable(cls):
+                return (db.select([Item.category.label('id'),
+                                   func.count(Item.id).label('count')])
+                        .where(Item.category != 'c')
+                        .group_by(Item.category))
+
+        _model_registry.finalize_mappings()
+        db.create_all()
+        assert 'incremental_view_plan' not in FilteredStats.__table__.info
+
+        statements = []
+        event.listen(db.session.bind, 'before_cursor_execute',
+                     lambda *args: statements.append(args[2]))
+        db.session.add(Item(category='a'))
+        db.session.commit()
+        assert len(_refreshes(statements)) == 1
+
+
+class TestEmulated:
+    def test_refresh(self, db):
+        Item, CategoryStats, item_manager, statements = setup(db)
+
+        for i in range(5):
+            item_manager.create(category='a', price=i)
+        item_manager.create(category='b', price=42)
+        item_manager.commit()
+        assert not _refreshes(statements)
+        assert {row.id: row.count for row in CategoryStats.query} == {
+            'a': 5, 'b': 1}
+
+        # the swapped-in table keeps the indexes, primary key and column types
+        inspector = sa_inspect(db.session.bind)
+        index_names = {idx['name'] for idx in
+                       inspector.get_indexes('category_stats')}
+        assert 'ix_category_stats_id' in index_names
+        assert inspector.get_pk_constraint('category_stats')[
+            'constrained_columns'] == ['id', 'count']
+        assert {col['name']: str(col['type']) for col in
+                inspector.get_columns('category_stats')} == {
+            'id': 'VARCHAR', 'count': 'INTEGER'}
+
+        item_manager.create(category='c', price=1)
+        item_manager.create(category='c', price=2)
+        db.session.flush()
+        CategoryStats.refresh(concurrently=False)
+        db.session.expire_all()
+        assert {row.id: row.count for row in CategoryStats.query} == {
+            'a': 5, 'b': 1, 'c': 2}
+
+    def test_refresh_levels_of_joins(self, db):
+        Item, CategoryStats, item_manager, statements = setup(db)
+
+        class ItemCategoryStats(db.MaterializedView):
+            class Meta:
+                mv_for = 'Item'
+
+            @classmethod
+            def selectable(cls):
+                stats = CategoryStats.__table__
+                return db.select([Item.id.label('id'),
+                                  stats.c.count.label('count')]).select_from(
+                    Item.__table__.join(stats, Item.category == stats.c.id))
+
+        _model_registry.finalize_mappings()
+        assert materialized_view._get_refresh_levels(
+            db.session.bind, db.metadata) == [
+            [CategoryStats.__tablename__], [ItemCategoryStats.__tablename__]]
+
+    def test_refresh_all(self, db):
+        Item, CategoryStats, item_manager, statements = setup(db)
+        item_manager.create(category='a', price=1, commit=True)
+        # emulated views always get refreshed serially (on the same thread)
+        threads = set()
+        event.listen(db.engine, 'before_cursor_execute',
+                     lambda *args: threads.add(threading.get_ident()))
+        db.refresh_all_materialized_views(max_workers=4)
+        assert threads == {threading.get_ident()}
+        assert {row.id: row.count for row in CategoryStats.query} == {'a': 1}
+
+
+class TestFreshness:
+    @pytest.mark.options(SQLALCHEMY_DATABASE_URI=POSTGRES)
+    def test_records_refreshes(self, db):
+        Item, CategoryStats, item_manager, statements = setup(db)
+        assert CategoryStats.freshness() is None
+
+        item_manager.create(category='a', price=1)
+        item_manager.create(category='b', price=2)
+        item_manager.create(category='b', price=3, commit=True)
+        freshness = CategoryStats.freshness()
+        assert freshness['last_trigger'] == 'event'
+        assert freshness['refresh_count'] == 1
+        assert freshness['last_duration'] >= 0
+        assert 0 <= freshness['age'] < 60
+
+        # the row count is postgres' estimate (known once it's been analyzed)
+        db.session.execute('ANALYZE category_stats')
+        db.session.commit()
+        CategoryStats.refresh()
+        freshness = CategoryStats.freshness()
+        assert freshness['last_trigger'] == 'manual'
+        assert freshness['row_count'] == 2
+        assert freshness['refresh_count'] == 2
+
+    def test_records_row_counts_of_emulated_views(self, db):
+        Item, CategoryStats, item_manager, statements = setup(db)
+        item_manager.create(category='a', price=1)
+        item_manager.create(category='b', price=2)
+        item_manager.create(category='b', price=3, commit=True)
+        assert CategoryStats.freshness()['row_count'] == 2
+
+        CategoryStats.refresh(concurrently=False)
+        assert CategoryStats.freshness()['row_count'] == 2
+
+    def test_recording_is_best_effort(self, db, monkeypatch):
+        Item, CategoryStats, item_manager, statements = setup(db)
+        errors = []
+        monkeypatch.setattr(refresh_stats.logger, 'exception', errors.append)
+        db.engine.execute('DROP TABLE materialized_view_refreshes')
+        try:
+            item_manager.create(category='a', price=1, commit=True)
+            assert {row.id: row.count for row in CategoryStats.query} == {
+                'a': 1}
+            assert errors == ["Failed to record the refresh of materialized "
+                              "view 'category_stats'"]
+        finally:
+            get_refresh_stats_table(db.metadata).create(db.engine)
+
+    def test_views_status_command(self, app, db, capsys):
+        Item, CategoryStats, item_manager, statements = setup(db)
+        unchained.flask_sqlalchemy_bundle.models.update(
+            _model_registry.finalize_mappings())
+        CategoryStats.refresh()
+
+        def status():
+            ctx = views_status_command.make_context(
+                'views-status', [], obj=ScriptInfo(create_app=lambda info: app))
+            with ctx:
+                views_status_command.invoke(ctx)
+            return capsys.readouterr().out.splitlines()[1].split()
+
+        assert status()[0] == 'category_stats'
+        assert status()[-3:] == ['manual', '0', '1']
+
+        db.session.execute('UPDATE materialized_view_refreshes '
+                           'SET row_count = NULL')
+        db.session.commit()
+        assert status()[-3:] == ['manual', '-', '1']
+
+
+@pytest.mark.options(SQLALCHEMY_DATABASE_URI=POSTGRES)
+class TestColumnAwareInvalidation:
+    def test_only_refreshes_for_selected_columns(self, db):
+        Item, CategoryStats, item_manager, statements = setup(db)
+        item = item_manager.create(category='a', price=1, commit=True)
+        assert len(_refreshes(statements)) == 1
+
+        # price isn't used by the view
+        item_manager.update(item, price=2, commit=True)
+        assert len(_refreshes(statements)) == 1
+
+        item_manager.update(item, category='b', commit=True)
+        assert len(_refreshes(statements)) == 2
+
+
+@pytest.mark.options(SQLALCHEMY_DATABASE_URI=POSTGRES)
+class TestRefreshOnRead:
+    @pytest.fixture(autouse=True)
+    def reset_polls(self):
+        materialized_view._on_read_polled.clear()
+
+    def test_refreshes_on_first_read(self, db):
+        Item, CategoryStats, item_manager, statements = setup(
+            db, policy='on_read')
+
+        item_manager.create(category='a', price=1)
+        item_manager.create(category='b', price=2)
+        item_manager.create(category='b', price=3, commit=True)
+        assert _refreshes(statements) == []
+        assert CategoryStats.freshness()['stale_since'] is not None
+
+        assert {row.id: row.count for row in CategoryStats.query} == {
+            'a': 1, 'b': 2}
+        assert len(_refreshes(statements)) == 1
+        assert CategoryStats.freshness()['stale_since'] is None
+
+        CategoryStats.query.all()
+        assert len(_refreshes(statements)) == 1
+
+    def test_stale_marker_from_another_process(self, db):
+        Item, CategoryStats, item_manager, statements = setup(
+            db, policy='on_read')
+        item_manager.create(category='a', price=1)
+        db.session.flush()
+
+        # only the marker row is set, like after a write by another process
+        mark_stale(db.session.bind, db.metadata, CategoryStats.__tablename__)
+        assert {row.id: row.count for row in CategoryStats.query} == {'a': 1}
+        assert len(_refreshes(statements)) == 1
+
+    def test_only_one_refresh(self, db):
+        Item, CategoryStats, item_manager, statements = setup(
+            db, policy='on_read')
+        name = CategoryStats.__tablename__
+        mark_stale(db.session.bind, db.metadata, name)
+        assert claim_stale(db.session.bind, db.metadata, name)
+        assert not claim_stale(db.session.bind, db.metadata, name)
+
+        CategoryStats.query.all()
+        assert _refreshes(statements) == []
+
+    def test_polls_stale_markers_at_an_interval(self, db):
+        Item, CategoryStats, item_manager, statements = setup(
+            db, policy='on_read')
+        item_manager.create(category='a', price=1)
+        db.session.flush()
+
+        def polls():
+            return [s for s in statements if s.startswith('SELECT '
+                    'materialized_view_refreshes.stale_since')]
+
+        CategoryStats.query.all()
+        assert len(polls()) == 1
+        CategoryStats.query.all()
+        assert len(polls()) == 1
+
+        # markers of other processes get picked up by the next poll
+        mark_stale(db.session.bind, db.metadata, CategoryStats.__tablename__)
+        CategoryStats.query.all()
+        assert _refreshes(statements) == []
+        materialized_view._on_read_polled.clear()
+        assert {row.id: row.count for row in CategoryStats.query} == {'a': 1}
+        assert len(_refreshes(statements)) == 1
+
+    def test_missing_stats_table_is_not_stale(self, db):
+        Item, CategoryStats, item_manager, statements = setup(
+            db, policy='on_read')
+        db.session.execute('DROP TABLE materialized_view_refreshes')
+        assert CategoryStats.query.all() == []
+        assert _refreshes(statements) == []
+
+
+@pytest.mark.options(SQLALCHEMY_DATABASE_URI=POSTGRES)
+class TestDedicatedRefreshes:
+    def _lock(self, db, name):
+        conn = db.engine.connect()
+        transaction = conn.begin()
+        conn.execute(text('SELECT pg_advisory_xact_lock(hashtext(:key))'),
+                     key=f'materialized_view:{name}')
+        return conn, transaction
+
+    def test_skip_and_lock_timeout(self, db):
+        Item, CategoryStats, item_manager, statements = setup(db)
+        conn, transaction = self._lock(db, CategoryStats.__tablename__)
+        try:
+            assert CategoryStats.refresh(bind=db.engine,
+                                         on_locked='skip') is False
+            with pytest.raises(OperationalError):
+                CategoryStats.refresh(bind=db.engine, lock_timeout=0.1)
+        finally:
+            transaction.rollback()
+            conn.close()
+
+        assert CategoryStats.refresh(bind=db.engine) is True
+        assert CategoryStats.freshness()['refresh_count'] == 1
+
+    def test_coalesce(self, db):
+        Item, CategoryStats, item_manager, statements = setup(db)
+        name = CategoryStats.__tablename__
+        conn, transaction = self._lock(db, name)
+
+        results, engine = [], db.engine
+        thread = threading.Thread(target=lambda: results.append(
+            CategoryStats.refresh(bind=engine)))
+        thread.start()
+        time.sleep(0.2)
+
+        # another process refreshes the view while this one waits for it
+        record_refresh(conn, db.metadata, name, 'manual', 0)
+        transaction.commit()
+        conn.close()
+        thread.join(5)
+        assert results == [False]
+
+    @pytest.mark.options(SQLALCHEMY_DATABASE_URI=POSTGRES,
+                         SQLALCHEMY_MATERIALIZED_VIEW_REFRESH_ON_LOCKED='skip')
+    def test_settings_apply_without_app_context(self, app, db):
+        Item, CategoryStats, item_manager, statements = setup(db)
+        conn, transaction = self._lock(db, CategoryStats.__tablename__)
+        try:
+            # refreshed by worker threads (which have no app context)
+            db.refresh_all_materialized_views(max_workers=2)
+        finally:
+            transaction.rollback()
+            conn.close()
+        assert CategoryStats.freshness() is None
+
+        worker = make_refresh_worker(app)
+        assert worker.refresh_options['on_locked'] == 'skip'
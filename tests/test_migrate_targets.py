@@ -0,0 +1,131 @@
+import functools
+import pytest
+
+from flask import current_app
+from flask_migrate import init
+from flask_sqlalchemy_bundle import commands
+from flask_sqlalchemy_bundle.commands import upgrade_target
+from flask_sqlalchemy_bundle.extensions.migrate import MigrationTarget
+from tests.conftest import POSTGRES
+
+
+SQLITE_BIND = 'sqlite:///:memory:'
+
+
+def _echo_uri(target):
+    print(target.name, current_app.config['SQLALCHEMY_DATABASE_URI'])
+
+
+def _fail_on_tenant_b(target):
+    if target.schema == 'tenant_b':
+        raise ValueError('boom')
+
+
+@pytest.fixture()
+def migrate(app):
+    return app.extensions['migrate'].migrate
+
+
+@pytest.mark.options(SQLALCHEMY_DATABASE_URI=POSTGRES,
+                     SQLALCHEMY_BINDS={'other': SQLITE_BIND},
+                     SQLALCHEMY_MIGRATION_BINDS=True,
+                     SQLALCHEMY_MIGRATION_SCHEMAS=lambda app: ['tenant_a',
+                                                               'tenant_b'])
+def test_get_targets(app, migrate):
+    targets = migrate.get_targets(app)
+    # schemas only apply to postgres databases
+    assert [target.name for target in targets] == [
+        'default/tenant_a', 'default/tenant_b', 'other',
+    ]
+    assert targets[1].get_url(app) == \
+        f'{POSTGRES}?options=-csearch_path=tenant_b'
+    assert targets[-1].get_url(app) == SQLITE_BIND
+
+
+def test_get_targets_default(app, migrate):
+    assert [target.name for target in migrate.get_targets(app)] == ['default']
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_run_for_targets(app, migrate, tmpdir, processes):
+    targets = [MigrationTarget(None, schema)
+               for schema in ['tenant_a', 'tenant_b', 'tenant_c']]
+
+    results = migrate.run_for_targets(_echo_uri, targets, processes=processes,
+                                      log_dir=str(tmpdir), app=app)
+    assert [result.status for result in results] == ['ok'] * 3
+    assert tmpdir.join('default-tenant_b.log').read() == \
+        'default/tenant_b sqlite://?options=-csearch_path=tenant_b\n'
+    assert app.config['SQLALCHEMY_DATABASE_URI'] == 'sqlite://'
+
+    results = migrate.run_for_targets(_fail_on_tenant_b, targets,
+                                      processes=processes, fail_fast=False,
+                                      log_dir=str(tmpdir), app=app)
+    assert [result.status for result in results] == ['ok', 'failed', 'ok']
+    assert results[1].error == 'ValueError: boom'
+    assert 'ValueError: boom' in tmpdir.join('default-tenant_b.log').read()
+
+    if processes == 1:
+        results = migrate.run_for_targets(_fail_on_tenant_b, targets,
+                                          log_dir=str(tmpdir), app=app)
+        assert [result.status for result in results] == \
+            ['ok', 'failed', 'skipped']
+
+
+_REVISION = """
+from alembic import op
+import sqlalchemy as sa
+
+revision = 'aaa'
+down_revision = None
+
+
+def upgrade():
+    op.create_table('tenant_item', sa.Column('id', sa.Integer, primary_key=True))
+
+
+def downgrade():
+    op.drop_table('tenant_item')
+"""
+
+
+@pytest.mark.options(SQLALCHEMY_DATABASE_URI=POSTGRES)
+def test_upgrade_tenant_schemas(app, db, migrate, tmpdir, monkeypatch):
+    directory = str(tmpdir.join('migrations'))
+    init(directory)
+    tmpdir.join('migrations', 'versions', 'aaa.py').write(_REVISION)
+    monkeypatch.setattr(migrate, 'directory', directory)
+
+    schemas = ['tenant_a', 'tenant_b']
+    targets = [MigrationTarget(None, schema) for schema in schemas]
+    try:
+        results = migrate.run_for_targets(
+            functools.partial(upgrade_target, directory=directory), targets,
+            processes=2, log_dir=str(tmpdir.join('logs')), app=app)
+        assert [result.status for result in results] == ['ok', 'ok'], \
+            [result.error for result in results]
+
+        assert sorted(db.engine.execute(
+            "SELECT table_schema, table_name FROM information_schema.tables "
+            "WHERE table_schema LIKE 'tenant_%%' ORDER BY 1, 2")) == [
+            ('tenant_a', 'alembic_version'), ('tenant_a', 'tenant_item'),
+            ('tenant_b', 'alembic_version'), ('tenant_b', 'tenant_item'),
+        ]
+    finally:
+        for schema in schemas:
+            db.engine.execute(f'DROP SCHEMA IF EXISTS {schema} CASCADE')
+
+
+@pytest.mark.options(SQLALCHEMY_DATABASE_URI=POSTGRES,
+                     SQLALCHEMY_MIGRATION_SCHEMAS=['tenant_a', 'tenant_b'])
+def test_run_for_targets_summary(migrate, tmpdir, monkeypatch, capsys):
+    monkeypatch.setattr(commands, 'migrate', migrate)
+    with pytest.raises(SystemExit) as e:
+        commands.run_for_targets(_fail_on_tenant_b, processes=1,
+                                 log_dir=str(tmpdir))
+    assert e.value.code == '1 of 2 target(s) failed or were skipped.'
+
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0].split()[:2] == ['default/tenant_a', 'ok']
+    assert lines[1].split()[:2] == ['default/tenant_b', 'failed']
+    assert lines[2].split() == ['ValueError:', 'boom']
@@ -0,0 +1,111 @@
+import json
+import pytest
+
+from datetime import datetime, timezone
+from flask_sqlalchemy_bundle import SQLAlchemy
+from flask_sqlalchemy_bundle.meta.model_registry import _model_registry
+
+
+def setup(db: SQLAlchemy):
+    class Author(db.Model):
+        class Meta:
+            serialized_relationships = ('books',)
+
+        name = db.Column(db.String)
+        books = db.relationship('Book', back_populates='author')
+
+        @db.hybrid_property
+        def upper_name(self):
+            return self.name.upper()
+
+    class Book(db.Model):
+        class Meta:
+            created_at = None
+            updated_at = None
+
+        title = db.Column(db.String)
+        author_id = db.foreign_key('Author')
+        author = db.relationship('Author', back_populates='books')
+
+    _model_registry.finalize_mappings()
+    db.create_all()
+
+    return Author, Book
+
+
+class TestModelSerializer:
+    def test_fields(self, db: SQLAlchemy):
+        Author, Book = setup(db)
+
+        assert set(Author.__serializer__.fields) == {
+            'id', 'created_at', 'updated_at', 'name', 'upper_name', 'books'}
+        assert set(Book.__serializer__.fields) == {'id', 'title', 'author_id'}
+
+    def test_to_dict(self, db: SQLAlchemy):
+        Author, Book = setup(db)
+
+        author = Author(name='author')
+        book = Book(title='title', author=author)
+        db.session.add_all([author, book])
+        db.session.commit()
+
+        assert Author.__serializer__.to_dict(author) == {
+            'id': author.id,
+            'created_at': author.created_at,
+            'updated_at': author.updated_at,
+            'name': 'author',
+            'upper_name': 'AUTHOR',
+            'books': [{'id': book.id, 'title': 'title',
+                       'author_id': author.id}],
+        }
+        assert Book.__serializer__.to_dict(book, fields=('title', 'author')) \
+            == {'title': 'title', 'author': {
+                'id': author.id,
+                'created_at': author.created_at,
+                'updated_at': author.updated_at,
+                'name': 'author',
+                'upper_name': 'AUTHOR',
+            }}
+
+    def test_to_dict_readonly(self, db: SQLAlchemy):
+        Author, Book = setup(db)
+
+        author = Author(name='author')
+        db.session.add(author)
+        db.session.commit()
+
+        row = Author.query.as_readonly().one()
+        assert Author.__serializer__.to_dict(row, fields=('id', 'upper_name',
+                                                          'books')) \
+            == {'id': author.id, 'upper_name': 'AUTHOR'}
+
+    def test_unknown_field(self, db: SQLAlchemy):
+        Author, Book = setup(db)
+
+        with pytest.raises(ValueError):
+            Author.__serializer__.to_dict(Author(name='a'), fields=('fail',))
+
+    def test_to_json(self, db: SQLAlchemy):
+        Author, Book = setup(db)
+
+        created_at = datetime(2018, 1, 1, tzinfo=timezone.utc)
+        author = Author(name='author', created_at=created_at)
+        assert Author.__serializer__.to_json(
+            author, fields=('name', 'created_at')) \
+            == b'{"name":"author","created_at":"2018-01-01T00:00:00+00:00"}'
+
+    def test_iter_json(self, db: SQLAlchemy):
+        Author, Book = setup(db)
+
+        db.session.add_all([Author(name=str(i)) for i in range(5)])
+        db.session.commit()
+
+        serializer = Author.__serializer__
+        query = Author.query.order_by(Author.id).as_readonly()
+        chunks = list(serializer.iter_json(query, fields=('name',),
+                                           chunk_size=2))
+        assert len(chunks) == 5
+        assert json.loads(b''.join(chunks).decode()) == [
+            {'name': str(i)} for i in range(5)]
+
+        assert b''.join(serializer.iter_json([])) == b'[]'